@@ -0,0 +1,83 @@
+"""Compare one aligner process per gene with a warm, long-lived aligner process.
+
+    python benchmarks/bench_aligner.py --standin java --genes 200     # stand-in jar, needs javac
+    python benchmarks/bench_aligner.py --standin python --startup 0.5 # no JDK needed
+    python benchmarks/bench_aligner.py --jar scripts/macse_v2.07.jar --genes 50
+
+Each backend aligns the same small genes one after the other in a single worker; the total
+and per-gene wall-clock times are reported.
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+from macse_backend import DRIVER_SOURCE, MACSE_MAIN_CLASS, ProcessAligner, WarmJVMAligner
+
+def write_genes(directory, count, rng, codons=100, species=3):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"combined_GENE{i}.fasta")
+        reference = ''.join(rng.choice('ACGT') for _ in range(codons * 3))
+        with open(path, 'w') as f:
+            for s in range(species):
+                seq = ''.join(rng.choice('ACGT') if rng.random() < 0.05 else c for c in reference)
+                f.write(f">GENE{i}_S{s}\n{seq}\n")
+        paths.append(path)
+    return paths
+
+def build_standin_jar(directory):
+    """Compile StandInAligner.java into an executable jar (requires javac and jar)."""
+    source = os.path.join(directory, 'StandInAligner.java')
+    shutil.copy(os.path.join(benchmarks_path, 'StandInAligner.java'), source)
+    subprocess.run(['javac', '-d', directory, source], check=True)
+    jar_path = os.path.join(directory, 'standin.jar')
+    subprocess.run(['jar', 'cfe', jar_path, 'StandInAligner', '-C', directory, 'StandInAligner.class'], check=True)
+    return jar_path
+
+def backends(args, workdir):
+    if args.standin == 'python':
+        standin = [sys.executable, os.path.join(benchmarks_path, 'standin_aligner.py'), str(args.startup)]
+        return {'process': ProcessAligner(standin + ['cli']), 'warm': WarmJVMAligner(standin + ['driver'])}
+    if args.jar:
+        jar_path, main_class = args.jar, MACSE_MAIN_CLASS
+    else:
+        jar_path, main_class = build_standin_jar(workdir), 'StandInAligner'
+    return {'process': ProcessAligner(['java', '-jar', jar_path]),
+            'warm': WarmJVMAligner(['java', '-cp', jar_path, DRIVER_SOURCE, main_class])}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=100)
+    parser.add_argument('--standin', choices=['java', 'python'], default='java')
+    parser.add_argument('--startup', type=float, default=0.5, help="Simulated startup of the Python stand-in (s).")
+    parser.add_argument('--jar', help="Benchmark this MACSE jar instead of a stand-in.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        genes = write_genes(workdir, args.genes, random.Random(0))
+        for name, aligner in backends(args, workdir).items():
+            start = time.perf_counter()
+            if name == 'warm':
+                aligner.align(['-prog', 'alignSequences', '-seq', genes[0], '-out_NT', genes[0] + '.warmup'])
+                warmup = time.perf_counter() - start
+                start = time.perf_counter()
+            for path in genes:
+                aligner.align(['-prog', 'alignSequences', '-seq', path, '-out_NT', path + f'.{name}.aligned'])
+            elapsed = time.perf_counter() - start
+            aligner.close()
+            missing = [path for path in genes if not os.path.exists(path + f'.{name}.aligned')]
+            if missing:
+                raise SystemExit(f"{name}: {len(missing)} genes were not aligned")
+            extra = f" (+{warmup:.2f} s to start the worker)" if name == 'warm' else ""
+            print(f"{name:>8}: {elapsed:.2f} s for {len(genes)} genes, {1000 * elapsed / len(genes):.1f} ms/gene{extra}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Compare the per-gene xrefs discovery of the original 1list.py with the batched lookup engine.
+
+All engines run against the same stub Ensembl server and gene set; wall-clock time and
+number of HTTP requests are reported for each. With --index, step 1 is also run on a local
+gene index built from GTF dumps, for human only and for every species.
+
+    python benchmarks/bench_discovery.py --genes 3000 --species mouse,rat --latency 0.02
+"""
+import argparse
+import concurrent.futures
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+from stub_ensembl import make_dataset, start_stub_server, write_gtf, CHROMOSOME_LENGTHS
+from gene_index import GeneIndex, build_index
+
+def legacy_discovery(client, species_list):
+    """Original algorithm: one xrefs GET per gene per species, issued while holding a global lock."""
+    lock = threading.Lock()
+
+    def fetch_chromosome(chromosome, chrom_length):
+        common_genes = []
+        start, end = 1, 5000000
+        while start < chrom_length:
+            genes = client.get_json(f"/overlap/region/human/{chromosome}:{start}-{end}", params={"feature": "gene"})
+            for gene in genes or []:
+                with lock:
+                    if gene.get('biotype') == 'protein_coding' and 'external_name' in gene:
+                        if all(client.get_json(f"/xrefs/symbol/{sp}/{gene['external_name']}") for sp in species_list):
+                            common_genes.append(gene['external_name'])
+            start, end = end + 1, min(end + 5000000, chrom_length)
+        return common_genes
+
+    found = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(fetch_chromosome, c, l) for c, l in CHROMOSOME_LENGTHS.items()]
+        for future in concurrent.futures.as_completed(futures):
+            found.extend(future.result())
+    return sorted(set(found))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=2000)
+    parser.add_argument('--species', default='mouse')
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added to every stub response.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--index', action='store_true', help="Also run discovery on a local gene index.")
+    args = parser.parse_args()
+    species_list = args.species.split(',')
+
+    dataset = make_dataset(args.genes, species_list)
+    server, state, url = start_stub_server(dataset, args.latency)
+    os.environ['ENSEMBL_SERVER'] = url
+    os.environ['ENSEMBL_CONCURRENCY'] = str(args.concurrency)
+    os.environ['ENSEMBL_CACHE'] = 'off'  # Every engine must reach the stub, not replay the previous one
+    list_module = importlib.import_module('1list')
+    regions = list_module.chromosome_regions(CHROMOSOME_LENGTHS)
+
+    results = {}
+    if not args.skip_legacy:
+        before, start = state.total_requests(), time.perf_counter()
+        results['legacy'] = (legacy_discovery(list_module.client, species_list),
+                             time.perf_counter() - start, state.total_requests() - before)
+
+    before, start = state.total_requests(), time.perf_counter()
+    results['batched'] = (list_module.discover_common_genes(species_list, regions),
+                          time.perf_counter() - start, state.total_requests() - before)
+    if args.index:
+        with tempfile.TemporaryDirectory(prefix='bench_index_') as directory:
+            index = GeneIndex(os.path.join(directory, 'gene_index.sqlite'))
+            for species in ['human'] + species_list:
+                write_gtf(dataset, os.path.join(directory, f'{species}.gtf'), species)
+            start = time.perf_counter()
+            build_index(index, 'human', os.path.join(directory, 'human.gtf'))
+            print(f"\nHuman index built in {time.perf_counter() - start:.2f} s")
+            before, start = state.total_requests(), time.perf_counter()
+            results['index'] = (list_module.discover_from_index(species_list, index),
+                                time.perf_counter() - start, state.total_requests() - before)
+            for species in species_list:
+                build_index(index, species, os.path.join(directory, f'{species}.gtf'))
+            before, start = state.total_requests(), time.perf_counter()
+            results['index-all'] = (list_module.discover_from_index(species_list, index),
+                                    time.perf_counter() - start, state.total_requests() - before)
+    print()
+    server.shutdown()
+
+    for name, (genes, seconds, requests_sent) in results.items():
+        print(f"{name:>8}: {len(genes)} genes, {seconds:.2f} s, {requests_sent} requests")
+    if any(genes != results['batched'][0] for genes, _, _ in results.values()):
+        print("WARNING: the engines returned different gene sets")
+
+if __name__ == "__main__":
+    main()
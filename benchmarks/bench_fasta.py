@@ -0,0 +1,151 @@
+"""Compare the FASTA readers used by steps 3 to 5 before fasta.py with the memory-mapped reader.
+
+Random gapped alignments are written for every combination of length (in bases per sequence)
+and number of sequences, then read by each reader in a fresh process. Parse throughput is
+reported in MB/s of file, with the peak of Python allocations (tracemalloc) and the growth of
+the process's peak resident memory, which also counts the pages of the mapped file. All readers
+must return the same sequences.
+
+    python benchmarks/bench_fasta.py --lengths 1000000,5000000 --sequences 6,12
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+from fasta import FastaWriter, UPPER, deleted_except, read_fasta
+
+invalid_characters = re.compile(r"[^ACDEFGHIKLMNPQRSTVWY-]")
+
+def legacy_mos_reader(file_path):
+    """Original reader of 4qualityMOS.py: one regex substitution and one string per line."""
+    sequences = []
+    with open(file_path, "r") as file:
+        current_sequence = []
+        sequence_id = ""
+        for line in file:
+            if line.startswith(">"):
+                if current_sequence:
+                    sequences.append((sequence_id, "".join(current_sequence)))
+                current_sequence = []
+                sequence_id = line.strip()[1:]
+            else:
+                cleaned_line = invalid_characters.sub("", line)
+                if cleaned_line:
+                    current_sequence.append(cleaned_line)
+        if current_sequence:
+            sequences.append((sequence_id, "".join(current_sequence)))
+    return [sequence for _, sequence in sequences]
+
+def legacy_kaks_reader(file_path):
+    """Original reader of 5kaks.py: every line stripped and upper-cased."""
+    sequences = []
+    with open(file_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith(">"):
+                sequences.append([])
+            elif line and sequences:
+                sequences[-1].append(line.upper())
+    return ["".join(parts) for parts in sequences]
+
+def seqio_reader(file_path):
+    """Biopython, as the original step 3 loaded whole files."""
+    from Bio import SeqIO
+    return [str(record.seq) for record in SeqIO.parse(file_path, 'fasta')]
+
+def mos_reader(file_path):
+    delete = deleted_except(b"ACDEFGHIKLMNPQRSTVWY-")
+    return [sequence for _, sequence in read_fasta(file_path, delete=delete) if sequence]
+
+def kaks_reader(file_path):
+    return [sequence for _, sequence in read_fasta(file_path, table=UPPER)]
+
+def lazy_reader(file_path):
+    """Records consumed one at a time without being kept, as a streaming consumer would."""
+    return sum(len(sequence) for _, sequence in read_fasta(file_path))
+
+READERS = {'legacy 4qualityMOS': legacy_mos_reader, 'legacy 5kaks': legacy_kaks_reader, 'Bio.SeqIO': seqio_reader,
+           'fasta.py MOS filter': mos_reader, 'fasta.py upper case': kaks_reader, 'fasta.py lazy': lazy_reader}
+
+def write_alignment(path, length, num_sequences, rng):
+    """Mutated copies of a random sequence with 5% gaps, in lines of 60 characters."""
+    alphabet = np.frombuffer(b'ACGT-', dtype=np.uint8)
+    reference = alphabet[rng.choice(5, size=length, p=[0.2375] * 4 + [0.05])]
+    with FastaWriter(path) as writer:
+        for index in range(num_sequences):
+            sequence = reference.copy()
+            mutated = rng.random(length) < 0.1
+            sequence[mutated] = alphabet[rng.integers(0, 4, size=mutated.sum())]
+            writer.write(f'GENE_Species{index}_T{index}', sequence.tobytes())
+
+def memory_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+def measure(reader, path, repeat, queue):
+    """Run in a fresh process: best time of `repeat` reads, peak allocations and peak RSS growth."""
+    rss_before = memory_kb('VmRSS')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = reader(path)
+        times.append(time.perf_counter() - start)
+        del result
+    peak_rss = memory_kb('VmHWM') - rss_before
+    tracemalloc.start()
+    result = reader(path)
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    queue.put((min(times), heap_peak, peak_rss, result if isinstance(result, list) else None))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', default='1000000,5000000', help="Bases per sequence.")
+    parser.add_argument('--sequences', default='6,12')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+    try:
+        import Bio  # noqa: F401
+    except ImportError:
+        del READERS['Bio.SeqIO']
+    context = multiprocessing.get_context('fork')
+
+    print(f"{'length':>9} {'seqs':>5} {'file MB':>8} {'reader':>20} {'seconds':>8} {'MB/s':>8} {'heap MB':>8} "
+          f"{'RSS MB':>7}  same")
+    with tempfile.TemporaryDirectory(prefix='bench_fasta_') as directory:
+        for length in map(int, args.lengths.split(',')):
+            for num_sequences in map(int, args.sequences.split(',')):
+                path = os.path.join(directory, f'alignment_{length}_{num_sequences}.fasta')
+                write_alignment(path, length, num_sequences, rng)
+                size_mb = os.path.getsize(path) / 1e6
+                expected = None
+                for name, reader in READERS.items():
+                    queue = context.Queue()
+                    process = context.Process(target=measure, args=(reader, path, args.repeat, queue))
+                    process.start()
+                    seconds, heap_peak, peak_rss, sequences = queue.get()
+                    process.join()
+                    if sequences is not None:
+                        sequences = [s.decode() if isinstance(s, bytes) else s for s in sequences]
+                    if expected is None:
+                        expected = sequences
+                    same = '' if sequences is None else sequences == expected
+                    print(f"{length:>9} {num_sequences:>5} {size_mb:>8.1f} {name:>20} {seconds:>8.3f} "
+                          f"{size_mb / seconds:>8.1f} {heap_peak / 1e6:>8.1f} {peak_rss / 1024:>7.1f}  {same}")
+                os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare the serial per-gene CDS fetching of the original 2CDS_fetcher.py with the batched pipeline.
+
+Both engines download the same genes x species from the stub Ensembl server into separate
+directories; wall-clock time, request count and throughput are reported, and the two
+output trees are checked to be identical.
+
+    python benchmarks/bench_fetch.py --genes 2000 --species human,mouse,rat --latency 0.02
+"""
+import argparse
+import filecmp
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+from stub_ensembl import make_dataset, start_stub_server
+
+def legacy_fetch(client, fetcher, symbols, species_list, output_dir):
+    """Original algorithm: one symbol lookup and one sequence request per gene and species, in sequence."""
+    written = 0
+    for symbol in symbols:
+        for species in species_list:
+            data = client.post_json(f"/lookup/symbol/{species}", {'symbols': [symbol]})
+            if data and symbol in data:
+                transcript_id = data[symbol]['canonical_transcript'].split('.')[0]
+                cds = client.get_json(f"/sequence/id/{transcript_id}", params={'type': 'cds'})
+                if cds:
+                    fetcher.write_cds_sequence(output_dir, symbol, species, transcript_id, cds['seq'])
+                    written += 1
+    return written
+
+def same_tree(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.diff_files or comparison.funny_files:
+        return False
+    return all(same_tree(os.path.join(left, d), os.path.join(right, d)) for d in comparison.common_dirs)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=500)
+    parser.add_argument('--species', default='human,mouse,rat')
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added to every stub response.")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Stub requests per second before answering 429.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--client-rate', type=float, default=0, help="Client-side requests per second (0: unlimited).")
+    args = parser.parse_args()
+    species_list = args.species.split(',')
+
+    dataset = make_dataset(args.genes, [s for s in species_list if s.lower() != 'human'])
+    server, state, url = start_stub_server(dataset, args.latency, rate_limit=args.rate_limit)
+    os.environ.update(ENSEMBL_SERVER=url, ENSEMBL_CONCURRENCY=str(args.concurrency),
+                      ENSEMBL_RATE=str(args.client_rate), ENSEMBL_CACHE='off')
+    fetcher = importlib.import_module('2CDS_fetcher')
+    symbols = [gene['external_name'] for gene in dataset['genes']]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {}
+        for name in ('legacy', 'batched'):
+            output_dir = os.path.join(workdir, name)
+            before, start = state.total_requests(), time.perf_counter()
+            if name == 'legacy':
+                written = legacy_fetch(fetcher.client, fetcher, symbols, species_list, output_dir)
+            else:
+                written = fetcher.fetch_all_cds(symbols, species_list, output_dir)
+            results[name] = (written, time.perf_counter() - start, state.total_requests() - before)
+        identical = same_tree(os.path.join(workdir, 'legacy'), os.path.join(workdir, 'batched'))
+    server.shutdown()
+
+    pairs = len(symbols) * len(species_list)
+    for name, (written, seconds, requests_sent) in results.items():
+        print(f"{name:>8}: {written} CDS written, {seconds:.2f} s, {requests_sent} requests, "
+              f"{pairs / seconds:.0f} gene-species pairs/s")
+    print(f" speedup: {results['legacy'][1] / results['batched'][1]:.1f}x; identical output: {identical}")
+    if state.counts.get('429'):
+        print(f"     429: {state.counts['429']} rate-limited answers from the stub")
+
+if __name__ == "__main__":
+    main()
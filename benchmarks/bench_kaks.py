@@ -0,0 +1,92 @@
+"""Benchmark the Python Ka/Ks engine of step 5 (scripts/kaks.py and scripts/5kaks.py).
+
+Writes synthetic human/mouse/rat codon alignments (substitutions and codon gaps) to a temporary
+directory, checks the vectorized engine against the codon-by-codon reference on a sample, and
+times step 5's per-alignment function over all of them with a process pool.
+
+    python benchmarks/bench_kaks.py --alignments 20000 --workers 8
+"""
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+import kaks
+
+SPECIES = ['Human', 'Mouse', 'Rat']
+SENSE_CODONS = np.array([codon for codon in kaks.CODONS if kaks.GENETIC_CODE[codon] != '*'])
+
+def synthetic_alignment(rng, n_codons, divergence=0.1, gap_rate=0.02):
+    """Human CDS plus mutated copies; every substituted codon is a random sense codon, and a few
+    codons of each copy are replaced by gaps."""
+    human = rng.choice(SENSE_CODONS, n_codons)
+    sequences = [human]
+    for _ in SPECIES[1:]:
+        copy = np.where(rng.random(n_codons) < divergence, rng.choice(SENSE_CODONS, n_codons), human)
+        sequences.append(np.where(rng.random(n_codons) < gap_rate, '---', copy))
+    return [''.join(sequence) for sequence in sequences]
+
+def write_alignments(directory, count, seed, min_codons, max_codons):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(count):
+        sequences = synthetic_alignment(rng, int(rng.integers(min_codons, max_codons)))
+        path = os.path.join(directory, f'alignment_GENE{index}.fasta')
+        with open(path, 'w') as f:
+            for species, sequence in zip(SPECIES, sequences):
+                f.write(f'>GENE{index}_{species}_{species.upper()}T{index}\n')
+                f.write('\n'.join(sequence[i:i + 60] for i in range(0, len(sequence), 60)) + '\n')
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--alignments', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--check', type=int, default=200, help="Alignments compared with the reference engine.")
+    parser.add_argument('--min-codons', type=int, default=100)
+    parser.add_argument('--max-codons', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    step = importlib.import_module('5kaks')
+
+    with tempfile.TemporaryDirectory(prefix='bench_kaks_') as directory:
+        start = time.perf_counter()
+        paths = write_alignments(directory, args.alignments, args.seed, args.min_codons, args.max_codons)
+        print(f"Wrote {len(paths)} alignments in {time.perf_counter() - start:.1f} s")
+
+        worst, reference_time, vector_time = 0.0, 0.0, 0.0
+        for path in paths[:args.check]:
+            _, sequences = step.read_alignment(path)
+            start = time.perf_counter()
+            ka, ks = kaks.kaks_matrices(sequences)
+            vector_time += time.perf_counter() - start
+            codons = kaks.codon_matrix(sequences)  # Same gap removal as the vectorized engine
+            aligned = [''.join(kaks.CODONS[c] for c in row) for row in codons]
+            start = time.perf_counter()
+            for j in range(1, len(sequences)):
+                reference = kaks.kaks_pair_reference(aligned[0], aligned[j])
+                worst = max(worst, abs(reference[0] - ka[0, j]), abs(reference[1] - ks[0, j]))
+            reference_time += time.perf_counter() - start
+        if args.check:
+            print(f"Reference vs vectorized on {min(args.check, len(paths))} alignments: {reference_time:.2f} s vs "
+                  f"{vector_time:.2f} s ({reference_time / vector_time:.0f}x), max difference {worst:.2e}")
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = dict(executor.map(step.gene_kaks, paths, chunksize=64))
+        elapsed = time.perf_counter() - start
+        ratios = [value for gene_results in results.values() for value in gene_results.values()]
+        print(f"Step 5 on {len(paths)} alignments with {args.workers} workers: {elapsed:.1f} s "
+              f"({len(paths) / elapsed:.0f} alignments/s), median Ka/Ks {np.median(ratios):.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Compare the pure-Python and NumPy multiple overlap score (MOS) engines of 4qualityMOS.py.
+
+Random gapped alignments are generated for every combination of length and number of
+sequences; both engines must return exactly the same score.
+
+    python benchmarks/bench_mos.py --lengths 1000,10000,100000 --sequences 3,6,12
+"""
+import argparse
+import importlib
+import os
+import random
+import sys
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+
+def random_alignment(length, num_sequences, rng, divergence=0.1, gap_rate=0.05):
+    """Mutated copies of a random nucleotide sequence, with gap runs, as bytes like step 4 reads them."""
+    reference = [rng.choice('ACGT') for _ in range(length)]
+    alignment = []
+    for _ in range(num_sequences):
+        seq = [rng.choice('ACGT') if rng.random() < divergence else c for c in reference]
+        position = 0
+        while position < length:
+            if rng.random() < gap_rate / 10:
+                run = rng.randint(1, 30)
+                seq[position:position + run] = '-' * len(seq[position:position + run])
+                position += run
+            position += 1
+        alignment.append(''.join(seq).encode())
+    return alignment
+
+def timed(function, *args, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', default='1000,10000,100000')
+    parser.add_argument('--sequences', default='3,6,12')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    mos = importlib.import_module('4qualityMOS')
+    rng = random.Random(args.seed)
+
+    print(f"{'length':>8} {'seqs':>5} {'python s':>10} {'numpy s':>10} {'speedup':>8}  equal")
+    for length in map(int, args.lengths.split(',')):
+        for num_sequences in map(int, args.sequences.split(',')):
+            alignment = random_alignment(length, num_sequences, rng)
+            loop_score, loop_time = timed(mos.multiple_overlap_score, alignment)
+            numpy_score, numpy_time = timed(mos.multiple_overlap_score_numpy, alignment, repeat=3)
+            print(f"{length:>8} {num_sequences:>5} {loop_time:>10.4f} {numpy_time:>10.4f} "
+                  f"{loop_time / numpy_time:>7.1f}x  {loop_score == numpy_score}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Benchmark the step 5 results store (scripts/results_store.py).
+
+Records random Ka/Ks results gene by gene, as step 5 does, then times the SQL summary and the
+optional Excel rendering of the whole table.
+
+    python benchmarks/bench_results_store.py --genes 20000 --species 10
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+from results_store import ResultsStore
+from xlsx import write_xlsx
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=20000)
+    parser.add_argument('--species', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    pairs = [f"HUMAN-Species{index}" for index in range(args.species)]
+
+    with tempfile.TemporaryDirectory(prefix='bench_results_') as directory:
+        store = ResultsStore(os.path.join(directory, 'kaks.sqlite'))
+        start = time.perf_counter()
+        for index in range(args.genes):
+            results = {}
+            for pair in pairs:
+                ka, ks = rng.uniform(0, 0.5), rng.uniform(0.01, 2)
+                results[pair] = (ka, ks, round(ka / ks, 3))
+            store.record_gene(f"alignment_GENE{index}", '112', results)
+        print(f"Recorded {args.genes} genes x {args.species} species pairs one gene at a time: "
+              f"{time.perf_counter() - start:.2f} s")
+
+        start = time.perf_counter()
+        summary = store.summary('112')
+        print(f"SQL summary of {len(summary)} species pairs: {time.perf_counter() - start:.3f} s")
+
+        start = time.perf_counter()
+        columns, rows = store.wide_table('112')
+        write_xlsx(os.path.join(directory, 'output_results.xlsx'), columns, rows)
+        print(f"Excel rendering of {len(rows)} rows: {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Simulate the makespan of the alignment step under the original and the adaptive scheduling.
+
+original: 8 workers whatever the node, genes in os.listdir (arbitrary) order.
+adaptive: workers sized from the node's cores and memory, longest genes first.
+
+Gene sizes come from a real "Fetched CDS sequences for ..." directory (--cds-dir) or from a
+synthetic log-normal distribution; alignment time is modelled as a * size**b seconds and
+slows down proportionally when workers outnumber cores.
+
+    python benchmarks/bench_schedule.py --genes 20000 --cores 4 --memory-gb 16
+    python benchmarks/bench_schedule.py --cds-dir "results/Fetched CDS sequences for Human_Mouse" --cores 64
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+from scheduling import JVM_OVERHEAD_MB, MEMORY_FRACTION, gene_size
+
+def makespan(durations, workers, cores):
+    """Greedy list scheduling: each gene goes to the first idle worker, in the given order."""
+    slowdown = max(1.0, workers / cores)
+    finish_times = [0.0] * workers
+    for duration in durations:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + duration * slowdown)
+    return max(finish_times)
+
+def synthetic_sizes(count, species, rng):
+    # Human CDS lengths are roughly log-normal (median ~1.3 kb) with a long tail (TTN ~100 kb).
+    return [species * min(110000, int(rng.lognormvariate(7.2, 0.75))) for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=20000)
+    parser.add_argument('--species', type=int, default=3)
+    parser.add_argument('--cds-dir', help="Use the gene sizes of an existing CDS directory.")
+    parser.add_argument('--cores', type=int, default=8)
+    parser.add_argument('--memory-gb', type=float, default=32)
+    parser.add_argument('--heap-mb', type=int, default=2048)
+    parser.add_argument('--seconds-per-kb', type=float, default=2.0, help="Alignment time of a 1 kb gene.")
+    parser.add_argument('--exponent', type=float, default=1.6, help="Growth of alignment time with size.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.cds_dir:
+        sizes = [gene_size(entry.path) for entry in os.scandir(args.cds_dir) if entry.is_dir()]
+    else:
+        sizes = synthetic_sizes(args.genes, args.species, rng)
+    durations = [args.seconds_per_kb * (size / 1024) ** args.exponent for size in sizes]
+    arbitrary = durations[:]
+    rng.shuffle(arbitrary)
+
+    memory_mb = args.memory_gb * 1024
+    per_worker_mb = args.heap_mb + JVM_OVERHEAD_MB
+    adaptive_workers = max(1, min(args.cores, int(memory_mb * MEMORY_FRACTION) // per_worker_mb))
+    schemes = [
+        ("original (8 workers, arbitrary order)", 8, arbitrary),
+        (f"original order, {adaptive_workers} workers", adaptive_workers, arbitrary),
+        (f"adaptive ({adaptive_workers} workers, longest first)", adaptive_workers, sorted(durations, reverse=True)),
+    ]
+    lower_bound = max(sum(durations) / adaptive_workers, max(durations))
+    print(f"{len(durations)} genes, {args.cores} cores, {args.memory_gb:g} GB, {args.heap_mb} MB heap per JVM")
+    for name, workers, order in schemes:
+        hours = makespan(order, workers, args.cores) / 3600
+        memory_note = " (exceeds memory)" if workers * per_worker_mb > memory_mb else ""
+        print(f"{name:>42}: makespan {hours:8.2f} h{memory_note}")
+    print(f"{'lower bound':>42}: makespan {lower_bound / 3600:8.2f} h")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Time steps 1 to 4 end to end on a synthetic genome served by the stub Ensembl server.
+
+A synthetic gene set is generated for the requested number of genes, CDS lengths and species,
+then every stage runs on it in a temporary directory: discovery (step 1), CDS fetching
+(step 2), combining the CDS of each gene and aligning them with a stand-in aligner (step 3),
+and MOS (step 4). Times, item counts and stub requests of every stage are written to a JSON
+file, which benchmarks/compare_results.py compares between commits.
+
+    python benchmarks/bench_suite.py --genes 2000 --species mouse,rat --latency 0.02
+    python benchmarks/bench_suite.py --genes 500 --species 6 --min-codons 300 --max-codons 3000 --rate-limit 40
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+repository_path = os.path.abspath(os.path.join(benchmarks_path, '..'))
+sys.path.insert(0, os.path.join(repository_path, 'scripts'))
+from stub_ensembl import CHROMOSOME_LENGTHS, make_dataset, start_stub_server
+
+def git_commit():
+    """Short hash of the checked-out commit, with "-dirty" if the tree has local changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository_path, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository_path,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def species_names(value):
+    """Species given by name ("mouse,rat") or by number ("6": species1 ... species6)."""
+    if value.isdigit():
+        return [f"species{index}" for index in range(1, int(value) + 1)]
+    return [species.strip().lower() for species in value.split(',')]
+
+class Stages:
+    """Wall-clock time, items processed and stub requests of each stage."""
+
+    def __init__(self, state):
+        self.state = state
+        self.results = {}
+
+    def run(self, name, function, *args):
+        """Run one stage; `function` returns (result, number of items processed)."""
+        requests_before = self.state.total_requests()
+        limited_before = self.state.counts.get('429', 0)
+        start = time.perf_counter()
+        result, items = function(*args)
+        seconds = time.perf_counter() - start
+        self.results[name] = {'seconds': round(seconds, 4), 'items': items,
+                              'items_per_second': round(items / seconds, 2) if seconds else None,
+                              'requests': self.state.total_requests() - requests_before,
+                              'rate_limited': self.state.counts.get('429', 0) - limited_before}
+        print(f"{name:>10}: {items:>7} items, {seconds:8.2f} s, {self.results[name]['requests']:>6} requests")
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=1000, help="Number of synthetic human genes.")
+    parser.add_argument('--species', default='mouse,rat', help="Other species, by name or as a number.")
+    parser.add_argument('--min-codons', type=int, default=100)
+    parser.add_argument('--max-codons', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added to every stub response.")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Stub requests per second before answering 429.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--client-rate', type=float, default=0, help="Client-side requests per second (0: unlimited).")
+    parser.add_argument('--workers', type=int, default=4, help="Parallel stand-in aligners and MOS processes.")
+    parser.add_argument('--aligner-startup', type=float, default=0.5, help="Start-up time of each stand-in aligner (s).")
+    parser.add_argument('--output', help="Results file (default: bench_results_<commit>.json).")
+    args = parser.parse_args()
+    species_list = species_names(args.species)
+
+    dataset = make_dataset(args.genes, species_list, seed=args.seed, min_codons=args.min_codons,
+                           max_codons=args.max_codons)
+    server, state, url = start_stub_server(dataset, args.latency, rate_limit=args.rate_limit)
+    with tempfile.TemporaryDirectory(prefix='bench_suite_') as workdir:
+        os.environ.update(ENSEMBL_SERVER=url, ENSEMBL_CONCURRENCY=str(args.concurrency),
+                          ENSEMBL_RATE=str(args.client_rate), ENSEMBL_CACHE='off',
+                          TELEMETRY=os.path.join(workdir, 'telemetry'))
+        list_step = importlib.import_module('1list')
+        fetch_step = importlib.import_module('2CDS_fetcher')
+        align_step = importlib.import_module('3align')
+        qc_step = importlib.import_module('4qualityMOS')
+        # Imported once the environment is set: these modules read their settings at import time
+        from cds_store import CDS_STORE, gene_records, list_gene_dirs
+        from macse_backend import WarmJVMAligner
+        stages = Stages(state)
+        print(f"{args.genes} genes in human and {len(species_list)} species, {args.min_codons}-{args.max_codons} "
+              f"codons, stub latency {args.latency} s, CDS stored as {CDS_STORE}, commit {git_commit()}")
+
+        # Step 1: human genes from chromosome regions, kept if found in every species
+        def discovery():
+            symbols = list_step.discover_common_genes(species_list, list_step.chromosome_regions(CHROMOSOME_LENGTHS))
+            print()
+            return symbols, len(symbols)
+        symbols = stages.run('discovery', discovery)
+
+        # Step 2: canonical CDS of every gene in every species
+        cds_dir = os.path.join(workdir, 'cds')
+        fetch_species = ['Human'] + [species.title() for species in species_list]
+        stages.run('fetch', lambda: (None, fetch_step.fetch_all_cds(symbols, fetch_species, cds_dir)))
+
+        # Step 3: combined MACSE input of every gene, then the stand-in aligner
+        combined_dir = os.path.join(workdir, 'combined')
+        os.makedirs(combined_dir)
+
+        def combine():
+            paths = []
+            for gene_dir in sorted(list_gene_dirs(cds_dir)):
+                paths.append(os.path.join(combined_dir, f'combined_{os.path.basename(gene_dir)}.fasta'))
+                align_step.write_combined_fasta(gene_records(gene_dir), paths[-1])
+            return paths, len(paths)
+        combined = stages.run('combine', combine)
+
+        alignments_dir = os.path.join(workdir, 'alignments')
+        os.makedirs(alignments_dir)
+        standin = [sys.executable, os.path.join(benchmarks_path, 'standin_aligner.py'), str(args.aligner_startup),
+                   'driver']
+        aligners, local = [], threading.local()
+
+        def align_one(path):
+            # One warm stand-in per thread, as step 3 keeps one warm JVM per worker process
+            if not hasattr(local, 'aligner'):
+                local.aligner = WarmJVMAligner(standin)
+                aligners.append(local.aligner)
+            output = os.path.join(alignments_dir, 'alignment_' + os.path.basename(path)[len('combined_'):])
+            local.aligner.align(['-prog', 'alignSequences', '-seq', path, '-out_NT', output])
+            return output
+
+        def align():
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                outputs = list(executor.map(align_one, combined))
+            for aligner in aligners:
+                aligner.close()
+            return outputs, len(outputs)
+        alignments = stages.run('align', align)
+
+        # Step 4: MOS of every alignment
+        def mos():
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                rows = [row for row in executor.map(qc_step.qc_alignment, alignments, chunksize=16) if row]
+            return rows, len(rows)
+        stages.run('mos', mos)
+    server.shutdown()
+
+    results = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'parameters': dict({key: value for key, value in vars(args).items() if key != 'output'},
+                           cds_store=os.environ.get('CDS_STORE', 'files')),
+        'stages': stages.results,
+        'total_seconds': round(sum(stage['seconds'] for stage in stages.results.values()), 4),
+    }
+    output = args.output or f"bench_results_{results['commit']}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"     total: {results['total_seconds']:.2f} s; results written to {output}")
+
+if __name__ == "__main__":
+    main()
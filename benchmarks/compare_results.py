@@ -0,0 +1,57 @@
+"""Compare two results files of benchmarks/bench_suite.py, e.g. before and after a change.
+
+    python benchmarks/compare_results.py bench_results_4e86129.json bench_results_b0e3bb0.json --threshold 0.1
+
+Prints the time of every stage in both runs and their ratio. Exits with status 1 if a stage is
+slower than the baseline by more than the threshold (a fraction), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1, help="Slowdown reported as a regression (0.1: 10%%).")
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help="Stages faster than this in both runs are never reported as regressions.")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['commit']} ({baseline['date']}), candidate {candidate['commit']} ({candidate['date']})")
+    changed = {key: (value, candidate['parameters'].get(key)) for key, value in baseline['parameters'].items()
+               if candidate['parameters'].get(key) != value}
+    if changed:
+        print("WARNING: the runs used different parameters: " +
+              ', '.join(f"{key} {old} -> {new}" for key, (old, new) in changed.items()))
+    if baseline['host'] != candidate['host']:
+        print("WARNING: the runs were made on different hosts or Python versions")
+
+    regressions = []
+    print(f"{'stage':>10} {'baseline s':>11} {'candidate s':>12} {'ratio':>7} {'items':>13} {'requests':>15}")
+    for name, old in baseline['stages'].items():
+        new = candidate['stages'].get(name)
+        if new is None:
+            print(f"{name:>10} {old['seconds']:>11.2f} {'missing':>12}")
+            continue
+        ratio = new['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+        flag = ''
+        if ratio > 1 + args.threshold and max(old['seconds'], new['seconds']) >= args.min_seconds:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        items = f"{old['items']}" + (f"->{new['items']}" if new['items'] != old['items'] else '')
+        requests_sent = f"{old['requests']}" + (f"->{new['requests']}" if new['requests'] != old['requests'] else '')
+        print(f"{name:>10} {old['seconds']:>11.2f} {new['seconds']:>12.2f} {ratio:>6.2f}x {items:>13} "
+              f"{requests_sent:>15}{flag}")
+    print(f"{'total':>10} {baseline['total_seconds']:>11.2f} {candidate['total_seconds']:>12.2f} "
+          f"{candidate['total_seconds'] / baseline['total_seconds']:>6.2f}x")
+    if regressions:
+        print(f"Stages slower by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Stand-in for MACSE used when no JDK is available: copies -seq to -out_NT.
+
+    python standin_aligner.py <startup seconds> cli <MACSE arguments>   # like `java -jar macse.jar`
+    python standin_aligner.py <startup seconds> driver                  # like MacseDriver.java
+
+The startup delay models JVM start and JIT warm-up, paid once per process.
+"""
+import shutil
+import sys
+import time
+
+def align(arguments):
+    shutil.copyfile(arguments[arguments.index('-seq') + 1], arguments[arguments.index('-out_NT') + 1])
+
+def main():
+    startup, mode, arguments = float(sys.argv[1]), sys.argv[2], sys.argv[3:]
+    time.sleep(startup)
+    if mode == 'cli':
+        align(arguments)
+        return
+    print("READY", flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        try:
+            align(line.rstrip('\n').split('\t'))
+            print(f"OK\t{int((time.perf_counter() - start) * 1000)}", flush=True)
+        except Exception as e:
+            print(f"ERROR\t{e}", flush=True)
+
+if __name__ == "__main__":
+    main()
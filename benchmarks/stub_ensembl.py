@@ -0,0 +1,279 @@
+"""Local stand-in for the subset of the Ensembl REST API used by the pipeline.
+
+Start it from a benchmark with `start_stub_server(...)`, or from the command line:
+
+    python benchmarks/stub_ensembl.py --genes 2000 --species mouse,rat --latency 0.05
+
+and point the pipeline at it with ENSEMBL_SERVER=http://127.0.0.1:<port>.
+"""
+import argparse
+import functools
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+
+CHROMOSOME_LENGTHS = {
+    '1': 248956422, '2': 242193529, '3': 198295559, '4': 190214555, '5': 181538259,
+    '6': 170805979, '7': 159345973, '8': 145138636, '9': 138394717, '10': 133797422,
+    '11': 135086622, '12': 133275309, '13': 114364328, '14': 107043718, '15': 101991189,
+    '16': 90338345, '17': 83257441, '18': 80373285, '19': 58617616, '20': 64444167,
+    '21': 46709983, '22': 50818468, 'X': 156040895, 'Y': 57227415
+}
+
+def make_dataset(n_genes, species, seed=0, shared_fraction=0.8, coding_fraction=0.7, min_codons=100, max_codons=1500):
+    """Build a synthetic human gene set and decide which genes exist in each other species.
+    CDS lengths are drawn uniformly between min_codons and max_codons."""
+    rng = random.Random(seed)
+    chromosomes = list(CHROMOSOME_LENGTHS)
+    genes = []
+    for i in range(n_genes):
+        chromosome = rng.choice(chromosomes)
+        start = rng.randint(1, CHROMOSOME_LENGTHS[chromosome] - 100000)
+        genes.append({
+            'id': f"ENSG{i:011d}",
+            'external_name': f"GENE{i}",
+            'biotype': 'protein_coding' if rng.random() < coding_fraction else 'lncRNA',
+            'seq_region_name': chromosome,
+            'start': start,
+            'end': start + rng.randint(1000, 90000),
+            'cds_codons': rng.randint(min_codons, max_codons),
+        })
+    presence = {sp.lower(): {g['external_name'] for g in genes if rng.random() < shared_fraction} for sp in species}
+    return {'genes': genes, 'presence': presence, 'seed': seed}
+
+def write_gtf(dataset, path, species='human'):
+    """Write the genes of a species (human: all genes, others: the shared ones) as an Ensembl-style GTF,
+    with one canonical transcript per gene."""
+    presence = None if species.lower() in ('human', 'homo_sapiens') else dataset['presence'][species.lower()]
+    with open(path, 'w') as f:
+        f.write('#!genome-build synthetic\n')
+        for gene in dataset['genes']:
+            if presence is not None and gene['external_name'] not in presence:
+                continue
+            location = f"{gene['seq_region_name']}\tensembl\t{{}}\t{gene['start']}\t{gene['end']}\t.\t+\t.\t"
+            attributes = (f'gene_id "{gene["id"]}"; gene_version "1"; gene_name "{gene["external_name"]}"; '
+                          f'gene_source "ensembl"; gene_biotype "{gene["biotype"]}";')
+            f.write(location.format('gene') + attributes + '\n')
+            f.write(location.format('transcript') + attributes +
+                    f' transcript_id "{StubState.transcript_id(species, gene["external_name"])}"; '
+                    f'transcript_biotype "{gene["biotype"]}"; tag "basic"; tag "Ensembl_canonical";\n')
+
+STOP_CODONS = {'TAA', 'TAG', 'TGA'}
+SENSE_CODONS = [a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT' if a + b + c not in STOP_CODONS]
+
+def human_cds(gene, seed=0):
+    """Deterministic random open reading frame for a synthetic human gene."""
+    rng = random.Random(f"{seed}:{gene['external_name']}")
+    return 'ATG' + ''.join(rng.choice(SENSE_CODONS) for _ in range(gene['cds_codons'] - 2)) + 'TAA'
+
+def species_cds(gene, species, seed=0, divergence=0.08):
+    """Copy of the human CDS with random codon substitutions and occasional codon indels."""
+    human = human_cds(gene, seed)
+    if species.lower() in ('human', 'homo_sapiens'):
+        return human
+    rng = random.Random(f"{seed}:{species.lower()}:{gene['external_name']}")
+    codons = [human[i:i + 3] for i in range(0, len(human), 3)]
+    result = [codons[0]]
+    for codon in codons[1:-1]:
+        draw = rng.random()
+        if draw < divergence:
+            result.append(rng.choice(SENSE_CODONS))
+        elif draw < divergence * 1.05:
+            continue  # Codon deletion
+        elif draw < divergence * 1.1:
+            result.extend([codon, rng.choice(SENSE_CODONS)])  # Codon insertion
+        else:
+            result.append(codon)
+    result.append(codons[-1])
+    return ''.join(result)
+
+class StubState:
+    """Dataset plus request counters shared by all handler threads."""
+
+    def __init__(self, dataset, latency=0.0, rate_limit=0, error_rate=0.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.rate_limit = rate_limit  # Requests per second before answering 429, 0 for unlimited
+        self.error_rate = error_rate  # Fraction of POST requests answered 503, as an overloaded server would
+        self.error_rng = random.Random(dataset.get('seed', 0))
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.by_chromosome = {}
+        self.by_symbol = {}
+        for gene in dataset['genes']:
+            self.by_chromosome.setdefault(gene['seq_region_name'], []).append(gene)
+            self.by_symbol[gene['external_name']] = gene
+
+    def throttle(self):
+        """Return the number of seconds the client must wait, or 0 if the request is allowed."""
+        if not self.rate_limit:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            if self.window_count > self.rate_limit:
+                self.counts['429'] = self.counts.get('429', 0) + 1
+                return max(0.01, 1 - (now - self.window_start))
+            return 0
+
+    def server_error(self):
+        """True if this request should fail with 503."""
+        if not self.error_rate:
+            return False
+        with self.lock:
+            failed = self.error_rng.random() < self.error_rate
+            if failed:
+                self.counts['503'] = self.counts.get('503', 0) + 1
+            return failed
+
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.counts.values())
+
+    def exists(self, species, symbol):
+        if species.lower() in ('human', 'homo_sapiens'):
+            return symbol in self.by_symbol
+        return symbol in self.dataset['presence'].get(species.lower(), ())
+
+    @staticmethod
+    def transcript_id(species, symbol):
+        return f"{species.upper()}T_{symbol}"
+
+    @functools.lru_cache(maxsize=None)
+    def transcript_cds(self, transcript_id):
+        """CDS of a transcript created by transcript_id(), or None if it does not exist."""
+        species, _, symbol = transcript_id.partition('T_')
+        if not self.exists(species, symbol):
+            return None
+        return species_cds(self.by_symbol[symbol], species, self.dataset.get('seed', 0))
+
+    def lookup(self, species, symbol):
+        return {'id': f"{species}:{symbol}", 'display_name': symbol,
+                'canonical_transcript': f"{self.transcript_id(species, symbol)}.1"}
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _rate_limited(self):
+            wait = state.throttle()
+            if wait:
+                self._reply(429, {'error': 'Too many requests'}, {'Retry-After': f"{wait:.3f}"})
+            return bool(wait)
+
+        def do_GET(self):
+            path = unquote(urlparse(self.path).path)
+            time.sleep(state.latency)
+            if self._rate_limited():
+                return
+            if path == '/info/data':
+                state.count('info/data')
+                return self._reply(200, {'releases': [state.dataset.get('release', 112)]})
+            match = re.fullmatch(r'/overlap/region/\w+/(\w+):(\d+)-(\d+)', path)
+            if match:
+                state.count('overlap/region')
+                chromosome, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+                genes = [g for g in state.by_chromosome.get(chromosome, []) if g['start'] <= end and g['end'] >= start]
+                return self._reply(200, genes)
+            match = re.fullmatch(r'/xrefs/symbol/(\w+)/([\w.-]+)', path)
+            if match:
+                state.count('xrefs/symbol')
+                species, symbol = match.groups()
+                found = state.exists(species, symbol)
+                return self._reply(200, [{'id': f"{species}:{symbol}", 'type': 'gene'}] if found else [])
+            match = re.fullmatch(r'/sequence/id/(\w+)', path)
+            if match:
+                state.count('sequence/id')
+                sequence = state.transcript_cds(match.group(1))
+                if sequence is None:
+                    return self._reply(400, {'error': f"ID '{match.group(1)}' not found"})
+                return self._reply(200, {'id': match.group(1), 'query': match.group(1), 'seq': sequence,
+                                         'molecule': 'dna'})
+            state.count('unknown')
+            self._reply(404, {'error': f"Unknown endpoint {path}"})
+
+        def do_POST(self):
+            path = unquote(urlparse(self.path).path)
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            time.sleep(state.latency)
+            if self._rate_limited():
+                return
+            if state.server_error():
+                return self._reply(503, {'error': 'Service unavailable'})
+            match = re.fullmatch(r'/lookup/symbol/(\w+)', path)
+            if match:
+                state.count('lookup/symbol')
+                species = match.group(1)
+                symbols = payload.get('symbols', [])
+                if len(symbols) > 1000:
+                    return self._reply(400, {'error': 'Too many symbols'})
+                return self._reply(200, {s: state.lookup(species, s) for s in symbols if state.exists(species, s)})
+            if path == '/sequence/id':
+                state.count('sequence/id')
+                ids = payload.get('ids', [])
+                if len(ids) > 50:
+                    return self._reply(400, {'error': 'Too many IDs'})
+                records = [(i, state.transcript_cds(i)) for i in ids]
+                return self._reply(200, [{'id': i, 'query': i, 'seq': seq, 'molecule': 'dna'}
+                                         for i, seq in records if seq is not None])
+            state.count('unknown')
+            self._reply(404, {'error': f"Unknown endpoint {path}"})
+
+    return Handler
+
+def start_stub_server(dataset, latency=0.0, port=0, rate_limit=0, error_rate=0.0):
+    """Serve the dataset on 127.0.0.1 in a background thread. Returns (server, state, url)."""
+    state = StubState(dataset, latency, rate_limit, error_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--genes', type=int, default=2000)
+    parser.add_argument('--species', default='mouse')
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requests per second before answering 429.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of POST requests answered 503.")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-codons', type=int, default=100)
+    parser.add_argument('--max-codons', type=int, default=1500)
+    args = parser.parse_args()
+    dataset = make_dataset(args.genes, args.species.split(','), seed=args.seed, min_codons=args.min_codons,
+                           max_codons=args.max_codons)
+    server, state, url = start_stub_server(dataset, args.latency, args.port, args.rate_limit, args.error_rate)
+    print(f"Stub Ensembl server listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Check the Python Ka/Ks engine (scripts/kaks.py) against seqinr's kaks(), used by 5kaks.R.
+
+Writes a fixture set of synthetic alignments (or uses --alignments DIR), computes Ka and Ks of
+every sequence pair with seqinr through Rscript, and compares them with kaks_matrices(). Without R
+on this machine, run the printed R snippet elsewhere and pass its output with --r-table.
+
+--fixture compares kaks_matrices() with the table committed in benchmarks/kaks_fixture, which needs no
+R: small alignments with gaps, frameshift columns ("!"), internal stop codons and saturated pairs
+(reported as 10), with ka, ks, vka and vks. The values committed were computed without R, by a
+per-codon transcription of seqinr's Li (1993) code independent of kaks.py; --write-fixture replaces
+them with seqinr's own output and should be run once where R and seqinr are installed.
+
+    python benchmarks/validate_kaks.py --fixture
+    python benchmarks/validate_kaks.py --fixtures 200
+    python benchmarks/validate_kaks.py --alignments results/1Alignments_Human_Mouse_Rat
+"""
+import argparse
+import csv
+import glob
+import importlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+benchmarks_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchmarks_path, '..', 'scripts'))
+sys.path.insert(0, benchmarks_path)
+os.environ.setdefault('TELEMETRY', 'off')  # Keep benchmark spans out of temp/telemetry
+import kaks
+from bench_kaks import write_alignments
+
+FIXTURE_DIRECTORY = os.path.join(benchmarks_path, 'kaks_fixture')
+FIXTURE_TABLE = os.path.join(FIXTURE_DIRECTORY, 'expected_kaks.tsv')
+
+# Writes one row per file and sequence pair: file, seq1, seq2, ka, ks, vka, vks
+R_SNIPPET = r'''
+library(seqinr)
+args <- commandArgs(trailingOnly = TRUE)
+rows <- list()
+for (path in list.files(args[1], pattern = "\\.fasta$", full.names = TRUE)) {
+  result <- kaks(read.alignment(path, format = "fasta"))
+  ka <- as.matrix(result$ka); ks <- as.matrix(result$ks)
+  vka <- as.matrix(result$vka); vks <- as.matrix(result$vks)
+  for (i in seq_len(nrow(ka))) for (j in seq_len(ncol(ka))) if (i < j)
+    rows[[length(rows) + 1]] <- data.frame(file = basename(path), seq1 = rownames(ka)[i], seq2 = colnames(ka)[j],
+                                           ka = ka[i, j], ks = ks[i, j], vka = vka[i, j], vks = vks[i, j])
+}
+write.table(do.call(rbind, rows), args[2], sep = "\t", quote = FALSE, row.names = FALSE)
+'''
+
+def run_r(alignments_directory, table_path):
+    with tempfile.NamedTemporaryFile('w', suffix='.R', delete=False) as script:
+        script.write(R_SNIPPET)
+    try:
+        subprocess.run(['Rscript', script.name, alignments_directory, table_path], check=True)
+    finally:
+        os.remove(script.name)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--alignments', help="Directory of alignment FASTA files (default: generated fixtures).")
+    parser.add_argument('--fixtures', type=int, default=200, help="Number of fixture alignments to generate.")
+    parser.add_argument('--r-table', help="Output of the R snippet for the same alignments, instead of running R.")
+    parser.add_argument('--fixture', action='store_true',
+                        help="Compare with the committed fixture table (benchmarks/kaks_fixture), without R.")
+    parser.add_argument('--write-fixture', action='store_true',
+                        help="Compute the fixture table with seqinr and save it in benchmarks/kaks_fixture.")
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    step = importlib.import_module('5kaks')
+    if args.write_fixture:
+        run_r(FIXTURE_DIRECTORY, FIXTURE_TABLE)
+        print(f"Wrote {FIXTURE_TABLE}")
+        return
+    if args.fixture:
+        args.alignments, args.r_table = FIXTURE_DIRECTORY, FIXTURE_TABLE
+
+    with tempfile.TemporaryDirectory(prefix='validate_kaks_') as directory:
+        alignments_directory = args.alignments
+        if alignments_directory is None:
+            alignments_directory = os.path.join(directory, 'fixtures')
+            os.makedirs(alignments_directory)
+            write_alignments(alignments_directory, args.fixtures, args.seed, 30, 600)
+        table_path = args.r_table
+        if table_path is None:
+            if shutil.which('Rscript') is None:
+                print("Rscript not found. Run this R code with arguments <alignments directory> <output.tsv> "
+                      "and pass the output with --r-table:\n" + R_SNIPPET)
+                sys.exit(1)
+            table_path = os.path.join(directory, 'r_kaks.tsv')
+            run_r(alignments_directory, table_path)
+
+        with open(table_path, newline='') as f:
+            expected = list(csv.DictReader(f, delimiter='\t'))
+        computed = {}
+        for path in sorted(glob.glob(os.path.join(alignments_directory, '*.fasta'))):
+            names, sequences = step.read_alignment(path)
+            ka, ks = kaks.kaks_matrices(sequences)
+            for i in range(len(names)):
+                for j in range(len(names)):
+                    computed[os.path.basename(path), names[i], names[j]] = (ka[i, j], ks[i, j])
+
+        mismatches = 0
+        for row in expected:
+            ka, ks = computed[row['file'], row['seq1'], row['seq2']]
+            if abs(ka - float(row['ka'])) > args.tolerance or abs(ks - float(row['ks'])) > args.tolerance:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"{row['file']} {row['seq1']} {row['seq2']}: R ka={row['ka']} ks={row['ks']}, "
+                          f"Python ka={ka:.6g} ks={ks:.6g}")
+        print(f"{len(expected) - mismatches}/{len(expected)} pairs match within {args.tolerance}")
+        sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import argparse
 import subprocess
 import sys
 import time
@@ -11,8 +12,10 @@ results_path = os.path.join(os.environ['BASE_PATH'], "results")
 os.environ['RESULTS_PATH'] = results_path
 temp_path = os.path.join(os.environ['BASE_PATH'], "temp")
 os.environ['TEMP_PATH'] = temp_path
+sys.path.insert(0, scripts_path)
+from telemetry import TELEMETRY_RUN, span  # Sets TELEMETRY_RUN, shared by every script of this run
 
-def run_script(script_filename):
+def run_script(script_filename, arguments=()):
     """Runs a specified script using the appropriate interpreter."""
     script_path = os.path.join(scripts_path, script_filename)
     # Check script extension to determine execution method
@@ -21,7 +24,8 @@ def run_script(script_filename):
         for python_cmd in python_cmds:
             try:
                 start_time = time.time()
-                result = subprocess.run([python_cmd, script_path], check=True)
+                with span('script', script=script_filename):
+                    result = subprocess.run([python_cmd, script_path] + list(arguments), check=True)
                 end_time = time.time()
                 elapsed_time = end_time - start_time
                 print(f"Script '{script_filename}' took {elapsed_time:.2f} seconds to execute using {python_cmd}.")
@@ -33,7 +37,8 @@ def run_script(script_filename):
     elif script_filename.endswith('.R'):
         try:
             start_time = time.time()
-            result = subprocess.run(['Rscript', script_path], check=True)
+            with span('script', script=script_filename):
+                result = subprocess.run(['Rscript', script_path], check=True)
             end_time = time.time()
             elapsed_time = end_time - start_time
             print(f"Script '{script_filename}' took {elapsed_time:.2f} seconds to execute using Rscript.")
@@ -51,9 +56,14 @@ def ask_user():
         "4": "4qualityMOS.py",
         "5": "5kaks.R"
     }
+    # Alternative implementations, not part of 'all'
+    alternatives = {
+        "5py": "5kaks.py"
+    }
     print("Select the scripts you want to run:")
     for number, filename in scripts.items():
         print(f"{number}: {filename}")
+    print("5PY: 5kaks.py (Python implementation of step 5, not yet validated against 5kaks.R)")
     print("Enter 'all' to run all scripts.")
     
     choice = input("Enter your choice (e.g., '1, 2' or all): ").strip().lower()
@@ -65,15 +75,42 @@ def ask_user():
             number = number.strip()
             if number in scripts:
                 selected_scripts.append(scripts[number])
+            elif number in alternatives:
+                selected_scripts.append(alternatives[number])
             else:
                 print(f"Invalid selection: {number}")
         return selected_scripts
 
 def main():
     """Main function to manage script execution based on user input."""
-    scripts_to_run = ask_user()
-    for script_filename in scripts_to_run:
-        run_script(script_filename)
+    parser = argparse.ArgumentParser(description="Run the Auto-dN-dS pipeline.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip genes whose outputs are recorded as complete in temp/manifest.sqlite.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Run step 1, then steps 2 to 4 as a pipeline (genes are aligned and checked as "
+                             "soon as their CDS are fetched), then step 5.")
+    parser.add_argument('--python-kaks', action='store_true',
+                        help="With --stream, compute Ka/Ks in the pipeline with 5kaks.py instead of running "
+                             "5kaks.R after it (not yet validated against 5kaks.R).")
+    parser.add_argument('--add-species', metavar='SPECIES',
+                        help="Add species (e.g. 'dog,cat') to the last run: only their CDS are fetched, existing "
+                             "alignments are extended and only the new Ka/Ks pairs are computed.")
+    args = parser.parse_args()
+    if args.resume:
+        os.environ['PIPELINE_RESUME'] = '1'  # Read by the step scripts through manifest.RESUME
+    if args.python_kaks:
+        os.environ['PIPELINE_KAKS'] = 'python'  # Read by pipeline.py
+
+    if args.add_species:
+        run_script("expand_panel.py", [args.add_species])
+    else:
+        if args.stream:
+            scripts_to_run = ["1list.py", "pipeline.py"] + ([] if args.python_kaks else ["5kaks.R"])
+        else:
+            scripts_to_run = ask_user()
+        for script_filename in scripts_to_run:
+            run_script(script_filename)
+    print(f"Timing report of this run: python scripts/telemetry.py --run {TELEMETRY_RUN}")
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,12 @@
-import requests
 import concurrent.futures
 import threading
-from requests.adapters import HTTPAdapter
+import time
 import os
+from ensembl_client import EnsemblClient, EnsemblError
+from gene_index import GENE_INDEX_SOURCE, GeneIndex, build_index
 
 debug_mode = False  # Initialize the debug mode flag as False
+species_input = []  # Species to check for each human gene, set from user input in main()
 
 # Get the directory of the current script
 current_directory = os.path.dirname(os.path.abspath(__file__))
@@ -14,11 +16,6 @@ temp_directory = os.path.join(current_directory, '..', 'temp')
 if not os.path.exists(temp_directory):
     os.makedirs(temp_directory)
 
-# Input prompt to the user for species or debug mode activation
-input_value = input("Please enter the species, separated by commas (e.g., 'mouse,rat') or 'd' for debug mode: ")
-species_input = ["mouse"] if input_value.lower() == 'd' else [species.strip() for species in input_value.split(',')]
-debug_mode = input_value.lower() == 'd'  # Update debug mode based on user input
-
 # Dictionary mapping human chromosomes to their respective lengths in base pairs
 chromosome_lengths = {
     '1': 248956422, '2': 242193529, '3': 198295559, '4': 190214555, '5': 181538259,
@@ -27,81 +24,125 @@ chromosome_lengths = {
     '16': 90338345, '17': 83257441, '18': 80373285, '19': 58617616, '20': 64444167,
     '21': 46709983, '22': 50818468, 'X': 156040895, 'Y': 57227415
 }
+CHUNK_SIZE = 5000000  # Define size of chromosome chunks to process
 
-session = requests.Session()
-session.mount('http://', HTTPAdapter(max_retries=3))
-session.mount('https://', HTTPAdapter(max_retries=3))
+client = EnsemblClient()
 
 successful_retrieval = 0  # Counter for successful gene retrievals
-lock = threading.Lock()  # Lock for thread-safe operations
-
-def safe_request(url):
-    """ Perform a safe HTTP GET request with error handling. """
-    response = session.get(url, timeout=10, headers={"Content-Type": "application/json"})
-    if response.status_code == 200:
-        return response.json()
-    return None
-
-def gene_exists_in_species(gene_symbol, species):
-    """ Check if a given gene symbol exists in a specified species using the Ensembl API. """
-    url = f"https://rest.ensembl.org/xrefs/symbol/{species}/{gene_symbol}?content-type=application/json"
-    response = safe_request(url)
-    return bool(response)
+completed_chunks = 0
+total_chunks = 0
+lock = threading.Lock()  # Lock for thread-safe counter updates
 
 def print_progress_bar():
     """ Update and print the progress bar in the console. """
     bar_length = 50
-    progress_fraction = completed_chunks / total_chunks
+    progress_fraction = completed_chunks / total_chunks if total_chunks else 1
     arrow = '=' * int(round(progress_fraction * bar_length) - 1) + '>'
     spaces = ' ' * (bar_length - len(arrow))
     print(f"\rProgress: [{arrow + spaces}] {int(progress_fraction * 100)}% - Successful retrievals: {successful_retrieval}", end="")
 
-def fetch_genes_from_region(chromosome, chrom_length):
-    """ Fetch genes from a specified region of a chromosome and check if they are common across specified species. """
-    global successful_retrieval, completed_chunks
-    CHUNK_SIZE = 5000000  # Define size of chromosome chunks to process
-    common_genes = []
-    start = 1
-    end = CHUNK_SIZE
-
-    while start < chrom_length:
-        with lock:
-            if debug_mode and successful_retrieval >= 5:
-                return common_genes
-
-        url = f"https://rest.ensembl.org/overlap/region/human/{chromosome}:{start}-{end}?feature=gene;content-type=application/json"
-        genes = safe_request(url)
-        
-        if genes:
-            for gene in genes:
-                with lock:
-                    if debug_mode and successful_retrieval >= 5:
-                        return common_genes
-                    if gene.get('biotype') == 'protein_coding' and 'external_name' in gene:
-                        if all(gene_exists_in_species(gene['external_name'], species) for species in species_input):
-                            print(f"Processing gene: {gene['external_name']}")  # Output the gene being processed
-                            common_genes.append(gene['external_name'])
-                            successful_retrieval += 1
-                            print_progress_bar()
-
-        start, end = end + 1, min(end + CHUNK_SIZE, chrom_length)
-        with lock:
-            completed_chunks += 1
-            print_progress_bar()
-
-    return common_genes
+def chromosome_regions(lengths):
+    """ Split each chromosome into consecutive regions of at most CHUNK_SIZE base pairs. """
+    regions = []
+    for chromosome, chrom_length in lengths.items():
+        start, end = 1, min(CHUNK_SIZE, chrom_length)
+        while start < chrom_length:
+            regions.append((chromosome, start, end))
+            start, end = end + 1, min(end + CHUNK_SIZE, chrom_length)
+    return regions
+
+def fetch_genes_from_region(region):
+    """ Fetch the symbols of the protein-coding genes overlapping a chromosome region. """
+    global completed_chunks
+    chromosome, start, end = region
+    genes = client.get_json(f"/overlap/region/human/{chromosome}:{start}-{end}", params={"feature": "gene"})
+    symbols = [gene['external_name'] for gene in genes or []
+               if gene.get('biotype') == 'protein_coding' and 'external_name' in gene]
+    with lock:
+        completed_chunks += 1
+        print_progress_bar()
+    return symbols
+
+def find_common_genes(symbols, species_list):
+    """ Keep the symbols that resolve in every species, using batched symbol lookups.
+
+    Each species is only queried with the symbols that survived the previous species. Batches
+    that failed are retried once; if they fail again, EnsemblError is raised rather than
+    dropping their genes from the list.
+    """
+    global successful_retrieval
+    common = sorted(set(symbols))
+    for species in species_list:
+        found, failed = client.lookup_symbols(species, common)
+        if failed:
+            retried, failed = client.lookup_symbols(species, failed)
+            found.update(retried)
+        if failed:
+            reason = "offline mode, not in the cache" if client.offline else "Ensembl requests failed"
+            raise EnsemblError(f"Lookup of {len(failed)} symbols in {species} failed ({reason}); "
+                               f"list.txt was not written, run step 1 again")
+        common = [symbol for symbol in common if symbol in found]
+    with lock:
+        successful_retrieval = len(common)
+        print_progress_bar()
+    return common
+
+def discover_common_genes(species_list, regions):
+    """ Collect human protein-coding genes from the given regions and keep those shared with all species. """
+    global total_chunks, completed_chunks, successful_retrieval
+    total_chunks, completed_chunks, successful_retrieval = len(regions), 0, 0
+    candidates = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=client.concurrency) as executor:
+        for symbols in executor.map(fetch_genes_from_region, regions):
+            candidates.extend(symbols)
+    return find_common_genes(candidates, species_list)
+
+def discover_from_index(species_list, index, limit=None):
+    """ Take the human protein-coding genes from the local index and keep those shared with all species.
+
+    Species with their own index are checked with a local join, the others with batched lookups.
+    """
+    global total_chunks, completed_chunks, successful_retrieval
+    total_chunks, completed_chunks, successful_retrieval = 0, 0, 0
+    candidates = index.symbols('human', set(chromosome_lengths))[:limit]
+    remote_species = []
+    for species in species_list:
+        if index.has_species(species):
+            candidates = index.common_symbols(candidates, species)
+        else:
+            remote_species.append(species)
+    return find_common_genes(candidates, remote_species)
 
 def main():
     """ Main function to orchestrate the gene fetching and file writing process. """
-    global total_chunks, completed_chunks
-    total_chunks = sum((length // 5000000 + (length % 5000000 > 0)) for length in chromosome_lengths.values())
-    completed_chunks = 0
-    all_common_genes = []
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = [executor.submit(fetch_genes_from_region, chromosome, length) for chromosome, length in chromosome_lengths.items()]
-        for future in concurrent.futures.as_completed(futures):
-            all_common_genes.extend(future.result())
+    global species_input, debug_mode
+    # Input prompt to the user for species or debug mode activation
+    input_value = input("Please enter the species, separated by commas (e.g., 'mouse,rat') or 'd' for debug mode: ")
+    species_input = ["mouse"] if input_value.lower() == 'd' else [species.strip() for species in input_value.split(',')]
+    debug_mode = input_value.lower() == 'd'  # Update debug mode based on user input
+
+    start_time = time.time()
+    index = GeneIndex()
+    if GENE_INDEX_SOURCE and not index.has_species('human'):
+        build_index(index, 'human', GENE_INDEX_SOURCE)
+    if index.has_species('human'):
+        # Local join on the gene index; the network is only used for species without an index
+        source, count = index.source('human')
+        print(f"Using the local index of {count} human protein-coding genes ({source})")
+        all_common_genes = discover_from_index(species_input, index, 50 if debug_mode else None)
+    else:
+        regions = chromosome_regions(chromosome_lengths)
+        if debug_mode:
+            regions = regions[:1]  # A single region is enough to find a handful of genes
+        all_common_genes = discover_common_genes(species_input, regions)
+    if debug_mode:
+        all_common_genes = all_common_genes[:5]
+    elapsed_time = time.time() - start_time
+    print(f"\nFound {len(all_common_genes)} common genes in {elapsed_time:.2f} seconds.")
+    print(client.summary())
+    if not all_common_genes:
+        # An empty list.txt would make the next steps run on nothing; the previous list is kept
+        raise ValueError(f"No protein-coding gene shared by human and {', '.join(species_input)} was found")
 
     formatted_species_names = "Human, " + ', '.join(species.title() for species in species_input)
     with open(os.path.join(temp_directory, "list.txt"), 'w') as f:
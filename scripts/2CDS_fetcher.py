@@ -1,58 +1,183 @@
-import ensembl_rest
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice, zip_longest
 from tqdm import tqdm
+from ensembl_client import EnsemblClient, LOOKUP_BATCH_SIZE, SEQUENCE_BATCH_SIZE
+from manifest import Manifest, inputs_digest, RESUME
+from cds_store import CDS_STORE, open_store, record_name, store_path
+from fasta import format_record
+from telemetry import emit
 
-def fetch_cds_sequence(symbol, species):
-    """Fetch and save CDS sequence for a given gene symbol and species using the Ensembl REST API."""
-    try:
-        # Retrieve gene data using the symbol from the Ensembl database for the specified species.
-        data = ensembl_rest.symbol_post(species=species, params={'symbols': [symbol]})
-        if symbol in data:
-            # Extract canonical transcript ID and fetch its CDS sequence.
-            canid = data[symbol]['canonical_transcript']
-            canid_fasta = ensembl_rest.sequence_id(canid.split('.')[0], headers={'content-type': 'text/x-fasta'}, params={'type': 'cds'})
-
-            # Split FASTA format into header and sequence components.
-            header, sequence = canid_fasta.split('\n', 1)
-            symbol_dir = os.path.join(output_dir, symbol)
-            os.makedirs(symbol_dir, exist_ok=True)  # Ensure the directory for the symbol exists.
-
-            # Write the CDS sequence to a file.
-            output_file = os.path.join(symbol_dir, f'{symbol}_{species}.fasta')
-            with open(output_file, 'w') as f:
-                f.write(f'>{symbol}_{species}_{canid.split(".")[0]}\n' + sequence)
-
-            return f"CDS sequence fetched for {symbol} in {species}"
-        else:
-            return f"No CDS data found for {symbol} in {species}"
-    except Exception as e:
-        return f"Error processing {symbol}: {e}"
+client = EnsemblClient()
 
 # Setup paths and directories
 base_path = os.path.dirname(os.path.abspath(__file__))
 list_file_path = os.path.join(base_path, '..', 'temp', 'list.txt')
 base_output_dir = os.path.join(base_path, '..', 'results')
 
-# Read species and gene symbols from a file.
-with open(list_file_path, 'r') as f:
-    lines = f.read().splitlines()
-    spc, listSymb = lines[0].split(', '), lines[1:]
-
-# Set up the output directory based on species names.
-output_dir = os.path.join(base_output_dir, f"Fetched CDS sequences for {'_'.join(spc)}")
-os.makedirs(output_dir, exist_ok=True)
-
-# Write the output directory path to a file for potential future use.
-with open(os.path.join(base_path, '..', 'temp', 'alignfolder.txt'), 'w') as f:
-    f.write(f"Fetched CDS sequences for {'_'.join(spc)}")
-
-# Initialize the progress bar for tracking CDS sequence fetching.
-progress_bar = tqdm(total=len(spc) * len(listSymb), desc='Fetching CDS sequences')
-for symbol in listSymb:
-    for species in spc:
-        desc = fetch_cds_sequence(symbol, species)  # Fetch and process each CDS sequence.
-        progress_bar.set_description(desc)  # Update progress bar description with the current task.
-        progress_bar.update(1)  # Increment the progress bar.
-
-progress_bar.close()
-print("Finished!")  # Signal the end of the process.
+def batches(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def cds_path(output_dir, symbol, species):
+    return os.path.join(output_dir, symbol, record_name(symbol, species))
+
+def cds_record(symbol, species, transcript_id, sequence):
+    """FASTA bytes of a CDS, in lines of 60 bases as in Ensembl's FASTA output."""
+    return format_record(f'{symbol}_{species}_{transcript_id}', sequence.encode())
+
+def write_cds_sequence(output_dir, symbol, species, transcript_id, sequence):
+    """Save the CDS of one gene in one species as {symbol}/{symbol}_{species}.fasta."""
+    output_file = cds_path(output_dir, symbol, species)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)  # Ensure the directory for the symbol exists.
+    with open(output_file, 'wb') as f:
+        written = f.write(cds_record(symbol, species, transcript_id, sequence))
+    emit('fetch', symbol, species=species, bytes=written)  # Time is in the span of the batch request
+    return output_file
+
+def is_settled(manifest, store, symbol, species, inputs):
+    """True if an item is complete in the manifest (and, with the packed store, still in it)."""
+    item = f"{symbol}/{species}"
+    if not manifest.is_complete(item, inputs, ('done', 'missing')):
+        return False
+    return store is None or manifest.entry(item)[2] == 'missing' or store.has(symbol, species)
+
+def lookup_canonical_transcripts(species, symbols):
+    """Map each symbol found in a species to the stable ID of its canonical transcript; also returns
+    the symbols whose lookup failed."""
+    transcripts = {}
+    found, failed = client.lookup_symbols(species, symbols)
+    for symbol, data in found.items():
+        if data.get('canonical_transcript'):
+            transcripts[symbol] = data['canonical_transcript'].split('.')[0]
+    return transcripts, failed
+
+def fetch_cds_batch(species, pairs):
+    """Fetch the canonical CDS of a batch of (symbol, transcript_id) pairs with one request. Returns
+    the species and (symbol, transcript_id, sequence, failed) tuples."""
+    sequences, failed = client.sequences([transcript_id for _, transcript_id in pairs], seq_type='cds')
+    failed = set(failed)
+    return species, [(symbol, transcript_id, sequences.get(transcript_id), transcript_id in failed)
+                     for symbol, transcript_id in pairs]
+
+def fetch_all_cds(symbols, species_list, output_dir, progress_bar=None, manifest=None, resume=False, on_item=None):
+    """Fetch and save the CDS of every symbol in every species.
+
+    Symbols are resolved with batched POST /lookup/symbol calls, then canonical CDS are
+    downloaded with batched POST /sequence/id calls, run concurrently within the client's rate
+    limit. At most two sequence batches per request slot are in flight: the next one is only
+    sent once a result has been consumed, so fetched CDS never pile up in memory. Outcomes are
+    recorded in the manifest as "{symbol}/{species}" items; with resume, items already complete
+    for the current Ensembl release are skipped. Items whose requests failed are recorded as
+    "failed", so that resume fetches them again. `on_item(symbol, species)` is called once each
+    item is settled (skipped, missing, failed or written); while it blocks, no further sequence
+    batch is sent. With CDS_STORE=sqlite, the CDS are written to the packed store of output_dir
+    instead of files. Returns the number of CDS written.
+    """
+    store = open_store(output_dir, writer=True) if CDS_STORE == 'sqlite' else None
+    inputs = {species: inputs_digest(species, client.release) for species in species_list} if manifest else {}
+    pending = {species: symbols for species in species_list}
+    if manifest is not None and resume:
+        pending = {species: [symbol for symbol in symbols
+                             if not is_settled(manifest, store, symbol, species, inputs[species])]
+                   for species in species_list}
+    if on_item is not None:
+        for species in species_list:
+            pending_symbols = set(pending[species])
+            for symbol in symbols:
+                if symbol not in pending_symbols:
+                    on_item(symbol, species)
+
+    jobs = [(species, batch) for species in species_list for batch in batches(pending[species], LOOKUP_BATCH_SIZE)]
+    transcripts = {species: {} for species in species_list}
+    lookup_failed = {species: set() for species in species_list}
+    for (species, _), (found, failed) in zip(jobs, client.map(lambda job: lookup_canonical_transcripts(*job), jobs)):
+        transcripts[species].update(found)
+        lookup_failed[species].update(failed)
+    failures = sum(len(failed) for failed in lookup_failed.values())
+    if manifest is not None:
+        manifest.record_many([(f"{symbol}/{species}", inputs[species], (),
+                               'failed' if symbol in lookup_failed[species] else 'missing')
+                              for species in species_list for symbol in pending[species]
+                              if symbol not in transcripts[species]])
+    if on_item is not None:
+        for species in species_list:
+            for symbol in pending[species]:
+                if symbol not in transcripts[species]:
+                    on_item(symbol, species)
+    if progress_bar is not None:
+        # Symbols skipped or missing from a species will never be fetched; count them as done.
+        progress_bar.update(len(symbols) * len(species_list) - sum(len(t) for t in transcripts.values()))
+
+    written = 0
+    # Batches are interleaved across species, so that genes are complete in every species early
+    species_batches = [batches(sorted(transcripts[species].items()), SEQUENCE_BATCH_SIZE) for species in species_list]
+    jobs = iter([(species, batch) for batch_group in zip_longest(*species_batches)
+                 for species, batch in zip(species_list, batch_group) if batch])
+    with ThreadPoolExecutor(max_workers=client.concurrency) as executor:
+        running = {executor.submit(fetch_cds_batch, *job) for job in islice(jobs, 2 * client.concurrency)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                species, results = future.result()
+                outcomes, records = [], []
+                for symbol, transcript_id, sequence, failed in results:
+                    if failed:
+                        outcomes.append((f"{symbol}/{species}", inputs.get(species), (), 'failed'))
+                        failures += 1
+                    elif sequence and store is not None:
+                        records.append((symbol, species, cds_record(symbol, species, transcript_id, sequence)))
+                        outcomes.append((f"{symbol}/{species}", inputs.get(species), (), 'done'))
+                    elif sequence:
+                        output_file = write_cds_sequence(output_dir, symbol, species, transcript_id, sequence)
+                        outcomes.append((f"{symbol}/{species}", inputs.get(species), [output_file], 'done'))
+                    else:
+                        outcomes.append((f"{symbol}/{species}", inputs.get(species), (), 'missing'))
+                if records:
+                    # One transaction per batch; the manifest cannot hash these outputs, is_settled() checks them
+                    store.write_many(records)
+                    for symbol, _, data in records:
+                        emit('fetch', symbol, species=species, bytes=len(data))
+                written += sum(status == 'done' for _, _, _, status in outcomes)
+                if manifest is not None:
+                    manifest.record_many(outcomes)
+                if on_item is not None:
+                    for symbol, _, _, _ in results:
+                        on_item(symbol, species)
+                if progress_bar is not None:
+                    progress_bar.set_description(f"CDS sequences fetched in {species}")
+                    progress_bar.update(len(results))
+                # Only now is the next batch sent, so a blocking on_item() holds back the requests too
+                for job in islice(jobs, 1):
+                    running.add(executor.submit(fetch_cds_batch, *job))
+    if failures:
+        reason = "offline mode, not in the cache" if client.offline else "Ensembl requests failed"
+        print(f"\n{failures} CDS could not be fetched ({reason}); run again with --resume to fetch them")
+    return written
+
+def main():
+    # Read species and gene symbols from a file.
+    with open(list_file_path, 'r') as f:
+        lines = f.read().splitlines()
+        spc, listSymb = lines[0].split(', '), lines[1:]
+
+    # Set up the output directory based on species names (with CDS_STORE=sqlite, the packed store next to it).
+    output_dir = os.path.join(base_output_dir, f"Fetched CDS sequences for {'_'.join(spc)}")
+    os.makedirs(output_dir if CDS_STORE == 'files' else base_output_dir, exist_ok=True)
+
+    # Write the output directory path to a file for potential future use.
+    with open(os.path.join(base_path, '..', 'temp', 'alignfolder.txt'), 'w') as f:
+        f.write(f"Fetched CDS sequences for {'_'.join(spc)}")
+
+    # Initialize the progress bar for tracking CDS sequence fetching.
+    progress_bar = tqdm(total=len(spc) * len(listSymb), desc='Fetching CDS sequences')
+    written = fetch_all_cds(listSymb, spc, output_dir, progress_bar, Manifest('fetch'), RESUME)
+    progress_bar.close()
+    if CDS_STORE == 'sqlite':
+        open_store(output_dir, writer=True).seal()
+    print(f"{written} CDS sequences saved in {output_dir if CDS_STORE == 'files' else store_path(output_dir)}")
+    print(client.summary())
+    print("Finished!")  # Signal the end of the process.
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,166 @@
+import argparse
 import os
-import subprocess
-from concurrent.futures import ProcessPoolExecutor
+import shutil
+import tempfile
 from datetime import datetime
-from Bio import SeqIO
+from functools import lru_cache
+from manifest import Manifest, file_digest, inputs_digest, RESUME
+from cds_store import CDS_STORE, gene_records, list_gene_dirs, record_name
+from fasta import FastaWriter, parse_fasta, read_fasta
+from macse_backend import ALIGN_BACKEND, ALIGN_TIMEOUT, AlignmentError, FallbackAligner, make_aligner
+from executors import (ALIGN_EXECUTOR, ALIGN_SHARDS, LocalPoolExecutor, LocalShardsExecutor, ShardExecutor,
+                       SlurmArrayExecutor, merge_shards, parse_shard, shard_paths)
+from telemetry import span
+from scheduling import ALIGN_HEAP_MB, available_memory_mb, gene_timeout, longest_first, plan_workers, usable_cpus
 
-max_workers = 8  # Define the maximum number of worker processes to use.
+aligner = None  # Aligner of the current worker process, created on first use by get_aligner().
+# Scratch space for the per-gene MACSE input, node-local tmpfs when available.
+ALIGN_TMPDIR = os.environ.get('ALIGN_TMPDIR') or ('/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir())
 
 def process_gene_dir(args):
-    """Process each gene directory: combine Fasta files, align sequences, and handle errors."""
-    gene_dir, jar_path, alignments_dir, log_file_path = args
+    """Process each gene directory: combine Fasta files, align sequences, and handle errors.
+
+    The combined MACSE input and the amino acid output only live in a scratch directory on
+    ALIGN_TMPDIR, removed when the gene is done. Returns (gene_name, success, io_counts).
+    """
+    gene_dir, jar_path, alignments_dir, log_file_path, timeout, java_options = args
     gene_name = os.path.basename(gene_dir)
     aligned_file_name = f"alignment_{gene_name}.fasta"
     new_name = os.path.join(alignments_dir, aligned_file_name)
+    io_counts = {'staged_bytes': 0, 'staged_files': 0, 'output_bytes': 0, 'output_files': 0}
 
-    upper_dir = os.path.abspath(os.path.join(gene_dir, os.pardir))
-    output_file = os.path.join(upper_dir, f'combined_{gene_name}.fasta')  # Unique combined file for each gene
-
-    fasta_files = [f for f in os.listdir(gene_dir) if f.endswith('.fasta')]
-
-    with open(output_file, 'w') as outfile:  # Combine Fasta files into one.
-        for fname in fasta_files:
-            with open(os.path.join(gene_dir, fname)) as infile:
-                seq_data = infile.read()
-                outfile.write(seq_data)
-                outfile.write('\n')
+    # Sorted by file name, so the alignment does not depend on the order in which the CDS were written
+    records = gene_records(gene_dir)
 
-    try:
-        print(f"Attempting to align files in directory: {gene_dir}")
-        align_fasta_file(output_file, jar_path, new_name)
-    except Exception as e:
-        log_error(log_file_path, gene_name, e)
-        delete_aa_files(gene_dir)
-        return gene_name, False
+    with span('align', gene_name) as fields, \
+            tempfile.TemporaryDirectory(prefix=f"macse_{gene_name}_", dir=ALIGN_TMPDIR) as scratch_dir:
+        output_file = os.path.join(scratch_dir, f'combined_{gene_name}.fasta')
+        io_counts['staged_bytes'] = write_combined_fasta(records, output_file)
+        io_counts['staged_files'] = 1
+        fields.update(staged_bytes=io_counts['staged_bytes'], success=False)
+        try:
+            print(f"Attempting to align files in directory: {gene_dir}")
+            if os.path.exists(new_name):
+                os.remove(new_name)  # Left by an earlier run; it must not pass for this run's output
+            align_fasta_file(output_file, jar_path, new_name, timeout, java_options,
+                             aa_file=os.path.join(scratch_dir, f'combined_{gene_name}_AA.fasta'))
+            io_counts['output_bytes'] = output_size(new_name)
+        except Exception as e:
+            log_error(log_file_path, gene_name, e)
+            return gene_name, False, io_counts
+        finally:
+            usage = aligner.last_usage if aligner is not None else None
+            if usage:
+                # A peak that is not this gene's own (warm JVM since its start) is kept apart from the per-gene peaks
+                fields.update({'macse_cpu': round(usage[0], 3),
+                               'peak_rss_mb' if usage[2] else 'jvm_peak_rss_mb': round(usage[1], 1)})
+        io_counts['output_files'] = 1
+        fields.update(success=True, output_bytes=io_counts['output_bytes'])
 
-    delete_aa_files(gene_dir)
     with open(log_file_path, 'a') as log_file:  # Log the completion of processing for this gene.
         log_file.write(f"End of log for {gene_name}\n")
-    return gene_name, True
-
-def align_fasta_file(fasta_path, jar_path, aligned_file):
-    """Align the Fasta file using an external Java application."""
-    remove_asterisk_from_fasta(fasta_path)
-    cmd = ['java', '-jar', jar_path, '-prog', 'alignSequences', '-seq', fasta_path, '-out_NT', aligned_file]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    print("STDOUT:", result.stdout.decode())
-    print("STDERR:", result.stderr.decode())
-    result.check_returncode()
-
-def remove_asterisk_from_fasta(fasta_path):
-    """Remove asterisks from sequence ends in the Fasta file."""
-    sequences = list(SeqIO.parse(fasta_path, "fasta"))
-    for record in sequences:
-        if record.seq.endswith("*"):
-            record.seq = record.seq[:-1]
-    SeqIO.write(sequences, fasta_path, "fasta")
-
-def delete_aa_files(directory):
-    """Delete auxiliary amino acid (AA) files from the directory."""
-    for file_name in os.listdir(directory):
-        if "_AA" in file_name:
-            os.remove(os.path.join(directory, file_name))
+    return gene_name, True, io_counts
+
+def enrich_gene_alignment(args):
+    """Add the CDS of new species to the existing alignment of a gene with MACSE's enrichAlignment,
+    instead of aligning all its sequences again. The existing alignment is kept fixed, so the rows
+    of the species already aligned do not change. It is only replaced if MACSE's output holds all
+    of its records plus the new ones: MACSE can drop a sequence (e.g. beyond its maxFS_inSeq or
+    maxSTOP_inSeq limits), and the gene then fails. Returns (gene_name, success, io_counts).
+    """
+    gene_dir, new_species, jar_path, alignments_dir, log_file_path, timeout, java_options = args
+    gene_name = os.path.basename(gene_dir)
+    aligned_file = os.path.join(alignments_dir, f"alignment_{gene_name}.fasta")
+    io_counts = {'staged_bytes': 0, 'staged_files': 0, 'output_bytes': 0, 'output_files': 0}
+    new_names = {record_name(gene_name, species) for species in new_species}
+    records = [record for record in gene_records(gene_dir) if record[0] in new_names]
+
+    with span('align', gene_name, mode='enrich') as fields, \
+            tempfile.TemporaryDirectory(prefix=f"macse_{gene_name}_", dir=ALIGN_TMPDIR) as scratch_dir:
+        new_sequences = os.path.join(scratch_dir, f'new_{gene_name}.fasta')
+        enriched_file = os.path.join(scratch_dir, f'enriched_{gene_name}.fasta')
+        io_counts['staged_bytes'] = write_combined_fasta(records, new_sequences)
+        io_counts['staged_files'] = 1
+        fields.update(staged_bytes=io_counts['staged_bytes'], success=False)
+        try:
+            get_aligner(jar_path, java_options).align(
+                ['-prog', 'enrichAlignment', '-align', aligned_file, '-seq', new_sequences, '-fixed_alignment_ON',
+                 '-out_NT', enriched_file, '-out_AA', os.path.join(scratch_dir, f'enriched_{gene_name}_AA.fasta')],
+                timeout=timeout)
+            output_size(enriched_file)
+            expected = record_names(aligned_file) | {name for _, data in records for name, _ in parse_fasta(data)}
+            written = record_names(enriched_file)
+            if written != expected:
+                raise AlignmentError(f"enrichAlignment output lacks {', '.join(sorted(expected - written))}"
+                                     + (f" and has unexpected {', '.join(sorted(written - expected))}"
+                                        if written - expected else "") + "; the alignment was kept unchanged")
+            # Copied next to the alignment first, so an interruption never leaves a partial alignment
+            shutil.copyfile(enriched_file, aligned_file + '.part')
+            os.replace(aligned_file + '.part', aligned_file)
+            io_counts['output_bytes'] = os.path.getsize(aligned_file)
+        except Exception as e:
+            log_error(log_file_path, gene_name, e)
+            return gene_name, False, io_counts
+        io_counts['output_files'] = 1
+        fields.update(success=True, output_bytes=io_counts['output_bytes'])
+
+    with open(log_file_path, 'a') as log_file:
+        log_file.write(f"End of log for {gene_name} ({', '.join(new_species)} added)\n")
+    return gene_name, True, io_counts
+
+def record_names(path):
+    """Names of the records of a FASTA file."""
+    return {name for name, _ in read_fasta(path)}
+
+def output_size(path):
+    """Size of an alignment MACSE was asked to write. MACSE only logs some errors (e.g. invalid options)
+    and exits normally, so a missing output is an alignment error."""
+    if not os.path.exists(path):
+        raise AlignmentError(f"the aligner wrote no output to {path}")
+    return os.path.getsize(path)
+
+def write_combined_fasta(records, output_file):
+    """Concatenate the (file name, FASTA bytes) records of a gene in a single pass, dropping the
+    trailing asterisk (stop) of each sequence. Returns the number of bytes written."""
+    with FastaWriter(output_file) as writer:
+        for _, data in records:
+            for name, sequence in parse_fasta(data):
+                writer.write(name, sequence[:-1] if sequence.endswith(b'*') else sequence)
+    return writer.bytes_written
+
+def get_aligner(jar_path, java_options=()):
+    """Return this worker process's aligner; with the "pool" backend it keeps a warm MACSE JVM across genes."""
+    global aligner
+    if aligner is None:
+        if ALIGN_BACKEND == 'pool':
+            log_path = os.path.join(os.getcwd(), 'temp', f'macse_worker_{os.getpid()}.log')
+            aligner = FallbackAligner(jar_path, java_options, log_path=log_path)
+        else:
+            aligner = make_aligner(jar_path, ALIGN_BACKEND, java_options)
+    return aligner
+
+def align_fasta_file(fasta_path, jar_path, aligned_file, timeout=ALIGN_TIMEOUT, java_options=(), aa_file=None):
+    """Align the Fasta file with MACSE, raising macse_backend.AlignmentError on failure or timeout."""
+    arguments = ['-prog', 'alignSequences', '-seq', fasta_path, '-out_NT', aligned_file]
+    if aa_file:
+        arguments += ['-out_AA', aa_file]
+    get_aligner(jar_path, java_options).align(arguments, timeout=timeout)
+
+@lru_cache(maxsize=None)
+def jar_digest(jar_path, mtime_ns, size):
+    """Content digest of the aligner jar, computed once per run rather than for every gene; a jar
+    replaced during the run has another mtime or size, and is hashed again."""
+    return file_digest(jar_path)
+
+def gene_inputs_digest(gene_dir, jar_path):
+    """Digest of everything an alignment depends on: the gene's CDS and the content of the aligner
+    jar. It is the same whether the CDS are files or in the packed store."""
+    jar_stat = os.stat(jar_path)
+    jar = jar_digest(jar_path, jar_stat.st_mtime_ns, jar_stat.st_size)
+    if CDS_STORE == 'sqlite':
+        return inputs_digest(jar, contents=gene_records(gene_dir))
+    fasta_files = [os.path.join(gene_dir, f) for f in os.listdir(gene_dir) if f.endswith('.fasta')]
+    return inputs_digest(jar, files=fasta_files)
 
 def log_error(log_file_path, gene_name, error):
     """Log any errors encountered during the processing of a gene."""
@@ -68,63 +169,123 @@ def log_error(log_file_path, gene_name, error):
     with open(log_file_path, 'a') as log_file:
         log_file.write(f"Error processing {gene_name}: {str(error)}\n")
 
-def main():
-    """Main function to set up and execute the processing of gene directories."""
-    current_directory = os.getcwd()
-    relative_path = os.path.join(current_directory, 'temp', 'alignfolder.txt')
-    folder_name_file_path = os.path.abspath(relative_path)
-
-    relative_path = os.path.join(current_directory, 'temp', 'log.txt')
-    log_file_path = os.path.abspath(relative_path)
-
-    start_time = datetime.now()
-    print(f"Number of CPU cores available: {os.cpu_count()}")
-    print(f"Number of max_workers: {max_workers}")
-    print(f"Process started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-    with open(folder_name_file_path, 'r') as f:
+def find_directories(current_directory):
+    """Return the CDS gene directories (or their paths in the packed store), and the name and path of
+    the alignment directory."""
+    with open(os.path.join(current_directory, 'temp', 'alignfolder.txt'), 'r') as f:
         fetched_directory = f.readline().strip()
+    if fetched_directory.startswith("1Alignments_"):
+        # A previous run of this step already pointed alignfolder.txt to its output; go back to its input.
+        fetched_directory = "Fetched CDS sequences for " + fetched_directory[len("1Alignments_"):]
 
-    relative_path = os.path.join(current_directory, '..')
-    root_dir = os.path.abspath(relative_path)
-    
-    relative_path = os.path.join(current_directory, 'results', fetched_directory)
-    gene_dirs_path = os.path.abspath(relative_path)
-
-    gene_dirs = [os.path.join(gene_dirs_path, d) for d in os.listdir(gene_dirs_path) if os.path.isdir(os.path.join(gene_dirs_path, d))]
+    gene_dirs_path = os.path.abspath(os.path.join(current_directory, 'results', fetched_directory))
+    gene_dirs = list_gene_dirs(gene_dirs_path)
     alignments_dir_name = "1Alignments_" + "_".join(fetched_directory.split()[4:])
     alignments_dir = os.path.join(current_directory, 'results', alignments_dir_name)
-    if not os.path.exists(alignments_dir):
-        os.makedirs(alignments_dir)
+    os.makedirs(alignments_dir, exist_ok=True)
+    return gene_dirs, alignments_dir_name, alignments_dir
 
-    jar_path = os.path.join(current_directory, 'scripts', 'macse_v2.07.jar')
+def align_genes(executor, gene_dirs, jar_path, alignments_dir, log_file_path, manifest, completed_manifest):
+    """Align the genes not yet complete in completed_manifest with the given executor, recording
+    outcomes in manifest. Returns (successfully_aligned, gene_counter)."""
+    java_options = [f'-Xmx{ALIGN_HEAP_MB}m']
+    # Largest genes are dispatched first so they do not leave a long straggler tail. A shard only
+    # keeps its own genes before their inputs are hashed.
+    genes = executor.select(longest_first(gene_dirs))
+    gene_inputs = {gene_dir: gene_inputs_digest(gene_dir, jar_path) for gene_dir, _ in genes}
+    if RESUME:
+        pending = [(d, size) for d, size in genes
+                   if not completed_manifest.is_complete(os.path.basename(d), gene_inputs[d])]
+        print(f"Resuming: {len(genes) - len(pending)} genes already aligned, {len(pending)} to process.")
+        genes = pending
 
-    tasks = [(gene_dir, jar_path, alignments_dir, log_file_path) for gene_dir in gene_dirs]
+    tasks = [(gene_dir, jar_path, alignments_dir, log_file_path, gene_timeout(size, ALIGN_TIMEOUT), java_options)
+             for gene_dir, size in genes]
 
     successfully_aligned = 0
     gene_counter = 0
+    io_totals = {'staged_bytes': 0, 'staged_files': 0, 'output_bytes': 0, 'output_files': 0}
 
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(process_gene_dir, tasks)
+    for task, (gene_name, success, io_counts) in executor.run(process_gene_dir, tasks):
+        gene_counter += 1
+        for key, value in io_counts.items():
+            io_totals[key] += value
+        aligned_file = os.path.join(alignments_dir, f"alignment_{gene_name}.fasta")
+        manifest.record(gene_name, gene_inputs[task[0]], [aligned_file] if success else (),
+                        'done' if success else 'failed')
+        if success:
+            successfully_aligned += 1
+            print(f"{gene_counter}) Successfully aligned {gene_name}")
+        else:
+            print(f"{gene_counter}) Failed to align {gene_name}")
 
-        for gene_name, success in results:
-            gene_counter += 1
-            if success:
-                successfully_aligned += 1
-                print(f"{gene_counter}) Successfully aligned {gene_name}")
-            else:
-                print(f"{gene_counter}) Failed to align {gene_name}")
+    print(f"I/O: {io_totals['staged_files']} scratch files, {io_totals['staged_bytes'] / 1e6:.1f} MB written to "
+          f"{ALIGN_TMPDIR}; {io_totals['output_files']} alignments, {io_totals['output_bytes'] / 1e6:.1f} MB "
+          f"written to {alignments_dir}")
+    return successfully_aligned, gene_counter
 
-    print(f"\nAlignment process completed. {successfully_aligned}/{gene_counter} genes aligned successfully.")
+def main():
+    """Main function to set up and execute the processing of gene directories."""
+    parser = argparse.ArgumentParser(description="Align the fetched CDS of every gene with MACSE.")
+    parser.add_argument('--executor', choices=['local', 'shard', 'slurm'], default=ALIGN_EXECUTOR,
+                        help="local: process pool on this machine; shard: every shard as a separate local "
+                             "process; slurm: every shard as a task of a SLURM job array.")
+    parser.add_argument('--shards', type=int, default=ALIGN_SHARDS, help="Number of shards (array tasks).")
+    parser.add_argument('--shard', type=parse_shard, help="Only process shard I/M of the genes, e.g. 3/10.")
+    parser.add_argument('--merge', action='store_true', help="Only merge the logs and manifests of finished shards.")
+    args = parser.parse_args()
+
+    current_directory = os.getcwd()
+    temp_directory = os.path.join(current_directory, 'temp')
+    log_file_path = os.path.join(temp_directory, 'log.txt')
+    jar_path = os.path.join(current_directory, 'scripts', 'macse_v2.07.jar')
+
+    start_time = datetime.now()
+    max_workers = plan_workers()  # Fit the JVM workers in the cores and memory of this node
+    print(f"Number of CPU cores available: {usable_cpus()}")
+    print(f"Memory available: {available_memory_mb()} MB")
+    print(f"Number of max_workers: {max_workers} (Java heap {ALIGN_HEAP_MB} MB each)")
+    print(f"Alignment backend: {ALIGN_BACKEND}")
+    print(f"Scratch directory: {ALIGN_TMPDIR}")
+    print(f"Process started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    gene_dirs, alignments_dir_name, alignments_dir = find_directories(current_directory)
+    manifest = Manifest('align')
+
+    if args.shard:
+        # One task of a sharded run: its log and manifest are merged by the process that launched the shards.
+        index, count = args.shard
+        print(f"Processing shard {index}/{count}")
+        shard_log_path, shard_manifest_path = shard_paths(temp_directory, index)
+        executor = ShardExecutor(index, count, LocalPoolExecutor(max_workers))
+        successfully_aligned, gene_counter = align_genes(executor, gene_dirs, jar_path, alignments_dir,
+                                                         shard_log_path, Manifest('align', shard_manifest_path),
+                                                         manifest)
+        print(f"\nShard {index}/{count} completed. {successfully_aligned}/{gene_counter} genes aligned successfully.")
+        return
+
+    if args.merge or args.executor == 'local':
+        if not args.merge:
+            successfully_aligned, gene_counter = align_genes(LocalPoolExecutor(max_workers), gene_dirs, jar_path,
+                                                             alignments_dir, log_file_path, manifest, manifest)
+            print(f"\nAlignment process completed. {successfully_aligned}/{gene_counter} genes aligned successfully.")
+    else:
+        executor = (LocalShardsExecutor(args.shards, max_workers) if args.executor == 'shard'
+                    else SlurmArrayExecutor(args.shards))
+        print(f"Running {args.shards} shards with the {args.executor} executor")
+        return_codes = executor.submit(current_directory)
+        if any(return_codes):
+            print(f"Some shards failed (exit codes {return_codes}); their finished genes are merged anyway.")
+
+    merged = merge_shards(temp_directory, log_file_path, manifest)
+    if merged:
+        statuses = list(manifest.statuses().values())
+        print(f"Merged {merged} shards: {statuses.count('done')}/{len(statuses)} genes aligned successfully.")
     end_time = datetime.now()
     print(f"Process ended at: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"Total duration: {end_time - start_time}")
 
-    relative_path = os.path.join(current_directory, 'temp', 'alignfolder.txt')
-    outputfolder = os.path.abspath(relative_path)
-
-    with open(outputfolder, "w") as file:
-        os.makedirs(os.path.dirname(file.name), exist_ok=True)
+    with open(os.path.join(temp_directory, 'alignfolder.txt'), "w") as file:
         file.write(alignments_dir_name)
 
 if __name__ == "__main__":
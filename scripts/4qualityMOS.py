@@ -1,32 +1,34 @@
+import csv
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fasta import deleted_except, read_fasta
+from manifest import Manifest, inputs_digest, RESUME
+from telemetry import span
+
+# Alignments with an MOS below this threshold fail QC; they are flagged in the QC table, not deleted
+mos_threshold = float(os.environ.get("MOS_THRESHOLD", "0.8"))
+qc_workers = int(os.environ.get("QC_WORKERS", os.cpu_count() or 1))
+QC_COLUMNS = ["gene", "file", "n_seqs", "length", "mos", "pairwise_min", "pairwise_mean", "pairwise_max", "passed"]
 
 # Define mos_values to store Mean Overlap Scores (MOS)
 mos_values = []
 
-# Function to read sequences from a .fasta file and return them as a list of tuples
+GAP = ord('-')
+# Anything that is not a valid amino acid character or gap is dropped from sequences
+invalid_characters = deleted_except(b"ACDEFGHIKLMNPQRSTVWY-")
+
+# Read the non-empty sequences of a .fasta file as a list of (name, bytes) tuples
 def read_fasta_file(file_path):
-    sequences = []
-    valid_characters = set("ACDEFGHIKLMNPQRSTVWY-")  # Set of valid amino acid characters and gap
-    with open(file_path, "r") as file:
-        current_sequence = ""
-        sequence_id = ""
-        for line in file:
-            if line.startswith(">"):  # Start of a new sequence
-                if current_sequence:
-                    sequences.append((sequence_id, current_sequence))
-                current_sequence = ""
-                sequence_id = line.strip()[1:]  # Strip '>' and whitespace
-            else:
-                # Filter each line to include only valid characters
-                cleaned_line = "".join(c for c in line.strip() if c in valid_characters)
-                current_sequence += cleaned_line
-        # Append the last read sequence to the list
-        if current_sequence:
-            sequences.append((sequence_id, current_sequence))
-    return sequences
+    return [(name, sequence) for name, sequence in read_fasta(file_path, delete=invalid_characters) if sequence]
+
+# Sequences are bytes as read by read_fasta_file(), or str; the loop versions below compare characters
+def as_text(seq):
+    return seq.decode("ascii") if isinstance(seq, bytes) else seq
 
 # Calculate the pairwise overlap score between two sequences
 def pairwise_overlap_score(seq1, seq2):
+    seq1, seq2 = as_text(seq1), as_text(seq2)
     identical_positions = 0
     total_positions = 0
 
@@ -40,6 +42,7 @@ def pairwise_overlap_score(seq1, seq2):
 
 # Calculate the MOS for a set of sequences
 def multiple_overlap_score(alignment):
+    alignment = [as_text(seq) for seq in alignment]
     total_score = 0
     total_pairs = 0
 
@@ -52,49 +55,131 @@ def multiple_overlap_score(alignment):
 
     return total_score / total_pairs if total_pairs else 0  # Average score or 0 if no pairs
 
-# Main program
-if __name__ == "__main__":
-    initial_dir = os.getcwd()
-    # Change to the temporary directory to read alignment folder name
-    os.chdir(os.path.join("temp"))
-
-    with open("alignfolder.txt", "r") as file:
+# Stack sequences into a uint8 matrix, one row per sequence; shorter rows are padded with gaps,
+# which are ignored by the scores exactly like the positions that zip() drops in the loop version
+def alignment_matrix(alignment):
+    length = max((len(seq) for seq in alignment), default=0)
+    matrix = np.full((len(alignment), length), GAP, dtype=np.uint8)
+    for row, seq in enumerate(alignment):
+        # Sequences are bytes as read by read_fasta_file(), or str
+        matrix[row, :len(seq)] = np.frombuffer(seq if isinstance(seq, bytes) else seq.encode("ascii"),
+                                               dtype=np.uint8)
+    return matrix
+
+# Count, for every pair of rows, the positions where both are non-gap and those where they are also identical
+def pairwise_counts(matrix):
+    symbols = np.setdiff1d(np.unique(matrix), [GAP])
+    # One-hot encode every non-gap symbol; a dot product of two rows then counts identical positions.
+    # float32 keeps these integer counts exact for alignments shorter than 2**24 columns.
+    one_hot = (matrix[:, :, None] == symbols[None, None, :]).reshape(len(matrix), -1).astype(np.float32)
+    non_gap = (matrix != GAP).astype(np.float32)
+    identical = np.rint(one_hot @ one_hot.T).astype(np.int64)
+    overlap = np.rint(non_gap @ non_gap.T).astype(np.int64)
+    return identical, overlap
+
+# Matrix of pairwise overlap scores, 0 for pairs without overlapping positions
+def pairwise_overlap_matrix(matrix):
+    identical, overlap = pairwise_counts(matrix)
+    return np.divide(identical, overlap, out=np.zeros(identical.shape), where=overlap > 0)
+
+# MOS from the scores of the pairs i < j in row order, as in triu_indices(); 0 without pairs
+def mean_pair_score(pair_scores):
+    # Sum the pair scores in the same order as the loop version so the result matches bit for bit
+    upper = pair_scores.tolist()
+    return sum(upper) / len(upper) if upper else 0
+
+# Vectorized MOS, identical to multiple_overlap_score() but computed on a uint8 matrix
+def multiple_overlap_score_numpy(alignment):
+    num_sequences = len(alignment)
+    if num_sequences < 2:
+        return 0
+    scores = pairwise_overlap_matrix(alignment_matrix(alignment))
+    return mean_pair_score(scores[np.triu_indices(num_sequences, k=1)])
+
+# Per-gene QC metrics of one alignment file, or None if it contains no sequences
+def qc_alignment(file_path):
+    filename = os.path.basename(file_path)
+    gene = filename[len("alignment_"):-len(".fasta")] if filename.startswith("alignment_") else filename[:-len(".fasta")]
+    with span("qc", gene) as fields:
+        sequences = read_fasta_file(file_path)
+        if not sequences:
+            return None
+        alignment = [s[1] for s in sequences]
+        matrix = alignment_matrix(alignment)
+        scores = pairwise_overlap_matrix(matrix)[np.triu_indices(len(alignment), k=1)]
+        row = {
+            "gene": gene,
+            "file": filename,
+            "n_seqs": len(alignment),
+            "length": matrix.shape[1],
+            "mos": mean_pair_score(scores),
+            "pairwise_min": float(scores.min()) if scores.size else 0.0,
+            "pairwise_mean": float(scores.mean()) if scores.size else 0.0,
+            "pairwise_max": float(scores.max()) if scores.size else 0.0,
+        }
+        fields.update(n_seqs=row["n_seqs"], length=row["length"], mos=round(row["mos"], 4))
+    return row
+
+# Read a QC table written by write_qc_table(), keyed by alignment file name
+def read_qc_table(table_path):
+    rows = {}
+    if os.path.exists(table_path):
+        with open(table_path, "r", newline="") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                for column in ("n_seqs", "length"):
+                    row[column] = int(row[column])
+                for column in ("mos", "pairwise_min", "pairwise_mean", "pairwise_max"):
+                    row[column] = float(row[column])
+                rows[row["file"]] = row
+    return rows
+
+def write_qc_table(table_path, rows, threshold):
+    with open(table_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=QC_COLUMNS, delimiter="\t", extrasaction="ignore")
+        writer.writeheader()
+        for row in sorted(rows, key=lambda r: r["gene"]):
+            writer.writerow(dict(row, mos=repr(row["mos"]), passed=int(row["mos"] >= threshold)))
+
+def main():
+    base_directory = os.getcwd()
+    with open(os.path.join(base_directory, "temp", "alignfolder.txt"), "r") as file:
         var = file.readline().strip()  # Read the folder name
 
-    # Change to the results directory containing the alignment files
-    os.chdir(os.path.join("..", "results", var))
-    print(f"Current directory: {os.getcwd()}")
-
-    mos_threshold = 0.8  # Define threshold for deciding whether to delete a file
-    deleted_files_count = {}  # Track number of files deleted per directory
-    investigated_directories = set()  # Track directories that have been processed
-
-    # Process each directory in the current working directory
-    for item in os.listdir('.'):
-        if os.path.isdir(item):
-            print(f"Processing directory: {item}")
-            deleted_files_count[item] = 0  # Initialize deletion count
-
-            for filename in os.listdir(item):
-                if filename.endswith('.fasta'):
-                    file_path = os.path.join(item, filename)
-                    sequences = read_fasta_file(file_path)
-                    investigated_directories.add(item)
-                    
-                    if sequences:
-                        mos = multiple_overlap_score([s[1] for s in sequences])
-                        mos_values.append(mos)  # Store MOS for reporting or analysis
-                        print(f"File: {filename}, MOS: {mos}")
-                        
-                        # Delete files with an MOS below the threshold
-                        if mos < mos_threshold:
-                            os.remove(file_path)
-                            deleted_files_count[item] += 1
-                            print(f"Deleted file: {file_path}")
-
-    # Report the number of files deleted from each directory
-    if deleted_files_count:
-        for directory, count in deleted_files_count.items():
-            print(f"Deleted {count} fasta files from directory '{directory}'")
-    else:
-        print("Deleted 0 fasta files")
+    # Directory containing the alignment files, and the QC table written next to it
+    alignments_directory = os.path.join(base_directory, "results", var)
+    table_path = os.path.join(base_directory, "results", f"{var}_qc.tsv")
+    print(f"Alignment directory: {alignments_directory}")
+
+    manifest = Manifest("qc")
+    previous_rows = read_qc_table(table_path)
+    file_paths = sorted(os.path.join(alignments_directory, f) for f in os.listdir(alignments_directory)
+                        if f.endswith(".fasta"))
+    file_inputs = {path: inputs_digest(files=[path]) for path in file_paths}
+
+    rows, pending = [], []
+    for path in file_paths:
+        # MOS does not depend on the threshold, so with --resume unchanged alignments reuse their scores
+        if RESUME and os.path.basename(path) in previous_rows and \
+                manifest.is_complete(os.path.basename(path), file_inputs[path], ("pass", "fail")):
+            rows.append(previous_rows[os.path.basename(path)])
+        else:
+            pending.append(path)
+    print(f"Scoring {len(pending)} alignments ({len(rows)} reused) with {qc_workers} workers")
+
+    with ProcessPoolExecutor(max_workers=qc_workers) as executor:
+        for row in executor.map(qc_alignment, pending, chunksize=16):
+            if row is not None:
+                mos_values.append(row["mos"])  # Store MOS for reporting or analysis
+                rows.append(row)
+
+    write_qc_table(table_path, rows, mos_threshold)
+    manifest.record_many([(row["file"], file_inputs[os.path.join(alignments_directory, row["file"])], (),
+                           "pass" if row["mos"] >= mos_threshold else "fail") for row in rows])
+
+    failed = sum(row["mos"] < mos_threshold for row in rows)
+    print(f"QC table written to {table_path}")
+    print(f"{len(rows) - failed}/{len(rows)} alignments pass the MOS threshold of {mos_threshold} "
+          f"({failed} flagged as failed, no file deleted)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ensembl_client import cached_release
+from fasta import UPPER, read_fasta
+from kaks import kaks_matrices
+from manifest import Manifest, inputs_digest, RESUME
+from results_store import ResultsStore
+from telemetry import span
+from xlsx import write_xlsx
+
+# Same settings and output files as 5kaks.R, the default step 5; the values are checked against it
+# with benchmarks/validate_kaks.py
+mos_threshold = float(os.environ.get("MOS_THRESHOLD", "0.8"))
+kaks_workers = int(os.environ.get("KAKS_WORKERS", os.cpu_count() or 1))
+# Set to 0 to keep the results in results/kaks.sqlite only, without rendering the Excel files
+kaks_excel = os.environ.get("KAKS_EXCEL", "1") not in ("", "0")
+REFERENCE_SPECIES = "Human"
+
+# Read an alignment written by 3align.py into (names, upper-case sequences as bytes)
+def read_alignment(file_path):
+    records = list(read_fasta(file_path, table=UPPER))
+    return [name for name, _ in records], [sequence for _, sequence in records]
+
+# Species of a sequence named {symbol}_{species}_{transcript_id}
+def extract_species(sequence_name):
+    parts = sequence_name.split("_")
+    return parts[1] if len(parts) > 1 else None
+
+# Ka, Ks and Ka/Ks (rounded as in 5kaks.R) of the human sequence against every other sequence of
+# one alignment, or only against those of `species`, keyed "HUMAN-<species>"
+def gene_kaks(file_path, species=None):
+    gene_name = os.path.splitext(os.path.basename(file_path))[0]
+    with span("kaks", gene_name[len("alignment_"):] if gene_name.startswith("alignment_") else gene_name) as fields:
+        try:
+            names, sequences = read_alignment(file_path)
+            row_species = [extract_species(name) for name in names]
+            pairs = None if species is None else [
+                (i, j) for i in range(len(names)) if row_species[i] == REFERENCE_SPECIES
+                for j in range(len(names)) if row_species[j] in species]
+            ka, ks = kaks_matrices(sequences, pairs)
+        except Exception as e:
+            print(f"Error processing: {gene_name} with message: {e}")
+            fields["error"] = type(e).__name__
+            return gene_name, {}
+        fields.update(n_seqs=len(names), codons=len(sequences[0]) // 3 if sequences else 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = ka / ks
+    gene_results = {}
+    for i in range(len(names)):
+        if row_species[i] != REFERENCE_SPECIES:
+            continue
+        for j in range(len(names)):
+            if not np.isnan(ratio[i, j]):
+                gene_results[f"HUMAN-{row_species[j]}"] = (float(ka[i, j]), float(ks[i, j]),
+                                                       round(float(ratio[i, j]), 3))
+    return gene_name, gene_results
+
+# Keep only the alignments whose MOS reaches the threshold in the QC table written by 4qualityMOS.py
+def filter_passing_qc(file_paths, table_path):
+    if not os.path.exists(table_path):
+        return file_paths
+    with open(table_path, "r", newline="") as f:
+        passing_files = {row["file"] for row in csv.DictReader(f, delimiter="\t") if float(row["mos"]) >= mos_threshold}
+    passing = [path for path in file_paths if os.path.basename(path) in passing_files]
+    print(f"Alignments passing QC (MOS >= {mos_threshold}): {len(passing)} of {len(file_paths)}")
+    return passing
+
+# Render the results of a release as output_results.xlsx and summary.xlsx, as 5kaks.R did
+def export_excel(store, release, results_directory):
+    columns, rows = store.wide_table(release)
+    output_file_name = "output_results.xlsx"
+    write_xlsx(os.path.join(results_directory, output_file_name), columns, rows)
+    print(f"Results file created: {output_file_name}")
+    write_xlsx(os.path.join(results_directory, "summary.xlsx"), ["species_pair", "mean", "sd", "count", "release"],
+               [list(row) + [release] for row in store.summary(release)])
+    print("Summary file created: summary.xlsx")
+
+def print_summary(store, release):
+    print(f"Ka/Ks summary (Ensembl release {release}):")
+    for pair, mean, sd, count in store.summary(release):
+        sd_text = f"{sd:.3f}" if sd is not None else "NA"
+        print(f"  {pair}: mean {mean:.3f}, sd {sd_text}, {count} genes")
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate Ka/Ks of the alignments that pass QC.")
+    parser.add_argument("--summary", action="store_true",
+                        help="Only summarize (and export) the results already in results/kaks.sqlite.")
+    args = parser.parse_args()
+
+    base_directory = os.getcwd()
+    results_directory = os.path.join(base_directory, "results")
+    store = ResultsStore(os.path.join(results_directory, "kaks.sqlite"))
+    release = cached_release()
+
+    if not args.summary:
+        with open(os.path.join(base_directory, "temp", "alignfolder.txt"), "r") as file:
+            alignfolder = file.readline().strip()
+        alignments_directory = os.path.join(results_directory, alignfolder)
+        print(f"Alignment directory: {alignments_directory}")
+
+        file_paths = sorted(os.path.join(alignments_directory, f) for f in os.listdir(alignments_directory)
+                            if f.endswith(".fasta") or f.endswith(".fa"))
+        file_paths = filter_passing_qc(file_paths, os.path.join(results_directory, f"{alignfolder}_qc.tsv"))
+
+        # Results of genes that no longer pass QC would otherwise stay in the summary
+        store.keep_genes(release, [os.path.splitext(os.path.basename(path))[0] for path in file_paths])
+        manifest = Manifest("kaks")
+        file_inputs = {path: inputs_digest(release, files=[path]) for path in file_paths}
+        if RESUME:
+            stored = store.genes(release)
+            pending = [path for path in file_paths
+                       if os.path.splitext(os.path.basename(path))[0] not in stored
+                       or not manifest.is_complete(os.path.basename(path), file_inputs[path])]
+            print(f"Resuming: {len(file_paths) - len(pending)} alignments already in the results store")
+            file_paths = pending
+
+        print(f"Computing Ka/Ks of {len(file_paths)} alignments with {kaks_workers} workers")
+        with ProcessPoolExecutor(max_workers=kaks_workers) as executor:
+            # Every gene is stored as soon as it is done, so an interrupted run keeps its results
+            for path, (gene_name, gene_results) in zip(file_paths, executor.map(gene_kaks, file_paths, chunksize=16)):
+                store.record_gene(gene_name, release, gene_results)
+                manifest.record(os.path.basename(path), file_inputs[path])
+        print(f"Results stored in {os.path.join(results_directory, 'kaks.sqlite')}")
+
+    print_summary(store, release)
+    if kaks_excel:
+        export_excel(store, release, results_directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.Constructor;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.nio.charset.StandardCharsets;
+
+/**
+ * Long-lived host for MACSE, used by macse_backend.WarmJVMAligner.
+ *
+ * Reads one job per line on stdin, made of the tab-separated MACSE arguments, runs it in
+ * this JVM and answers "OK\t<milliseconds>" or "ERROR\t<message>" on stdout. MACSE's own
+ * output is redirected to stderr so it cannot interfere with the protocol.
+ *
+ * MACSE's main() runs every job through filterCommands(), which calls System.exit once the
+ * job is done and would end this JVM, so the driver calls what filterCommands() calls instead:
+ * extractSpecialOptions() then parse(), on a fresh instance per job. Like `java -jar`, option
+ * errors are only logged by parse(); other errors are thrown and answered with ERROR. A class
+ * with neither these methods nor a static macseMain() cannot be hosted: the driver then exits
+ * before READY, and macse_backend falls back to one process per gene.
+ *
+ * Launched without a compilation step (Java 11+ single-file source mode):
+ *     java -cp macse_v2.07.jar MacseDriver.java main.MacseMain
+ */
+public class MacseDriver {
+    public static void main(String[] args) throws Exception {
+        String mainClass = args.length > 0 ? args[0] : "main.MacseMain";
+        PrintStream protocol = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        System.setOut(System.err);
+
+        Entry entry;
+        try {
+            entry = findEntry(Class.forName(mainClass));
+        } catch (ReflectiveOperationException e) {
+            System.err.println("Cannot host " + mainClass + " without System.exit: " + e);
+            System.exit(2);
+            return;
+        }
+
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        protocol.println("READY");
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            long start = System.nanoTime();
+            try {
+                entry.run(line.split("\t", -1));
+                protocol.println("OK\t" + (System.nanoTime() - start) / 1000000);
+            } catch (InvocationTargetException e) {
+                protocol.println("ERROR\t" + describe(e.getCause() != null ? e.getCause() : e));
+            } catch (Throwable e) {
+                protocol.println("ERROR\t" + describe(e));
+            }
+            System.err.flush();
+        }
+    }
+
+    private interface Entry {
+        void run(String[] arguments) throws Exception;
+    }
+
+    private static Entry findEntry(Class<?> target) throws ReflectiveOperationException {
+        try {
+            // Stand-ins may expose a static macseMain that reports errors by throwing
+            Method macseMain = target.getDeclaredMethod("macseMain", String[].class);
+            macseMain.setAccessible(true);
+            return arguments -> macseMain.invoke(null, (Object) arguments);
+        } catch (NoSuchMethodException e) {
+            // MACSE 2.07: private constructor, private instance methods
+        }
+        Constructor<?> constructor = target.getDeclaredConstructor();
+        Method extractSpecialOptions = target.getDeclaredMethod("extractSpecialOptions", String[].class);
+        Method parse = target.getDeclaredMethod("parse", String[].class);
+        constructor.setAccessible(true);
+        extractSpecialOptions.setAccessible(true);
+        parse.setAccessible(true);
+        return arguments -> {
+            Object macse = constructor.newInstance();
+            Object options = extractSpecialOptions.invoke(macse, (Object) arguments);
+            parse.invoke(macse, options);
+        };
+    }
+
+    private static String describe(Throwable error) {
+        return String.valueOf(error).replace('\n', ' ').replace('\t', ' ');
+    }
+}
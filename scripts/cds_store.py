@@ -0,0 +1,172 @@
+"""Packed storage of the CDS fetched by step 2, as an alternative to one file per gene and species.
+
+With CDS_STORE=sqlite, step 2 writes every CDS into a single SQLite file next to the usual
+directory ("results/Fetched CDS sequences for Human_Mouse.sqlite"), and step 3 and the
+streaming mode read them back by gene. The FASTA records are stored exactly as they would be
+written to disk, compressed, so both layouts give the same alignments and manifest digests.
+
+Genes are still designated by the path their directory has in the file layout ("gene_dir");
+the functions below read either layout from it.
+
+    python scripts/cds_store.py export "results/Fetched CDS sequences for Human_Mouse"
+    python scripts/cds_store.py pack "results/Fetched CDS sequences for Human_Mouse"
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import zlib
+
+# "files" (default): {symbol}/{symbol}_{species}.fasta; "sqlite": one packed store per run.
+CDS_STORE = os.environ.get('CDS_STORE', 'files')
+if CDS_STORE not in ('files', 'sqlite'):
+    raise ValueError(f"Unknown CDS_STORE {CDS_STORE}: expected files or sqlite")
+
+def store_path(output_dir):
+    return os.path.normpath(output_dir) + '.sqlite'
+
+def record_name(symbol, species):
+    """File name of a record in the file layout, which also orders the records of a gene."""
+    return f'{symbol}_{species}.fasta'
+
+class CDSStore:
+    """SQLite table of FASTA records, one zlib-compressed record per (gene, species)."""
+
+    def __init__(self, path, writer=False):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            if writer:
+                # While CDS are written, readers on the same node (streaming mode) do not block the writer
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cds (symbol TEXT, species TEXT, size INTEGER, "
+                                    "record BLOB, PRIMARY KEY (symbol, species)) WITHOUT ROWID")
+
+    def seal(self):
+        """Leave WAL mode once all CDS are written: WAL needs memory shared by all readers, so shards
+        of step 3 on other nodes of a network filesystem could not read the store otherwise."""
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+
+    def write_many(self, records):
+        """Store (symbol, species, FASTA bytes) records in a single transaction."""
+        rows = []
+        for symbol, species, data in records:
+            rows.append((symbol, species, len(data), zlib.compress(data, 1)))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO cds VALUES (?, ?, ?, ?)", rows)
+
+    def has(self, symbol, species):
+        return self.connection.execute("SELECT 1 FROM cds WHERE symbol = ? AND species = ?",
+                                       (symbol, species)).fetchone() is not None
+
+    def genes(self):
+        """Symbols with at least one CDS."""
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT symbol FROM cds ORDER BY symbol")]
+
+    def size(self, symbol):
+        """Combined size in bytes of a gene's FASTA records, as the files would have."""
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cds WHERE symbol = ?",
+                                       (symbol,)).fetchone()[0]
+
+    def species(self, symbol):
+        """Species with a CDS of a gene."""
+        return [row[0] for row in self.connection.execute("SELECT species FROM cds WHERE symbol = ?", (symbol,))]
+
+    def records(self, symbol):
+        """(file name, FASTA bytes) of every CDS of a gene, ordered by file name."""
+        rows = self.connection.execute("SELECT species, record FROM cds WHERE symbol = ?", (symbol,))
+        return sorted((record_name(symbol, species), zlib.decompress(record)) for species, record in rows)
+
+    def export(self, output_dir):
+        """Write every record to the file layout of step 2; returns the number of files written."""
+        count = 0
+        for symbol, species, record in self.connection.execute("SELECT symbol, species, record FROM cds"):
+            os.makedirs(os.path.join(output_dir, symbol), exist_ok=True)
+            with open(os.path.join(output_dir, symbol, record_name(symbol, species)), 'wb') as f:
+                f.write(zlib.decompress(record))
+            count += 1
+        return count
+
+    def pack(self, output_dir):
+        """Store every CDS file of the file layout; returns the number of records stored."""
+        records = []
+        for entry in os.scandir(output_dir):
+            if entry.is_dir():
+                for name in os.listdir(entry.path):
+                    if name.startswith(entry.name + '_') and name.endswith('.fasta'):
+                        with open(os.path.join(entry.path, name), 'rb') as f:
+                            records.append((entry.name, name[len(entry.name) + 1:-len('.fasta')], f.read()))
+        self.write_many(records)
+        return len(records)
+
+stores = {}  # Open stores by process, thread and path: SQLite connections cannot be shared between them
+
+def open_store(output_dir, writer=False):
+    path = store_path(output_dir)
+    key = (os.getpid(), threading.get_ident(), path, writer)
+    if key not in stores:
+        stores[key] = CDSStore(path, writer)
+    return stores[key]
+
+def close_stores(output_dir):
+    """Close the connections of the calling thread to a store; sealing it needs every other one closed."""
+    path = store_path(output_dir)
+    for key in [key for key in stores if key[:3] == (os.getpid(), threading.get_ident(), path)]:
+        stores.pop(key).connection.close()
+
+def list_gene_dirs(output_dir):
+    """Paths designating the genes fetched by step 2 in output_dir."""
+    if CDS_STORE == 'sqlite':
+        return [os.path.join(output_dir, symbol) for symbol in open_store(output_dir).genes()]
+    return [os.path.join(output_dir, d) for d in os.listdir(output_dir) if os.path.isdir(os.path.join(output_dir, d))]
+
+def has_gene(gene_dir):
+    if CDS_STORE == 'sqlite':
+        return open_store(os.path.dirname(gene_dir)).size(os.path.basename(gene_dir)) > 0
+    return os.path.isdir(gene_dir)
+
+def gene_size(gene_dir):
+    """Combined size in bytes of a gene's CDS."""
+    if CDS_STORE == 'sqlite':
+        return open_store(os.path.dirname(gene_dir)).size(os.path.basename(gene_dir))
+    return sum(entry.stat().st_size for entry in os.scandir(gene_dir) if entry.name.endswith('.fasta'))
+
+def gene_species(gene_dir):
+    """Species with a CDS of a gene, without reading the CDS."""
+    if CDS_STORE == 'sqlite':
+        return open_store(os.path.dirname(gene_dir)).species(os.path.basename(gene_dir))
+    prefix = os.path.basename(gene_dir) + '_'
+    if not os.path.isdir(gene_dir):
+        return []
+    return [name[len(prefix):-len('.fasta')] for name in os.listdir(gene_dir)
+            if name.startswith(prefix) and name.endswith('.fasta')]
+
+def gene_records(gene_dir):
+    """(file name, FASTA bytes) of every CDS of a gene, ordered by file name."""
+    if CDS_STORE == 'sqlite':
+        return open_store(os.path.dirname(gene_dir)).records(os.path.basename(gene_dir))
+    records = []
+    for name in sorted(f for f in os.listdir(gene_dir) if f.endswith('.fasta')):
+        with open(os.path.join(gene_dir, name), 'rb') as f:
+            records.append((name, f.read()))
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between the CDS file layout of step 2 and a packed store.")
+    parser.add_argument('command', choices=['export', 'pack'],
+                        help="export: write the files of a packed store; pack: store the files in a packed store.")
+    parser.add_argument('output_dir', help='Directory of the file layout, e.g. "results/Fetched CDS sequences for '
+                                           'Human_Mouse"; the store is the same path with ".sqlite".')
+    args = parser.parse_args()
+    if args.command == 'export' and not os.path.exists(store_path(args.output_dir)):
+        parser.error(f"No packed store {store_path(args.output_dir)}")
+    store = CDSStore(store_path(args.output_dir), writer=args.command == 'pack')
+    if args.command == 'export':
+        print(f"{store.export(args.output_dir)} CDS files written to {args.output_dir}")
+    else:
+        print(f"{store.pack(args.output_dir)} CDS stored in {store.path}")
+        store.seal()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from http_cache import HTTPCache
+from telemetry import span
+
+temp_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'temp')
+
+# Base URL of the Ensembl REST server; point it at a local stub to test without network access.
+ENSEMBL_SERVER = os.environ.get('ENSEMBL_SERVER', 'https://rest.ensembl.org').rstrip('/')
+# Maximum number of requests in flight at the same time.
+ENSEMBL_CONCURRENCY = int(os.environ.get('ENSEMBL_CONCURRENCY', '8'))
+# Location of the persistent response cache, or "off" to disable it.
+ENSEMBL_CACHE = os.environ.get('ENSEMBL_CACHE', os.path.join(temp_directory, 'ensembl_cache.sqlite'))
+ENSEMBL_CACHE_TTL_DAYS = float(os.environ.get('ENSEMBL_CACHE_TTL_DAYS', '30'))
+ENSEMBL_CACHE_MAX_MB = float(os.environ.get('ENSEMBL_CACHE_MAX_MB', '2048'))
+# When set, responses are served from the cache only and no request reaches the network.
+ENSEMBL_OFFLINE = os.environ.get('ENSEMBL_OFFLINE', '') not in ('', '0')
+# Average number of requests per second sent to the server (Ensembl allows 15), or 0 for no limit.
+ENSEMBL_RATE = float(os.environ.get('ENSEMBL_RATE', '15'))
+# Number of times a request is retried after a 429 (Too Many Requests) answer.
+MAX_RATE_LIMIT_RETRIES = 5
+# Maximum number of symbols accepted by POST /lookup/symbol in a single request.
+LOOKUP_BATCH_SIZE = 1000
+# Maximum number of identifiers accepted by POST /sequence/id in a single request.
+SEQUENCE_BATCH_SIZE = 50
+
+class EnsemblError(Exception):
+    """A request that failed: non-200 answer after retries, or no answer at all."""
+
+class RateLimiter:
+    """Spaces requests evenly in time and pauses every thread when the server asks to slow down."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the calling thread may send its next request."""
+        with self.lock:
+            slot = max(time.monotonic(), self.next_slot)
+            self.next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold back all requests for the given number of seconds (e.g. from a Retry-After header)."""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+class EnsemblClient:
+    """Pooled, cached HTTP client for the Ensembl REST API that counts the requests it sends."""
+
+    def __init__(self, server=ENSEMBL_SERVER, concurrency=ENSEMBL_CONCURRENCY, cache_path=ENSEMBL_CACHE,
+                 offline=ENSEMBL_OFFLINE, rate=ENSEMBL_RATE):
+        self.server = server
+        self.concurrency = max(1, concurrency)
+        self.offline = offline
+        self.rate_limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        # Connection errors and server errors are retried by urllib3 (POST included: every endpoint used is
+        # read-only); 429 answers are left to _send, which honours Retry-After.
+        retries = Retry(total=3, backoff_factor=1, status_forcelist=(500, 502, 503, 504), allowed_methods=None,
+                        raise_on_status=False, respect_retry_after_header=False)
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=self.concurrency, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.lock = threading.Lock()  # Only guards the counters; requests themselves run unlocked.
+        self.cache = None
+        if cache_path and cache_path.lower() != 'off':
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self.cache = HTTPCache(cache_path, ENSEMBL_CACHE_TTL_DAYS, ENSEMBL_CACHE_MAX_MB)
+        self._release = None
+        self.release_lock = threading.Lock()
+
+    def _count(self, rate_limited=False):
+        with self.lock:
+            self.request_count += 1
+            self.rate_limited_count += rate_limited
+
+    @property
+    def release(self):
+        """Current Ensembl release, remembered in the cache so offline runs use the last one seen."""
+        with self.release_lock:
+            if self._release is None:
+                self._release = self._find_release()
+        return self._release
+
+    def _find_release(self):
+        release = None
+        if not self.offline:
+            try:
+                data = self._send('GET', '/info/data', None, None)
+            except requests.RequestException:
+                data = None  # Server unreachable: use the release last seen; the batches will fail one by one
+            if data and data.get('releases'):
+                release = str(data['releases'][0])
+                if self.cache:
+                    self.cache.set_meta('release', release)
+        if release is None and self.cache:
+            release = self.cache.get_meta('release')
+        return release or 'unknown'
+
+    def _send(self, method, path, params, payload, check=False):
+        """Send one request over the network and return the decoded JSON, or None on a non-200 answer
+        (with `check`, raise EnsemblError instead).
+
+        Answers with status 429 are retried after the delay given in their Retry-After header.
+        """
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        # Telemetry span: endpoint, items in the batch, retries, bytes received and time spent rate limited
+        endpoint = f"{method} /{path.split('/')[1]}"
+        items = max((len(value) for value in (payload or {}).values() if isinstance(value, list)), default=1)
+        with span('http', endpoint=endpoint, items=items) as fields:
+            waited = 0.0
+            for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+                wait_start = time.perf_counter()
+                self.rate_limiter.wait()
+                waited += time.perf_counter() - wait_start
+                if method == 'GET':
+                    response = self.session.get(f"{self.server}{path}", params=params, timeout=30, headers=headers)
+                else:
+                    response = self.session.post(f"{self.server}{path}", params=params, json=payload, timeout=60,
+                                                 headers=headers)
+                self._count(response.status_code == 429)
+                if response.status_code != 429:
+                    break
+                self.rate_limiter.pause(float(response.headers.get('Retry-After', 1)))
+            fields.update(status=response.status_code, retries=attempt, bytes=len(response.content),
+                          wait=round(waited, 6))
+        if response.status_code == 200:
+            return response.json()
+        if check:
+            raise EnsemblError(f"{method} {path}: HTTP {response.status_code}")
+        return None
+
+    def _request(self, method, path, params=None, payload=None):
+        """Serve a request from the cache if possible, otherwise send it and cache a successful answer."""
+        if self.cache is None:
+            return None if self.offline else self._send(method, path, params, payload)
+        key = HTTPCache.make_key(method, f"{self.server}{path}", params, payload, self.release)
+        value = self.cache.get(key)
+        if value is None and not self.offline:
+            value = self._send(method, path, params, payload)
+            if value is not None:
+                self.cache.put(key, path.split('/')[1], value)
+        return value
+
+    def get_json(self, path, params=None):
+        """Perform a GET request and return the decoded JSON, or None on a non-200 answer."""
+        return self._request('GET', path, params)
+
+    def post_json(self, path, payload, params=None):
+        """Perform a POST request with a JSON body and return the decoded JSON, or None on a non-200 answer."""
+        return self._request('POST', path, params, payload)
+
+    def map(self, function, items):
+        """Apply function to every item using at most `concurrency` threads, preserving order."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(function, items))
+
+    def _item_key(self, path, params, item):
+        return HTTPCache.make_key('POST', f"{self.server}{path}", params, item, self.release)
+
+    def _batch(self, path, params, items, fetch):
+        """Answers of a batch endpoint for `items`, cached one item at a time so that a different
+        list of genes still hits the cache. `fetch(items)` requests the items not cached and returns
+        a dict of those found; the others are cached as not found.
+
+        Returns (found, failed): a dict of the items found, and the items that are neither found nor
+        known to be missing because their request failed (or, offline, because they are not cached).
+        """
+        found, uncached = {}, list(items)
+        if self.cache is not None:
+            uncached = []
+            for item in items:
+                value = self.cache.get(self._item_key(path, params, item))
+                if value is None:
+                    uncached.append(item)
+                elif value:  # {} records an item known not to exist
+                    found[item] = value
+        if not uncached:
+            return found, []
+        if self.offline:
+            return found, uncached
+        try:
+            answered = fetch(uncached)
+        except (EnsemblError, requests.RequestException):
+            return found, uncached  # Status and retries are in the telemetry span of the request
+        for item in uncached:
+            value = answered.get(item)
+            if self.cache is not None:
+                self.cache.put(self._item_key(path, params, item), path.split('/')[1], value or {})
+            if value:
+                found[item] = value
+        return found, []
+
+    def lookup_symbols(self, species, symbols, batch_size=LOOKUP_BATCH_SIZE):
+        """Resolve gene symbols in a species with batched POST /lookup/symbol calls.
+
+        Returns (found, failed): a dict mapping each symbol that was found to its lookup record, and
+        the symbols of the batches that failed.
+        """
+        path = f"/lookup/symbol/{species}"
+        symbols = list(symbols)
+        batches = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+
+        def fetch(batch):
+            return self._send('POST', path, None, {"symbols": batch}, check=True)
+
+        found, failed = {}, []
+        for batch_found, batch_failed in self.map(lambda batch: self._batch(path, None, batch, fetch), batches):
+            found.update(batch_found)
+            failed.extend(batch_failed)
+        return found, failed
+
+    def sequences(self, ids, seq_type='cds'):
+        """Fetch the sequences of up to SEQUENCE_BATCH_SIZE stable IDs with one POST /sequence/id call.
+
+        Returns (sequences, failed): a dict mapping each ID found to its sequence, and the IDs that
+        could not be fetched.
+        """
+        params = {"type": seq_type}
+
+        def fetch(batch):
+            records = self._send('POST', "/sequence/id", params, {"ids": batch}, check=True)
+            return {record.get('query', record['id']): {'seq': record['seq']} for record in records}
+
+        found, failed = self._batch("/sequence/id", params, list(ids), fetch)
+        return {item: record['seq'] for item, record in found.items()}, failed
+
+    def summary(self):
+        """One-line report of network traffic and cache usage."""
+        line = f"{self.request_count} requests sent to {self.server}"
+        if self.rate_limited_count:
+            line += f" ({self.rate_limited_count} rate limited)"
+        if self.cache:
+            line += f"; {self.cache.summary()}"
+        if self.offline:
+            line += " (offline mode)"
+        return line
+
+def cached_release(cache_path=ENSEMBL_CACHE):
+    """Ensembl release last seen by steps 1 and 2, read from the response cache without any request."""
+    if not cache_path or cache_path.lower() == 'off' or not os.path.exists(cache_path):
+        return 'unknown'
+    return HTTPCache(cache_path, ENSEMBL_CACHE_TTL_DAYS, ENSEMBL_CACHE_MAX_MB).get_meta('release', 'unknown')
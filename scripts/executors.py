@@ -0,0 +1,138 @@
+import glob
+import os
+import shlex
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+scripts_directory = os.path.dirname(os.path.abspath(__file__))
+ALIGN_SCRIPT = os.path.join(scripts_directory, '3align.py')
+
+# Executor used by 3align.py: "local", "shard" or "slurm".
+ALIGN_EXECUTOR = os.environ.get('ALIGN_EXECUTOR', 'local')
+# Number of shards (array tasks) used by the "shard" and "slurm" executors.
+ALIGN_SHARDS = int(os.environ.get('ALIGN_SHARDS', '4'))
+# Extra options for sbatch, e.g. "--partition=long --time=24:00:00".
+ALIGN_SLURM_OPTIONS = os.environ.get('ALIGN_SLURM_OPTIONS', '')
+ALIGN_SLURM_CPUS = int(os.environ.get('ALIGN_SLURM_CPUS', '8'))
+
+def parse_shard(text):
+    """Parse "I/M" into (I, M), with 0 <= I < M."""
+    index, count = (int(part) for part in text.split('/'))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {text}: expected I/M with 0 <= I < M")
+    return index, count
+
+def select_shard(tasks, index, count):
+    """Tasks of shard `index` out of `count`. Tasks are dealt round-robin, so with tasks sorted
+    longest first every shard gets a similar mix of large and small genes."""
+    return tasks[index::count]
+
+def shard_paths(temp_directory, index):
+    """Log and manifest written by one shard, merged into the main ones by merge_shards()."""
+    return (os.path.join(temp_directory, f'log.shard{index}.txt'),
+            os.path.join(temp_directory, f'manifest.shard{index}.sqlite'))
+
+def merge_shards(temp_directory, log_file_path, manifest):
+    """Append the logs and manifest entries of all finished shards to the main ones, then remove them."""
+    merged = 0
+    for shard_log in sorted(glob.glob(os.path.join(temp_directory, 'log.shard*.txt'))):
+        with open(shard_log) as infile, open(log_file_path, 'a') as outfile:
+            outfile.write(infile.read())
+        os.remove(shard_log)
+    for shard_manifest in sorted(glob.glob(os.path.join(temp_directory, 'manifest.shard*.sqlite'))):
+        manifest.merge_from(shard_manifest)
+        for path in glob.glob(shard_manifest + '*'):
+            os.remove(path)
+        merged += 1
+    return merged
+
+class LocalPoolExecutor:
+    """Runs gene tasks in a process pool on this machine, yielding results as they complete."""
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+
+    def select(self, tasks):
+        """Tasks this executor is responsible for: all of them."""
+        return list(tasks)
+
+    def run(self, function, tasks):
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(function, task): task for task in tasks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+class ShardExecutor:
+    """Runs only shard `index` of `count` of the tasks, with another executor (the local pool).
+
+    Callers pass the tasks through select() first, so work done per task before running it
+    (e.g. hashing its inputs) is only done for the tasks of this shard."""
+
+    def __init__(self, index, count, inner):
+        self.index = index
+        self.count = count
+        self.inner = inner
+
+    def select(self, tasks):
+        return select_shard(list(tasks), self.index, self.count)
+
+    def run(self, function, tasks):
+        return self.inner.run(function, tasks)
+
+def shard_command(index, count):
+    return [sys.executable, ALIGN_SCRIPT, '--shard', f'{index}/{count}']
+
+class LocalShardsExecutor:
+    """Runs every shard as a separate `3align.py --shard I/M` process on this machine and waits for
+    all of them; a local stand-in for a cluster array job.
+
+    The shards share the machine: `workers`, the alignment workers that fit in its cores and memory,
+    are divided between them (ALIGN_WORKERS of each shard), and if there are more shards than
+    workers, the shards run a few at a time."""
+
+    def __init__(self, count, workers):
+        self.count = count
+        self.workers = workers
+
+    def submit(self, working_directory):
+        parallel = min(self.count, self.workers)
+        environment = dict(os.environ, ALIGN_WORKERS=str(self.workers // parallel))
+
+        def run_shard(index):
+            return subprocess.run(shard_command(index, self.count), cwd=working_directory, env=environment).returncode
+
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            return list(pool.map(run_shard, range(self.count)))
+
+class SlurmArrayExecutor:
+    """Submits the shards as a SLURM job array (one `3align.py --shard I/M` per array task) and
+    waits for the whole array with `sbatch --wait`."""
+
+    def __init__(self, count, cpus=ALIGN_SLURM_CPUS, options=ALIGN_SLURM_OPTIONS):
+        self.count = count
+        self.cpus = cpus
+        self.options = options
+
+    def batch_script(self, working_directory):
+        command = ' '.join(shlex.quote(part) for part in shard_command(0, self.count)[:-1])
+        return "\n".join([
+            "#!/bin/bash",
+            "#SBATCH --job-name=autodnds_align",
+            f"#SBATCH --array=0-{self.count - 1}",
+            f"#SBATCH --cpus-per-task={self.cpus}",
+            f"cd {shlex.quote(working_directory)}",
+            f"{command} \"$SLURM_ARRAY_TASK_ID/{self.count}\"",
+            "",
+        ])
+
+    def submit(self, working_directory):
+        script_path = os.path.join(working_directory, 'temp', 'align_array.sbatch')
+        with open(script_path, 'w') as f:
+            f.write(self.batch_script(working_directory))
+        # Given as an argument rather than an #SBATCH line, so the path needs no quoting.
+        output = '--output=' + os.path.join(working_directory, 'temp', 'slurm_align_%A_%a.out')
+        # Environment variables (ALIGN_*, PIPELINE_RESUME, ...) are exported to the array tasks by default.
+        result = subprocess.run(['sbatch', '--wait', '--parsable', output] + self.options.split() + [script_path],
+                                cwd=working_directory)
+        return [result.returncode]
@@ -0,0 +1,235 @@
+"""Add species to a finished run without recomputing what does not change (`mastercode.py --add-species`).
+
+The genes of temp/list.txt are kept. Only the CDS of the new species are fetched. Each gene
+they are found in has them added to its existing alignment with MACSE's enrichAlignment,
+and the genes never aligned are aligned in full. QC is redone for the alignments that
+changed, and only the new human-vs-species Ka/Ks pairs are computed; the results already
+in results/kaks.sqlite are kept unchanged.
+
+The files of the run are renamed after the new species panel, as if it had been run with
+all species from the start, so steps 2 to 5 (e.g. with --resume) continue from there. Until
+every new CDS is fetched and every alignment extended, temp/expansion.txt holds the panel
+before the expansion and the species being added: running the expansion again continues it.
+
+    python scripts/expand_panel.py dog,cat
+"""
+import argparse
+import glob
+import importlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from cds_store import CDS_STORE, gene_species, open_store, store_path
+from ensembl_client import cached_release
+from executors import LocalPoolExecutor
+from macse_backend import ALIGN_TIMEOUT
+from manifest import Manifest, inputs_digest
+from results_store import ResultsStore
+from scheduling import ALIGN_HEAP_MB, gene_timeout, longest_first, plan_workers
+
+fetch_step = importlib.import_module('2CDS_fetcher')
+align_step = importlib.import_module('3align')
+qc_step = importlib.import_module('4qualityMOS')
+kaks_step = importlib.import_module('5kaks')
+
+def rename_run(results_directory, old_panel, new_panel):
+    """Rename the CDS, alignments and QC table of a run after its species panel, and the output
+    paths recorded in the manifest."""
+    renames = [(f"Fetched CDS sequences for {old_panel}", f"Fetched CDS sequences for {new_panel}", 'fetch'),
+               (f"1Alignments_{old_panel}", f"1Alignments_{new_panel}", 'align')]
+    for old_name, new_name, step in renames:
+        old_path, new_path = (os.path.join(results_directory, name) for name in (old_name, new_name))
+        if CDS_STORE == 'sqlite' and step == 'fetch':
+            old_path, new_path = store_path(old_path), store_path(new_path)
+        if os.path.exists(old_path):
+            if os.path.exists(new_path):
+                raise FileExistsError(f"Cannot rename {old_path}: {new_path} already exists")
+            os.rename(old_path, new_path)
+            Manifest(step).rename_outputs(os.path.join(results_directory, old_name),
+                                          os.path.join(results_directory, new_name))
+    old_table = os.path.join(results_directory, f"1Alignments_{old_panel}_qc.tsv")
+    if os.path.exists(old_table):
+        os.rename(old_table, os.path.join(results_directory, f"1Alignments_{new_panel}_qc.tsv"))
+
+def add_kaks_pairs(store, release, alignments, qc_rows, new_species):
+    """Store the human-vs-new-species pairs of the alignments passing QC that were not scored yet for
+    this release, and all pairs of the genes without results (aligned in full, failing QC before, or
+    all genes if step 5 stored nothing); returns the number of alignments scored."""
+    kaks_manifest = Manifest('kaks')
+    scored_genes = store.genes(release)
+    passing = [path for path in alignments
+               if os.path.basename(path) in qc_rows and qc_rows[os.path.basename(path)]["mos"] >= qc_step.mos_threshold
+               and not kaks_manifest.is_complete(os.path.basename(path), inputs_digest(release, files=[path]))]
+    # Only the pairs of the new species are computed for the genes already scored
+    pair_species = [new_species if os.path.splitext(os.path.basename(path))[0] in scored_genes else None
+                    for path in passing]
+    with ProcessPoolExecutor(max_workers=kaks_step.kaks_workers) as pool:
+        for path, (gene_name, gene_results) in zip(passing, pool.map(kaks_step.gene_kaks, passing, pair_species,
+                                                                     chunksize=16)):
+            store.record_pairs(gene_name, release, gene_results)
+            # The other pairs of this gene are reused as they are: step 5 --resume must not recompute them
+            kaks_manifest.record(os.path.basename(path), inputs_digest(release, files=[path]))
+    return len(passing)
+
+def read_expansion(expansion_path):
+    """Panel before the expansion and species being added, if an expansion was left unfinished."""
+    if not os.path.exists(expansion_path):
+        return None
+    with open(expansion_path, 'r') as f:
+        lines = f.read().splitlines()
+    return lines[0].split(', '), lines[1].split(', ')
+
+def main():
+    parser = argparse.ArgumentParser(description="Add species to the panel of a finished run.")
+    parser.add_argument('species', help="Species to add, separated by commas (e.g. 'dog,cat').")
+    args = parser.parse_args()
+
+    base_directory = os.getcwd()
+    temp_directory = os.path.join(base_directory, 'temp')
+    results_directory = os.path.join(base_directory, 'results')
+    expansion_path = os.path.join(temp_directory, 'expansion.txt')
+    with open(fetch_step.list_file_path, 'r') as f:
+        lines = f.read().splitlines()
+        spc, symbols = lines[0].split(', '), lines[1:]
+    requested = [species.strip().title() for species in args.species.split(',')]
+    pending = read_expansion(expansion_path)
+    if pending is not None:
+        # list.txt may already name the new panel: the interrupted run got past the renaming
+        spc, new_species = pending
+        others = [species for species in requested if species and species not in spc + new_species]
+        if others:
+            raise SystemExit(f"The addition of {', '.join(new_species)} is unfinished: run it again with these "
+                             f"species before adding {', '.join(others)}")
+        print(f"Continuing the addition of {', '.join(new_species)} to {', '.join(spc)}")
+    else:
+        new_species = [species for species in dict.fromkeys(requested) if species and species not in spc]
+        if not new_species:
+            print(f"Nothing to add: the panel is already {', '.join(spc)}")
+            return
+        print(f"Adding {', '.join(new_species)} to {len(symbols)} genes of {', '.join(spc)}")
+        # Written before anything changes, so an interrupted or failed expansion can be continued
+        with open(expansion_path, 'w') as f:
+            f.write(', '.join(spc) + "\n" + ', '.join(new_species) + "\n")
+    old_panel, new_panel = '_'.join(spc), '_'.join(spc + new_species)
+
+    rename_run(results_directory, old_panel, new_panel)
+    with open(fetch_step.list_file_path, 'w') as f:
+        f.write(', '.join(spc + new_species) + "\n")
+        f.write('\n'.join(symbols))
+    alignments_dir_name = f"1Alignments_{new_panel}"
+    with open(os.path.join(temp_directory, 'alignfolder.txt'), 'w') as f:
+        f.write(alignments_dir_name)
+
+    # CDS of the new species only; the human CDS and the other species are already there
+    output_dir = os.path.join(results_directory, f"Fetched CDS sequences for {new_panel}")
+    if CDS_STORE == 'files':
+        os.makedirs(output_dir, exist_ok=True)
+    fetch_manifest = Manifest('fetch')
+    written = fetch_step.fetch_all_cds(symbols, new_species, output_dir, None, fetch_manifest, True)
+    if CDS_STORE == 'sqlite':
+        open_store(output_dir, writer=True).seal()
+    print(f"{written} CDS fetched in {', '.join(new_species)}")
+    fetch_failed = [item for item, status in fetch_manifest.statuses().items()
+                    if status == 'failed' and item.split('/')[-1] in new_species]
+
+    # Alignments: enrich the existing ones, align in full the genes that have none
+    alignments_dir = os.path.join(results_directory, alignments_dir_name)
+    os.makedirs(alignments_dir, exist_ok=True)
+    jar_path = os.path.join(base_directory, 'scripts', 'macse_v2.07.jar')
+    log_file_path = os.path.join(temp_directory, 'log.txt')
+    java_options = [f'-Xmx{ALIGN_HEAP_MB}m']
+    align_manifest = Manifest('align')
+    enrich_tasks, align_tasks, gene_inputs = [], [], {}
+    gene_dirs = [os.path.join(output_dir, symbol) for symbol in symbols]
+    for gene_dir, size in longest_first([d for d in gene_dirs if gene_species(d)]):
+        symbol = os.path.basename(gene_dir)
+        gene_inputs[symbol] = align_step.gene_inputs_digest(gene_dir, jar_path)
+        if align_manifest.is_complete(symbol, gene_inputs[symbol]):
+            continue  # Not found in the new species, or already extended by an interrupted run
+        timeout = gene_timeout(size, ALIGN_TIMEOUT)
+        entry = align_manifest.entry(symbol)
+        added = [species for species in new_species if species in gene_species(gene_dir)]
+        # An alignment that failed to be extended in an earlier run of this expansion (recorded with the
+        # current inputs) is left unchanged, so it is extended again rather than aligned in full
+        extendable = entry is not None and (entry[2] == 'done' or entry[0] == gene_inputs[symbol])
+        if extendable and added and os.path.exists(os.path.join(alignments_dir, f"alignment_{symbol}.fasta")):
+            enrich_tasks.append((gene_dir, added, jar_path, alignments_dir, log_file_path, timeout, java_options))
+        else:
+            align_tasks.append((gene_dir, jar_path, alignments_dir, log_file_path, timeout, java_options))
+    print(f"Enriching {len(enrich_tasks)} alignments, aligning {len(align_tasks)} genes in full")
+
+    executor = LocalPoolExecutor(plan_workers())
+    release = cached_release()
+    store = ResultsStore(os.path.join(results_directory, 'kaks.sqlite'))
+    updated = 0
+    for task, (gene_name, success, _) in executor.run(align_step.enrich_gene_alignment, enrich_tasks):
+        aligned_file = os.path.join(alignments_dir, f"alignment_{gene_name}.fasta")
+        align_manifest.record(gene_name, gene_inputs[gene_name], [aligned_file] if success else (),
+                              'done' if success else 'failed')
+        updated += success
+        if not success:
+            align_tasks.append((task[0],) + task[2:])  # Aligned in full instead, below
+    if updated < len(enrich_tasks):
+        print(f"{len(enrich_tasks) - updated} alignments could not be extended, aligning them in full")
+    for task, (gene_name, success, _) in executor.run(align_step.process_gene_dir, align_tasks):
+        aligned_file = os.path.join(alignments_dir, f"alignment_{gene_name}.fasta")
+        align_manifest.record(gene_name, gene_inputs[gene_name], [aligned_file] if success else (),
+                              'done' if success else 'failed')
+        updated += success
+        if success:
+            # The rows of every species may have changed: all pairs of the gene are scored again below
+            store.record_gene(f"alignment_{gene_name}", release, {})
+    print(f"{updated} alignments updated")
+
+    # Alignments holding a new species, including those extended by an interrupted run of the expansion
+    changed, align_failed = [], []
+    for symbol in gene_inputs:
+        aligned_file = os.path.join(alignments_dir, f"alignment_{symbol}.fasta")
+        if not any(species in new_species for species in gene_species(os.path.join(output_dir, symbol))):
+            continue
+        if align_manifest.is_complete(symbol, gene_inputs[symbol]):
+            changed.append(aligned_file)
+        else:
+            align_failed.append(symbol)
+
+    # QC of the alignments that changed since their last QC; the other rows of the QC table are kept
+    table_path = os.path.join(results_directory, f"{alignments_dir_name}_qc.tsv")
+    rows = qc_step.read_qc_table(table_path)
+    qc_manifest = Manifest('qc')
+    qc_digests = {path: inputs_digest(files=[path]) for path in changed}
+    stale = [path for path in changed
+             if not (os.path.basename(path) in rows and
+                     qc_manifest.is_complete(os.path.basename(path), qc_digests[path], ('pass', 'fail')))]
+    outcomes = []
+    with ProcessPoolExecutor(max_workers=qc_step.qc_workers) as pool:
+        for path, row in zip(stale, pool.map(qc_step.qc_alignment, stale, chunksize=16)):
+            if row is not None:
+                rows[row["file"]] = row
+                outcomes.append((row["file"], qc_digests[path], (),
+                                 "pass" if row["mos"] >= qc_step.mos_threshold else "fail"))
+    # The table first: an alignment recorded as checked always has its row in it
+    qc_step.write_qc_table(table_path, rows.values(), qc_step.mos_threshold)
+    qc_manifest.record_many(outcomes)
+
+    # Ka/Ks of the new pairs only, for the changed alignments that pass QC (same release as step 5)
+    if store.genes(release):
+        scored = add_kaks_pairs(store, release, changed, rows, new_species)
+        print(f"New Ka/Ks pairs computed for {scored} genes passing QC")
+    else:
+        # Step 5 was run with 5kaks.R, which does not fill the store: every pair of the panel is computed
+        print("No Ka/Ks results stored by 5kaks.py for this release: computing all pairs of the panel with "
+              "5kaks.py (not yet validated against 5kaks.R, run step 5 again for its results)")
+        scored = add_kaks_pairs(store, release, sorted(glob.glob(os.path.join(alignments_dir, 'alignment_*.fasta'))),
+                                rows, new_species)
+        print(f"Ka/Ks computed for {scored} genes passing QC")
+    kaks_step.print_summary(store, release)
+    if kaks_step.kaks_excel:
+        kaks_step.export_excel(store, release, results_directory)
+    print(fetch_step.client.summary())
+    if fetch_failed or align_failed:
+        print(f"{len(fetch_failed)} CDS could not be fetched and {len(align_failed)} alignments could not be "
+              f"extended: run the addition of {', '.join(new_species)} again to complete it")
+    else:
+        os.remove(expansion_path)
+
+if __name__ == "__main__":
+    main()
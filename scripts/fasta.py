@@ -0,0 +1,72 @@
+"""FASTA reading and writing shared by all steps, on bytes.
+
+Files are memory-mapped and parsed one record at a time: a record is located with two
+searches, and its sequence lines are joined and filtered with a single bytes.translate()
+call that deletes line breaks and any other unwanted character (and can change case at the
+same time). Reading a multi-megabase alignment therefore never builds per-line strings, and
+only one record is held in memory at a time besides the mapped file.
+
+Names are returned as str and sequences as bytes, ready for np.frombuffer().
+"""
+import mmap
+import os
+
+WHITESPACE = b' \t\r\n\v\f'
+# Translation table to upper case, for bytes.translate()
+UPPER = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+def deleted_except(characters):
+    """Bytes to delete, with bytes.translate(), to keep only `characters` in a sequence."""
+    keep = set(characters)
+    return bytes(byte for byte in range(256) if byte not in keep)
+
+def parse_fasta(data, table=None, delete=WHITESPACE):
+    """Yield the (name, sequence) records of FASTA bytes (bytes, mmap or any buffer with find()).
+
+    Each sequence is translated with `table` and stripped of the `delete` characters, which must
+    include line breaks. Anything before the first header is ignored.
+    """
+    start = data.find(b'>')
+    while start != -1:
+        header_end = data.find(b'\n', start)
+        if header_end == -1:
+            header_end = len(data)
+        next_start = data.find(b'\n>', header_end)
+        end = len(data) if next_start == -1 else next_start + 1
+        name = data[start + 1:header_end].strip().decode()
+        yield name, data[header_end:end].translate(table, delete)
+        start = end if next_start != -1 else -1
+
+def read_fasta(path, table=None, delete=WHITESPACE):
+    """Yield the (name, sequence) records of a FASTA file lazily, from a memory map of it."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # Empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from parse_fasta(data, table, delete)
+
+def format_record(name, sequence, width=60):
+    """FASTA bytes of one record, the sequence (bytes) wrapped into lines of `width` characters."""
+    lines = [b'>' + name.encode()]
+    lines.extend(sequence[i:i + width] for i in range(0, len(sequence), width))
+    return b'\n'.join(lines) + b'\n'
+
+class FastaWriter:
+    """Writes FASTA records through a large buffer; `bytes_written` counts what was written."""
+
+    def __init__(self, path, width=60, buffer_size=1 << 20):
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.width = width
+        self.bytes_written = 0
+
+    def write(self, name, sequence):
+        self.bytes_written += self.file.write(format_record(name, sequence, self.width))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
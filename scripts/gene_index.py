@@ -0,0 +1,179 @@
+"""Local index of protein-coding genes (symbol -> gene ID, canonical transcript, chromosome).
+
+The index is built once per species from an Ensembl GTF file, a BioMart TSV export, or a single
+bulk BioMart query whose result is kept in "temp", and is stored in temp/gene_index.sqlite. Step 1
+then finds human genes and checks the other species with local joins; species without an index
+are checked with batched Ensembl lookups.
+
+    python scripts/gene_index.py human --gtf Homo_sapiens.GRCh38.112.gtf.gz
+    python scripts/gene_index.py mouse --tsv mart_export.txt
+    python scripts/gene_index.py human --biomart hsapiens_gene_ensembl
+"""
+import argparse
+import csv
+import gzip
+import os
+import re
+import sqlite3
+import time
+from xml.sax.saxutils import quoteattr
+import requests
+
+temp_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'temp')
+GENE_INDEX_PATH = os.path.join(temp_directory, 'gene_index.sqlite')
+# GTF or BioMart TSV file, or "biomart", used by step 1 to build the human index when it is missing.
+GENE_INDEX_SOURCE = os.environ.get('GENE_INDEX_SOURCE', '')
+ENSEMBL_BIOMART = os.environ.get('ENSEMBL_BIOMART', 'https://www.ensembl.org/biomart/martservice')
+# BioMart datasets of the species known by name; others can be given with --biomart.
+BIOMART_DATASETS = {'human': 'hsapiens_gene_ensembl', 'mouse': 'mmusculus_gene_ensembl', 'rat': 'rnorvegicus_gene_ensembl'}
+BIOMART_ATTRIBUTES = ['ensembl_gene_id', 'external_gene_name', 'gene_biotype', 'ensembl_transcript_id',
+                      'transcript_is_canonical', 'chromosome_name']
+
+# Column names accepted in TSV exports, for each field of the index
+TSV_COLUMNS = {
+    'gene_id': ('Gene stable ID', 'ensembl_gene_id', 'gene_id'),
+    'symbol': ('Gene name', 'external_gene_name', 'gene_name', 'symbol'),
+    'biotype': ('Gene type', 'gene_biotype', 'biotype'),
+    'transcript_id': ('Transcript stable ID', 'ensembl_transcript_id', 'transcript_id'),
+    'canonical': ('Ensembl Canonical', 'transcript_is_canonical', 'canonical'),
+    'chromosome': ('Chromosome/scaffold name', 'chromosome_name', 'chromosome'),
+}
+GTF_ATTRIBUTE = re.compile(r'(\S+) "([^"]*)"')
+
+def open_text(path):
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+def read_gtf(path):
+    """Yield (symbol, gene_id, transcript_id, chromosome) of the canonical transcript of every
+    named protein-coding gene of an Ensembl GTF file (transcripts tagged "Ensembl_canonical")."""
+    with open_text(path) as f:
+        for line in f:
+            # Cheap substring tests first: only a small fraction of the lines are canonical coding transcripts
+            if 'Ensembl_canonical' not in line or 'protein_coding' not in line or line.startswith('#'):
+                continue
+            fields = line.split('\t', 8)
+            if len(fields) < 9 or fields[2] != 'transcript':
+                continue
+            attributes = dict(GTF_ATTRIBUTE.findall(fields[8]))
+            if attributes.get('gene_biotype') == 'protein_coding' and attributes.get('gene_name'):
+                yield attributes['gene_name'], attributes['gene_id'], attributes['transcript_id'], fields[0]
+
+def read_tsv(path):
+    """Yield (symbol, gene_id, transcript_id, chromosome) of the canonical transcript of every
+    named protein-coding gene of a BioMart-style TSV export (one row per transcript)."""
+    with open_text(path) as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        columns = {}
+        for field, names in TSV_COLUMNS.items():
+            columns[field] = next((name for name in names if name in reader.fieldnames), None)
+        missing = [field for field in ('gene_id', 'symbol', 'transcript_id') if columns[field] is None]
+        if missing:
+            raise ValueError(f"{path} has no column for {', '.join(missing)}")
+        for row in reader:
+            if columns['biotype'] and row[columns['biotype']] != 'protein_coding':
+                continue
+            if columns['canonical'] and row[columns['canonical']] not in ('1', 'true', 'True'):
+                continue
+            if row[columns['symbol']]:
+                yield (row[columns['symbol']], row[columns['gene_id']], row[columns['transcript_id']],
+                       row[columns['chromosome']] if columns['chromosome'] else '')
+
+def download_biomart(dataset, path):
+    """Save the protein-coding transcripts of a BioMart dataset as TSV in a single bulk query."""
+    query = ('<?xml version="1.0" encoding="UTF-8"?><!DOCTYPE Query>'
+             '<Query virtualSchemaName="default" formatter="TSV" header="1" uniqueRows="1">'
+             f'<Dataset name={quoteattr(dataset)} interface="default">'
+             '<Filter name="biotype" value="protein_coding"/>'
+             + ''.join(f'<Attribute name="{attribute}"/>' for attribute in BIOMART_ATTRIBUTES) +
+             '</Dataset></Query>')
+    response = requests.get(ENSEMBL_BIOMART, params={'query': query}, stream=True, timeout=600)
+    response.raise_for_status()
+    with open(path + '.part', 'wb') as f:
+        for block in response.iter_content(1 << 20):
+            f.write(block)
+    # The header row (BioMart display names) is recognised by read_tsv()
+    os.replace(path + '.part', path)
+    return path
+
+class GeneIndex:
+    """SQLite table of protein-coding genes, one row per species and symbol (matched case-insensitively)."""
+
+    def __init__(self, path=GENE_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS genes (species TEXT, symbol TEXT COLLATE NOCASE, "
+                                    "gene_id TEXT, transcript_id TEXT, chromosome TEXT, "
+                                    "PRIMARY KEY (species, symbol)) WITHOUT ROWID")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS sources (species TEXT PRIMARY KEY, source TEXT, "
+                                    "genes INTEGER, built REAL)")
+
+    def build(self, species, rows, source):
+        """Replace the index of a species with (symbol, gene_id, transcript_id, chromosome) rows.
+        For symbols given to several genes, the first one is kept."""
+        species = species.lower()
+        with self.connection:
+            self.connection.execute("DELETE FROM genes WHERE species = ?", (species,))
+            self.connection.executemany("INSERT OR IGNORE INTO genes VALUES (?, ?, ?, ?, ?)",
+                                        ((species,) + tuple(row) for row in rows))
+            count = self.connection.execute("SELECT COUNT(*) FROM genes WHERE species = ?", (species,)).fetchone()[0]
+            self.connection.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)",
+                                    (species, source, count, time.time()))
+        return count
+
+    def has_species(self, species):
+        return self.connection.execute("SELECT 1 FROM sources WHERE species = ?", (species.lower(),)).fetchone() is not None
+
+    def source(self, species):
+        """(source, number of genes) of a species' index, or None."""
+        return self.connection.execute("SELECT source, genes FROM sources WHERE species = ?",
+                                       (species.lower(),)).fetchone()
+
+    def symbols(self, species, chromosomes=None):
+        """Symbols of a species' protein-coding genes, optionally restricted to some chromosomes. Genes
+        of unknown chromosome (TSV exports without a chromosome column) are not filtered out."""
+        rows = self.connection.execute("SELECT symbol, chromosome FROM genes WHERE species = ? ORDER BY symbol",
+                                       (species.lower(),))
+        return [symbol for symbol, chromosome in rows
+                if chromosomes is None or not chromosome or chromosome in chromosomes]
+
+    def common_symbols(self, symbols, species):
+        """The given symbols that also name a protein-coding gene of `species` (local join)."""
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (symbol TEXT PRIMARY KEY COLLATE NOCASE)")
+            self.connection.execute("DELETE FROM candidates")
+            self.connection.executemany("INSERT OR IGNORE INTO candidates VALUES (?)", ((s,) for s in symbols))
+            found = {row[0] for row in self.connection.execute(
+                "SELECT c.symbol FROM candidates AS c JOIN genes AS g ON g.symbol = c.symbol AND g.species = ?",
+                (species.lower(),))}
+        return [symbol for symbol in symbols if symbol in found]
+
+def build_index(index, species, source):
+    """Build the index of a species from a GTF or TSV file, or from BioMart with source "biomart"
+    or a BioMart dataset name. Downloads are kept in "temp" and reused. Returns the gene count."""
+    if os.path.exists(source):
+        rows = read_gtf(source) if re.search(r'\.gtf(\.gz)?$', source) else read_tsv(source)
+        return index.build(species, rows, os.path.abspath(source))
+    dataset = BIOMART_DATASETS.get(species.lower()) if source == 'biomart' else source
+    if dataset is None:
+        raise ValueError(f"No BioMart dataset known for {species}; pass its name, e.g. mmusculus_gene_ensembl")
+    path = os.path.join(temp_directory, f'biomart_{dataset}.tsv')
+    if not os.path.exists(path):
+        print(f"Downloading the protein-coding genes of {dataset} from {ENSEMBL_BIOMART}")
+        download_biomart(dataset, path)
+    return index.build(species, read_tsv(path), f"biomart:{dataset}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local protein-coding gene index of a species.")
+    parser.add_argument('species', help="Species name as typed in step 1, e.g. human or mouse.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--gtf', help="Ensembl GTF file (optionally gzipped).")
+    source.add_argument('--tsv', help="BioMart TSV export with gene ID, gene name, transcript ID and canonical flag.")
+    source.add_argument('--biomart', nargs='?', const='biomart', help="Query BioMart (optionally a dataset name).")
+    args = parser.parse_args()
+    start_time = time.time()
+    count = build_index(GeneIndex(), args.species, args.gtf or args.tsv or args.biomart)
+    print(f"Indexed {count} protein-coding genes of {args.species} in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    main()
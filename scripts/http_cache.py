@@ -0,0 +1,92 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+EVICT_INTERVAL = 500
+
+class HTTPCache:
+    """Content-addressed SQLite cache for decoded HTTP responses.
+
+    Entries are keyed by a hash of the method, endpoint, parameters, request body and
+    Ensembl release, so a new release never serves stale data. Entries older than
+    `ttl_days` are ignored and the least recently used ones are evicted once the cache
+    grows beyond `max_mb`.
+    """
+
+    def __init__(self, path, ttl_days=30, max_mb=2048):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0  # Size-based eviction is checked every EVICT_INTERVAL writes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, "
+                                    "body BLOB, size INTEGER, created REAL, accessed REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.evict()
+
+    @staticmethod
+    def make_key(method, path, params=None, payload=None, release=None):
+        """Hash everything that determines the content of a response."""
+        material = json.dumps([method, path, params or {}, payload, release], sort_keys=True)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired."""
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.connection:
+                self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, endpoint, value):
+        """Store a JSON-serialisable value and evict old entries if the cache is over its size limit."""
+        body = json.dumps(value).encode()
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, endpoint, body, len(body), now, now))
+            self.pending_writes += 1
+            due = self.pending_writes >= EVICT_INTERVAL
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until the cache fits in max_mb."""
+        with self.lock, self.connection:
+            self.pending_writes = 0
+            self.connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def get_meta(self, name, default=None):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, name, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, str(value)))
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"HTTP cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
@@ -0,0 +1,155 @@
+"""Ka/Ks of aligned coding sequences with the method of Li (1993) and Pamilo & Bianchi (1993),
+the method of seqinr's kaks() used by 5kaks.R.
+
+Every codon site is classified as nondegenerate (0), twofold (2) or fourfold (4) degenerate, and
+the differences between two codons are split into transitions and transversions at each class,
+averaging over the evolutionary pathways between them that avoid stop codons. All of this only
+depends on the two codons, so it is computed once for the 64 x 64 codon pairs; a sequence pair
+then reduces to counting its codon pairs (one bincount) and a product with that table.
+"""
+from functools import lru_cache
+from itertools import permutations
+
+import numpy as np
+
+BASES = "TCAG"
+AMINO_ACIDS = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"  # Standard genetic code
+CODONS = [a + b + c for a in BASES for b in BASES for c in BASES]
+GENETIC_CODE = dict(zip(CODONS, AMINO_ACIDS))
+PURINES = set("AG")
+
+# Ka and Ks reported for pairs too divergent to be corrected (saturation), as seqinr does
+SATURATED = 10.0
+
+def is_transition(base1, base2):
+    return (base1 in PURINES) == (base2 in PURINES)
+
+@lru_cache(maxsize=None)
+def site_classes(codon):
+    """Degeneracy class (0, 2 or 4) of each position of a codon; changes to stop codons count as nonsynonymous."""
+    classes = []
+    for position in range(3):
+        synonymous = sum(GENETIC_CODE[codon[:position] + base + codon[position + 1:]] == GENETIC_CODE[codon]
+                         for base in BASES if base != codon[position])
+        classes.append(0 if synonymous == 0 else 4 if synonymous == 3 else 2)
+    return classes
+
+CLASS_INDEX = {0: 0, 2: 1, 4: 2}
+
+def site_counts(codon):
+    """Number of nondegenerate, twofold and fourfold sites of a codon."""
+    counts = [0, 0, 0]
+    for site_class in site_classes(codon):
+        counts[CLASS_INDEX[site_class]] += 1
+    return counts
+
+def substitutions(codon1, codon2):
+    """Transitions and transversions at nondegenerate, twofold and fourfold sites between two
+    codons, averaged over the pathways that do not go through a stop codon. The class of a site
+    is the mean of its class in the codons before and after each step."""
+    differing = [position for position in range(3) if codon1[position] != codon2[position]]
+    transitions, transversions = np.zeros(3), np.zeros(3)
+    if not differing:
+        return transitions, transversions
+    pathways = []
+    for order in permutations(differing):
+        steps, codon = [], codon1
+        for position in order:
+            following = codon[:position] + codon2[position] + codon[position + 1:]
+            steps.append((codon, following, position))
+            codon = following
+        pathways.append(steps)
+    valid = [steps for steps in pathways if all(GENETIC_CODE[after] != '*' for _, after, _ in steps[:-1])]
+    for steps in valid or pathways:
+        for before, after, position in steps:
+            counts = transitions if is_transition(before[position], after[position]) else transversions
+            for codon in (before, after):
+                counts[CLASS_INDEX[site_classes(codon)[position]]] += 0.5 / len(valid or pathways)
+    return transitions, transversions
+
+def build_pair_table():
+    """(4096, 9) table of L0, L2, L4, transitions at classes 0/2/4 and transversions at classes
+    0/2/4 for every codon pair, indexed by 64 * codon1 + codon2. Pairs involving a stop codon
+    are all zeros, i.e. left out of the comparison."""
+    table = np.zeros((64 * 64, 9))
+    for i, codon1 in enumerate(CODONS):
+        for j, codon2 in enumerate(CODONS):
+            if GENETIC_CODE[codon1] == '*' or GENETIC_CODE[codon2] == '*':
+                continue
+            sites = (np.array(site_counts(codon1)) + np.array(site_counts(codon2))) / 2
+            transitions, transversions = substitutions(codon1, codon2)
+            table[64 * i + j] = np.concatenate([sites, transitions, transversions])
+    return table
+
+PAIR_TABLE = build_pair_table()
+
+# Byte -> base index in CODONS order (T, C, A, G), anything else (gaps, frameshifts "!", N) -> 255
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+for code, base in enumerate(BASES):
+    BASE_CODES[ord(base)] = BASE_CODES[ord(base.lower())] = code
+
+def codon_matrix(sequences):
+    """Codon indices (0-63) of aligned sequences, one row per sequence. As with seqinr's default
+    rmgap=TRUE, codon columns containing a gap or an ambiguous base in any sequence are removed."""
+    n_codons = min(len(sequence) for sequence in sequences) // 3
+    # Sequences are bytes as read by fasta.py, or str
+    sequences = [s[:3 * n_codons] if isinstance(s, bytes) else s[:3 * n_codons].encode('ascii') for s in sequences]
+    bases = np.stack([BASE_CODES[np.frombuffer(sequence, dtype=np.uint8)]
+                      for sequence in sequences]).reshape(len(sequences), n_codons, 3)
+    complete = (bases != 255).all(axis=(0, 2))
+    bases = bases[:, complete].astype(np.int64)
+    return bases[:, :, 0] * 16 + bases[:, :, 1] * 4 + bases[:, :, 2]
+
+def li93(counts):
+    """Ka and Ks from L0, L2, L4, transitions and transversions at classes 0/2/4 (last axis of `counts`)."""
+    counts = np.asarray(counts, dtype=float)
+    sites, transitions, transversions = counts[..., 0:3], counts[..., 3:6], counts[..., 6:9]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P = np.where(sites > 0, transitions / sites, 0)
+        Q = np.where(sites > 0, transversions / sites, 0)
+        saturated = ((1 - 2 * P - Q) <= 0).any(axis=-1) | ((1 - 2 * Q) <= 0).any(axis=-1)
+        a = np.log(np.where(saturated[..., None], 1, 1 - 2 * P - Q))
+        b = np.log(np.where(saturated[..., None], 1, 1 - 2 * Q))
+        A = -0.5 * a + 0.25 * b  # Transitional component, 0.5 ln(1/(1-2P-Q)) - 0.25 ln(1/(1-2Q))
+        B = -0.5 * b  # Transversional component, 0.5 ln(1/(1-2Q))
+        L0, L2, L4 = sites[..., 0], sites[..., 1], sites[..., 2]
+        ks = (L2 * A[..., 1] + L4 * A[..., 2]) / (L2 + L4) + B[..., 2]
+        ka = A[..., 0] + (L0 * B[..., 0] + L2 * B[..., 1]) / (L0 + L2)
+    return np.where(saturated, SATURATED, ka), np.where(saturated, SATURATED, ks)
+
+def kaks_matrices(sequences, pairs=None):
+    """Ka and Ks matrices (n x n, zero diagonal) of every pair of aligned coding sequences, or only of
+    `pairs`, a list of (i, j) sequence indices, the others being NaN. The codon columns removed are the
+    same either way (those with a gap in any sequence)."""
+    codons = codon_matrix(sequences)
+    n = len(sequences)
+    if pairs is None:
+        rows, columns = np.triu_indices(n, k=1)
+    else:
+        rows, columns = np.array(pairs, dtype=np.int64).reshape(-1, 2).T
+    # Count the codon pairs of all sequence pairs at once: pair p uses bins [4096 p, 4096 (p + 1))
+    pair_codes = 64 * codons[rows] + codons[columns] + 4096 * np.arange(len(rows))[:, None]
+    pair_counts = np.bincount(pair_codes.ravel(), minlength=4096 * len(rows)).reshape(len(rows), 4096)
+    ka_pairs, ks_pairs = li93(pair_counts @ PAIR_TABLE)
+    ka, ks = np.full((n, n), np.nan), np.full((n, n), np.nan)
+    np.fill_diagonal(ka, 0)
+    np.fill_diagonal(ks, 0)
+    ka[rows, columns] = ka[columns, rows] = ka_pairs
+    ks[rows, columns] = ks[columns, rows] = ks_pairs
+    return ka, ks
+
+def kaks_pair_reference(sequence1, sequence2):
+    """Ka and Ks of two aligned sequences (bytes or str), one codon at a time; reference for kaks_matrices()."""
+    sequence1, sequence2 = (s.decode('ascii') if isinstance(s, bytes) else s for s in (sequence1, sequence2))
+    totals = np.zeros(9)
+    for position in range(0, min(len(sequence1), len(sequence2)) - 2, 3):
+        codon1, codon2 = sequence1[position:position + 3].upper(), sequence2[position:position + 3].upper()
+        if codon1 not in GENETIC_CODE or codon2 not in GENETIC_CODE:
+            continue
+        if GENETIC_CODE[codon1] == '*' or GENETIC_CODE[codon2] == '*':
+            continue
+        transitions, transversions = substitutions(codon1, codon2)
+        sites = (np.array(site_counts(codon1)) + np.array(site_counts(codon2))) / 2
+        totals += np.concatenate([sites, transitions, transversions])
+    ka, ks = li93(totals)
+    return float(ka), float(ks)
@@ -0,0 +1,184 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from telemetry import process_usage, reset_peak_rss
+
+scripts_directory = os.path.dirname(os.path.abspath(__file__))
+DRIVER_SOURCE = os.path.join(scripts_directory, 'MacseDriver.java')
+MACSE_MAIN_CLASS = 'main.MacseMain'
+
+# "process" starts `java -jar` for every gene; "pool" keeps one long-lived JVM per worker process.
+ALIGN_BACKEND = os.environ.get('ALIGN_BACKEND', 'process')
+# Seconds after which a single alignment is abandoned (0: no limit).
+ALIGN_TIMEOUT = float(os.environ.get('ALIGN_TIMEOUT', '0'))
+# Number of jobs after which a warm JVM is replaced, so state kept by MACSE between runs cannot build up.
+JVM_RECYCLE_AFTER = int(os.environ.get('JVM_RECYCLE_AFTER', '500'))
+# Seconds allowed for a JVM to start and compile the driver.
+JVM_START_TIMEOUT = 120
+
+class AlignmentError(Exception):
+    """Raised when the aligner reports an error, crashes or times out."""
+
+class AlignerStartError(AlignmentError):
+    """Raised when a long-lived aligner process cannot be started."""
+
+class ProcessAligner:
+    """Runs every alignment in a fresh process, e.g. `java -jar macse.jar <arguments>`."""
+
+    def __init__(self, command):
+        self.command = list(command)
+        # (CPU seconds, peak RSS in MB, peak of this alignment only) of the last alignment
+        self.last_usage = None
+
+    def align(self, arguments, timeout=None):
+        self.last_usage = None
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(self.command + list(arguments), stdout=stdout, stderr=stderr)
+            # The child is reaped with wait4(), which returns its own CPU time and peak RSS (the
+            # RUSAGE_CHILDREN peak would be the largest of all the children of this process so far)
+            deadline = time.monotonic() + timeout if timeout else None
+            delay = 0.001
+            while True:
+                pid, status, usage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+                if pid:
+                    break
+                if time.monotonic() > deadline:
+                    process.kill()
+                    os.wait4(process.pid, 0)
+                    process.returncode = -9
+                    raise AlignmentError(f"alignment timed out after {timeout} s")
+                time.sleep(delay)
+                delay = min(2 * delay, 0.1)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            self.last_usage = (usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, True)
+            stdout.seek(0)
+            stderr.seek(0)
+            if process.returncode != 0:
+                raise AlignmentError(f"aligner exited with status {process.returncode}: "
+                                     f"{stderr.read().decode(errors='replace').strip()[-500:]}")
+            return stdout.read().decode(errors='replace')
+
+    def close(self):
+        pass
+
+class WarmJVMAligner:
+    """Sends alignments to a long-lived process speaking the MacseDriver protocol.
+
+    The process reads tab-separated arguments on stdin and answers one "OK" or "ERROR" line
+    per job. It is started on first use, restarted after a crash or a timeout, and recycled
+    after `recycle_after` jobs. Its stderr (MACSE's log) is appended to `log_path`. The driver
+    exits by itself when its stdin is closed, i.e. when the owning Python process ends.
+    """
+
+    def __init__(self, command, log_path=os.devnull, recycle_after=JVM_RECYCLE_AFTER):
+        self.command = list(command)
+        self.log_path = log_path
+        self.recycle_after = recycle_after
+        self.process = None
+        self.lines = None
+        self.jobs_done = 0
+        self.restarts = 0
+        # (CPU seconds, peak RSS in MB, peak of this alignment only) of the last alignment; the peak is
+        # that of the JVM since it started where it cannot be reset before each alignment
+        self.last_usage = None
+
+    def _start(self):
+        self.log = open(self.log_path, 'a')
+        try:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=self.log, text=True, bufsize=1)
+        except OSError as e:
+            self.log.close()
+            raise AlignerStartError(f"cannot start {self.command[0]}: {e}")
+        # A reader thread turns the answers into a queue, so waiting for one can time out.
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_answers, args=(self.process.stdout, self.lines), daemon=True).start()
+        self.jobs_done = 0
+        if self._answer(JVM_START_TIMEOUT) != 'READY':
+            self.close()
+            raise AlignerStartError(f"aligner process did not start: {' '.join(self.command)}")
+
+    @staticmethod
+    def _read_answers(stream, lines):
+        for line in stream:
+            lines.put(line.rstrip('\n'))
+        lines.put(None)  # End of stream: the process exited
+
+    def _answer(self, timeout):
+        try:
+            return self.lines.get(timeout=timeout or None)
+        except queue.Empty:
+            return 'TIMEOUT'
+
+    def align(self, arguments, timeout=None):
+        if self.process is None or self.process.poll() is not None or self.jobs_done >= self.recycle_after:
+            if self.process is not None:
+                self.restarts += 1
+            self.close()
+            self._start()
+        peak_reset = reset_peak_rss(self.process.pid)
+        before = process_usage(self.process.pid)
+        self.process.stdin.write('\t'.join(arguments) + '\n')
+        self.process.stdin.flush()
+        answer = self._answer(timeout)
+        self.jobs_done += 1
+        after = process_usage(self.process.pid)
+        self.last_usage = (after[0] - before[0], after[1], peak_reset) if before and after else None
+        if answer is None or answer == 'TIMEOUT':
+            # The JVM crashed or is stuck: kill it, the next job starts a fresh one.
+            self.close()
+            raise AlignmentError("alignment timed out" if answer else "aligner process crashed")
+        status, _, message = answer.partition('\t')
+        if status != 'OK':
+            if 'OutOfMemoryError' in message:
+                self.close()
+            raise AlignmentError(message)
+        return message
+
+    def close(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process.stdin.close()
+            self.log.close()
+            self.process = None
+
+def java_command(java_options=()):
+    return ['java'] + list(java_options)
+
+def make_aligner(jar_path, backend=ALIGN_BACKEND, java_options=(), log_path=os.devnull):
+    """Create the aligner selected by ALIGN_BACKEND for the MACSE jar."""
+    if backend == 'process':
+        return ProcessAligner(java_command(java_options) + ['-jar', jar_path])
+    if backend == 'pool':
+        return WarmJVMAligner(java_command(java_options) + ['-cp', jar_path, DRIVER_SOURCE, MACSE_MAIN_CLASS],
+                              log_path)
+    raise ValueError(f"Unknown alignment backend: {backend}")
+
+class FallbackAligner:
+    """Uses the warm JVM backend, and switches to one process per gene if the JVM cannot start
+    (e.g. with Java 8, which cannot run the driver from source)."""
+
+    def __init__(self, jar_path, java_options=(), log_path=os.devnull):
+        self.jar_path = jar_path
+        self.java_options = java_options
+        self.aligner = make_aligner(jar_path, 'pool', java_options, log_path)
+
+    @property
+    def last_usage(self):
+        return self.aligner.last_usage
+
+    def align(self, arguments, timeout=None):
+        try:
+            return self.aligner.align(arguments, timeout)
+        except AlignerStartError:
+            print("Warm JVM backend unavailable, starting one Java process per gene instead.")
+            self.aligner = make_aligner(self.jar_path, 'process', self.java_options)
+            return self.aligner.align(arguments, timeout)
+
+    def close(self):
+        self.aligner.close()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+base_directory = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+MANIFEST_PATH = os.path.join(base_directory, 'temp', 'manifest.sqlite')
+# Set by `mastercode.py --resume`: skip work whose manifest entry is complete and up to date.
+RESUME = os.environ.get('PIPELINE_RESUME', '') not in ('', '0')
+
+def file_digest(path):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def inputs_digest(*values, files=(), contents=()):
+    """Single digest of JSON-serialisable parameters and of the names and contents of input files.
+    `contents` are (file name, bytes) pairs of inputs kept elsewhere than in files, hashed as files would be."""
+    digest = hashlib.sha256(json.dumps(values, sort_keys=True).encode())
+    for path in sorted(files):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    for name, data in sorted(contents):
+        digest.update(name.encode())
+        digest.update(hashlib.sha256(data).hexdigest().encode())
+    return digest.hexdigest()
+
+class Manifest:
+    """Record of the work done by one pipeline step, one entry per item (gene or gene/species).
+
+    Each entry stores a digest of the item's inputs, the digests of the files it produced and
+    a status. An item is complete when its status is "done" (or another final status), its
+    inputs have not changed and its outputs are still on disk with the same content.
+    """
+
+    def __init__(self, step, path=MANIFEST_PATH):
+        self.step = step
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entries (step TEXT, item TEXT, inputs TEXT, "
+                                    "outputs TEXT, status TEXT, updated REAL, PRIMARY KEY (step, item))")
+
+    def entry(self, item):
+        """Return (inputs, outputs, status) recorded for an item, or None."""
+        row = self.connection.execute("SELECT inputs, outputs, status FROM entries WHERE step = ? AND item = ?",
+                                      (self.step, item)).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def is_complete(self, item, inputs, final_statuses=('done',)):
+        """True if the item was finished with the same inputs and its outputs are unchanged on disk."""
+        entry = self.entry(item)
+        if entry is None or entry[0] != inputs or entry[2] not in final_statuses:
+            return False
+        for relative_path, digest in entry[1].items():
+            path = os.path.join(base_directory, relative_path)
+            if not os.path.exists(path) or file_digest(path) != digest:
+                return False
+        return True
+
+    def record(self, item, inputs, outputs=(), status='done'):
+        """Store the outcome of an item, hashing the output files it produced."""
+        self.record_many([(item, inputs, outputs, status)])
+
+    def record_many(self, entries):
+        """Store several (item, inputs, outputs, status) outcomes in a single transaction."""
+        rows = []
+        for item, inputs, outputs, status in entries:
+            digests = {os.path.relpath(os.path.abspath(path), base_directory): file_digest(path)
+                       for path in outputs if os.path.exists(path)}
+            rows.append((self.step, item, inputs, json.dumps(digests), status, time.time()))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def merge_from(self, path):
+        """Copy every entry of another manifest database (e.g. written by a shard) into this one."""
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO entries SELECT * FROM other.entries")
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+
+    def rename_outputs(self, old_directory, new_directory):
+        """Update the output paths recorded by this step after a directory of outputs was renamed."""
+        old_prefix = os.path.relpath(os.path.abspath(old_directory), base_directory) + os.sep
+        new_prefix = os.path.relpath(os.path.abspath(new_directory), base_directory) + os.sep
+        rows = []
+        for item, outputs in self.connection.execute("SELECT item, outputs FROM entries WHERE step = ?", (self.step,)):
+            digests = json.loads(outputs)
+            renamed = {new_prefix + path[len(old_prefix):] if path.startswith(old_prefix) else path: digest
+                       for path, digest in digests.items()}
+            if renamed != digests:
+                rows.append((json.dumps(renamed), self.step, item))
+        with self.connection:
+            self.connection.executemany("UPDATE entries SET outputs = ? WHERE step = ? AND item = ?", rows)
+        return len(rows)
+
+    def statuses(self):
+        """Map every recorded item of this step to its status."""
+        return dict(self.connection.execute("SELECT item, status FROM entries WHERE step = ?", (self.step,)))
@@ -0,0 +1,206 @@
+"""Streaming mode of steps 2 to 4, run by `mastercode.py --stream` after step 1 and before step 5.
+
+A gene is sent to alignment as soon as its CDS have been fetched in every species, and each
+alignment goes straight to QC. Genes waiting for an aligner sit in a bounded queue: when it is
+full, the fetch thread blocks and sends no further CDS requests until alignment catches up. The
+files written are the same as with steps 2 to 4 run one after the other, and Ka/Ks is computed
+by 5kaks.R afterwards as in batch mode. With PIPELINE_KAKS=python (`mastercode.py --stream
+--python-kaks`), the alignments passing QC also go straight to the Python Ka/Ks of 5kaks.py,
+which has not yet been validated against 5kaks.R.
+"""
+import importlib
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from cds_store import CDS_STORE, close_stores, has_gene, open_store
+from macse_backend import ALIGN_TIMEOUT
+from manifest import Manifest, inputs_digest, RESUME
+from results_store import ResultsStore
+from scheduling import ALIGN_HEAP_MB, gene_size, gene_timeout, plan_workers
+
+fetch_step = importlib.import_module('2CDS_fetcher')
+align_step = importlib.import_module('3align')
+qc_step = importlib.import_module('4qualityMOS')
+kaks_step = importlib.import_module('5kaks')
+
+# Genes fetched in every species that may wait for an aligner before the fetch is paused.
+PIPELINE_QUEUE = int(os.environ.get('PIPELINE_QUEUE', '64'))
+# Processes running QC and Ka/Ks of finished alignments, next to the alignment workers.
+PIPELINE_ANALYSIS_WORKERS = int(os.environ.get('PIPELINE_ANALYSIS_WORKERS', '1'))
+# "python" to compute Ka/Ks of each gene with 5kaks.py in the pipeline; otherwise 5kaks.R runs after it.
+PIPELINE_KAKS = os.environ.get('PIPELINE_KAKS', 'R').lower()
+
+class StageStats:
+    """Items completed by one stage, with the time of the first and last completion."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.max_backlog = 0
+
+    def done(self):
+        self.last = time.monotonic()
+        self.first = self.first or self.last
+        self.count += 1
+
+    def backlog(self, size):
+        self.max_backlog = max(self.max_backlog, size)
+
+    def report(self, start):
+        if not self.count:
+            return f"{self.name:>6}: no items"
+        elapsed = self.last - start
+        return (f"{self.name:>6}: {self.count} genes, {self.count / elapsed if elapsed else 0:.2f} genes/s, "
+                f"first after {self.first - start:.1f} s, last after {elapsed:.1f} s, max backlog {self.max_backlog}")
+
+def analyse_alignment(path):
+    """QC of one alignment and, with PIPELINE_KAKS=python, the Ka/Ks of an alignment that passes the
+    MOS threshold (steps 4 and 5 for one gene)."""
+    row = qc_step.qc_alignment(path)
+    if row is None or row["mos"] < qc_step.mos_threshold or PIPELINE_KAKS != 'python':
+        return row, None
+    return row, kaks_step.gene_kaks(path)
+
+def main():
+    base_directory = os.getcwd()
+    temp_directory = os.path.join(base_directory, 'temp')
+    results_directory = os.path.join(base_directory, 'results')
+    with open(fetch_step.list_file_path, 'r') as f:
+        lines = f.read().splitlines()
+        spc, symbols = lines[0].split(', '), lines[1:]
+
+    output_dir = os.path.join(results_directory, f"Fetched CDS sequences for {'_'.join(spc)}")
+    alignments_dir_name = "1Alignments_" + '_'.join(spc)
+    alignments_dir = os.path.join(results_directory, alignments_dir_name)
+    if CDS_STORE == 'files':
+        os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(alignments_dir, exist_ok=True)
+    jar_path = os.path.join(base_directory, 'scripts', 'macse_v2.07.jar')
+    log_file_path = os.path.join(temp_directory, 'log.txt')
+    max_workers = plan_workers()
+    java_options = [f'-Xmx{ALIGN_HEAP_MB}m']
+    release = fetch_step.client.release
+    print(f"Streaming {len(symbols)} genes in {', '.join(spc)}: {max_workers} alignment workers, "
+          f"{PIPELINE_ANALYSIS_WORKERS} QC workers, queue of {PIPELINE_QUEUE} genes")
+    if PIPELINE_KAKS == 'python':
+        print("Warning: Ka/Ks is computed with 5kaks.py, whose values have not yet been validated against "
+              "5kaks.R (benchmarks/validate_kaks.py)")
+
+    # Fetch thread: a gene is queued once all its species are settled; put() blocks while the queue is full.
+    ready = queue.Queue(maxsize=PIPELINE_QUEUE)
+    settled = Counter()
+    fetch_errors = []
+
+    def on_item(symbol, species):
+        settled[symbol] += 1
+        if settled[symbol] == len(spc):
+            ready.put(symbol)
+
+    def run_fetch():
+        try:
+            fetch_step.fetch_all_cds(symbols, spc, output_dir, None, Manifest('fetch'), RESUME, on_item)
+        except Exception as e:
+            fetch_errors.append(e)
+        finally:
+            if CDS_STORE == 'sqlite':
+                close_stores(output_dir)  # The writer of this thread, so that the store can be sealed
+            ready.put(None)
+
+    align_manifest, qc_manifest, kaks_manifest = Manifest('align'), Manifest('qc'), Manifest('kaks')
+    store = ResultsStore(os.path.join(results_directory, 'kaks.sqlite')) if PIPELINE_KAKS == 'python' else None
+    stages = ('fetch', 'align', 'qc', 'kaks') if PIPELINE_KAKS == 'python' else ('fetch', 'align', 'qc')
+    stats = {name: StageStats(name) for name in stages}
+    align_futures, analysis_futures = {}, {}
+    qc_rows, passing_genes = [], []
+    fetch_finished = False
+
+    start = time.monotonic()
+    fetch_thread = threading.Thread(target=run_fetch, daemon=True)
+    fetch_thread.start()
+    with ProcessPoolExecutor(max_workers=max_workers) as align_pool, \
+            ProcessPoolExecutor(max_workers=PIPELINE_ANALYSIS_WORKERS) as analysis_pool:
+        while not fetch_finished or align_futures or analysis_futures:
+            stats['fetch'].backlog(ready.qsize())
+            # Keep at most two genes per alignment worker in flight; the rest waits in `ready`.
+            while not fetch_finished and len(align_futures) < 2 * max_workers:
+                try:
+                    symbol = ready.get(timeout=0 if align_futures or analysis_futures else 0.1)
+                except queue.Empty:
+                    break
+                if symbol is None:
+                    fetch_finished = True
+                    break
+                stats['fetch'].done()
+                gene_dir = os.path.join(output_dir, symbol)
+                if not has_gene(gene_dir):
+                    continue  # No CDS in any species
+                inputs = align_step.gene_inputs_digest(gene_dir, jar_path)
+                aligned_file = os.path.join(alignments_dir, f"alignment_{symbol}.fasta")
+                if RESUME and align_manifest.is_complete(symbol, inputs):
+                    stats['align'].done()
+                    analysis_futures[analysis_pool.submit(analyse_alignment, aligned_file)] = aligned_file
+                    continue
+                task = (gene_dir, jar_path, alignments_dir, log_file_path,
+                        gene_timeout(gene_size(gene_dir), ALIGN_TIMEOUT), java_options)
+                align_futures[align_pool.submit(align_step.process_gene_dir, task)] = (symbol, inputs, aligned_file)
+            stats['align'].backlog(len(align_futures))
+            stats['qc'].backlog(len(analysis_futures))
+
+            if not align_futures and not analysis_futures:
+                continue
+            done, _ = wait(list(align_futures) + list(analysis_futures), timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in align_futures:
+                    symbol, inputs, aligned_file = align_futures.pop(future)
+                    _, success, _ = future.result()
+                    align_manifest.record(symbol, inputs, [aligned_file] if success else (),
+                                          'done' if success else 'failed')
+                    stats['align'].done()
+                    if success:
+                        analysis_futures[analysis_pool.submit(analyse_alignment, aligned_file)] = aligned_file
+                    continue
+                path = analysis_futures.pop(future)
+                row, kaks_result = future.result()
+                stats['qc'].done()
+                if row is None:
+                    continue
+                qc_rows.append(row)
+                qc_manifest.record(row["file"], inputs_digest(files=[path]), (),
+                                   "pass" if row["mos"] >= qc_step.mos_threshold else "fail")
+                if kaks_result is not None:
+                    gene_name, gene_results = kaks_result
+                    store.record_gene(gene_name, release, gene_results)
+                    kaks_manifest.record(row["file"], inputs_digest(release, files=[path]))
+                    passing_genes.append(gene_name)
+                    stats['kaks'].done()
+    fetch_thread.join()
+    if fetch_errors:
+        raise fetch_errors[0]
+    if CDS_STORE == 'sqlite':
+        # As step 2 does, so that shards of step 3 on other nodes can read it
+        close_stores(output_dir)
+        open_store(output_dir, writer=True).seal()
+
+    # Same final files as the batch steps: QC table, alignfolder.txt, and with 5kaks.py its results
+    qc_step.write_qc_table(os.path.join(results_directory, f"{alignments_dir_name}_qc.tsv"), qc_rows,
+                           qc_step.mos_threshold)
+    with open(os.path.join(temp_directory, 'alignfolder.txt'), 'w') as f:
+        f.write(alignments_dir_name)
+    if PIPELINE_KAKS == 'python':
+        store.keep_genes(release, passing_genes)
+        kaks_step.print_summary(store, release)
+        if kaks_step.kaks_excel:
+            kaks_step.export_excel(store, release, results_directory)
+
+    print(f"Per-stage throughput (total {time.monotonic() - start:.1f} s):")
+    for stage in stats.values():
+        print(stage.report(start))
+    print(fetch_step.client.summary())
+
+if __name__ == "__main__":
+    main()
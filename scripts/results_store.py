@@ -0,0 +1,102 @@
+import math
+import os
+import sqlite3
+import time
+
+base_directory = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+RESULTS_STORE_PATH = os.path.join(base_directory, 'results', 'kaks.sqlite')
+# Ka/Ks ratios outside [0, MAX_KAKS] (and infinite ones) are stored but treated as missing
+MAX_KAKS = 50
+
+class ResultsStore:
+    """SQLite table of step 5 results, one row per (gene, species pair, Ensembl release).
+
+    Rows are written as each gene finishes, so an interrupted run keeps its results, and
+    summaries are computed with SQL aggregates instead of re-reading an Excel file.
+    """
+
+    def __init__(self, path=RESULTS_STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS kaks (gene TEXT, species_pair TEXT, release TEXT, "
+                                    "ka REAL, ks REAL, ka_ks REAL, updated REAL, "
+                                    "PRIMARY KEY (gene, species_pair, release))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS kaks_pair ON kaks (release, species_pair)")
+
+    def record_gene(self, gene, release, pairs):
+        """Replace the results of a gene with `pairs`, a dict of species pair -> (ka, ks, ka_ks), where
+        ka_ks is rounded to 3 decimals as in output_results.xlsx."""
+        now = time.time()
+        with self.connection:
+            self.connection.execute("DELETE FROM kaks WHERE gene = ? AND release = ?", (gene, release))
+            self.connection.executemany("INSERT INTO kaks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        [(gene, pair, release, ka, ks, ka_ks, now)
+                                         for pair, (ka, ks, ka_ks) in pairs.items()])
+
+    def record_pairs(self, gene, release, pairs):
+        """Add or replace some species pairs of a gene, keeping its other results as they are."""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO kaks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        [(gene, pair, release, ka, ks, ka_ks, now)
+                                         for pair, (ka, ks, ka_ks) in pairs.items()])
+
+    def keep_genes(self, release, genes):
+        """Delete the results of a release for genes not in `genes` (e.g. that no longer pass QC)."""
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS kept (gene TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM kept")
+            self.connection.executemany("INSERT OR IGNORE INTO kept VALUES (?)", [(gene,) for gene in genes])
+            self.connection.execute("DELETE FROM kaks WHERE release = ? AND gene NOT IN (SELECT gene FROM kept)",
+                                    (release,))
+
+    def genes(self, release):
+        """Genes with results stored for a release."""
+        return {row[0] for row in self.connection.execute("SELECT DISTINCT gene FROM kaks WHERE release = ?",
+                                                          (release,))}
+
+    def species_pairs(self, release):
+        """Species pairs of a release, in order of the first gene (by name) that has them."""
+        first_genes = self.connection.execute(
+            "SELECT species_pair, MIN(gene) FROM kaks WHERE release = ? GROUP BY species_pair", (release,)).fetchall()
+        keys = []
+        for pair, gene in first_genes:
+            rowid = self.connection.execute("SELECT rowid FROM kaks WHERE gene = ? AND species_pair = ? AND release = ?",
+                                            (gene, pair, release)).fetchone()[0]
+            keys.append((gene, rowid, pair))
+        return [pair for _, _, pair in sorted(keys)]
+
+    def summary(self, release):
+        """(species_pair, mean, sample sd, count) of the valid Ka/Ks ratios of every species pair.
+
+        Ratios are stored rounded to 3 decimals, so the sums are taken over integers (thousandths):
+        they are exact and do not depend on the order in which genes were recorded."""
+        rows = self.connection.execute(
+            "SELECT species_pair, COUNT(ka_ks), SUM(CAST(ROUND(ka_ks * 1000) AS INTEGER)), "
+            "SUM(CAST(ROUND(ka_ks * 1000) AS INTEGER) * CAST(ROUND(ka_ks * 1000) AS INTEGER)) FROM kaks "
+            "WHERE release = ? AND ka_ks BETWEEN 0 AND ? GROUP BY species_pair", (release, MAX_KAKS)).fetchall()
+        order = {pair: index for index, pair in enumerate(self.species_pairs(release))}
+        summary = []
+        for pair, count, total, squares in rows:
+            mean = total / count / 1000
+            sd = math.sqrt((count * squares - total * total) / (count * (count - 1))) / 1000 if count > 1 else None
+            summary.append((pair, mean, sd, count))
+        return sorted(summary, key=lambda row: order[row[0]])
+
+    def wide_table(self, release):
+        """(columns, rows) with one row per gene and one Ka/Ks column per species pair, in the layout
+        of output_results.xlsx; invalid ratios are None."""
+        pairs = self.species_pairs(release)
+        column = {pair: index for index, pair in enumerate(pairs)}
+        rows, current = [], None
+        for gene, pair, ka_ks in self.connection.execute(
+                "SELECT gene, species_pair, ka_ks FROM kaks WHERE release = ? ORDER BY gene", (release,)):
+            if current is None or current[0] != gene:
+                current = [gene, str(len(rows) + 1)] + [None] * len(pairs)
+                rows.append(current)
+            if ka_ks is not None and 0 <= ka_ks <= MAX_KAKS:
+                current[2 + column[pair]] = ka_ks
+        return ["gene", "gene_id"] + pairs, rows
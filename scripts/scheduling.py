@@ -0,0 +1,111 @@
+import os
+import cds_store
+
+# Java heap given to each MACSE JVM (-Xmx), in MB.
+ALIGN_HEAP_MB = int(os.environ.get('ALIGN_HEAP_MB', '2048'))
+# Memory used by a JVM beyond its heap (metaspace, JIT, thread stacks), in MB.
+JVM_OVERHEAD_MB = 512
+# Fraction of the available memory that alignment workers may use.
+MEMORY_FRACTION = 0.8
+# Number of alignment workers; 0 sizes the pool from the available cores and memory.
+ALIGN_WORKERS = int(os.environ.get('ALIGN_WORKERS', '0'))
+# Per-gene timeout: fixed base plus an allowance per kilobyte of combined CDS, in seconds.
+ALIGN_TIMEOUT_BASE = float(os.environ.get('ALIGN_TIMEOUT_BASE', '600'))
+ALIGN_TIMEOUT_PER_KB = float(os.environ.get('ALIGN_TIMEOUT_PER_KB', '60'))
+
+def usable_cpus():
+    """Number of CPUs this process may run on (honours affinity masks set by batch schedulers)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def cgroup_memory_mb():
+    """Memory left under the limit of this process's cgroup (v2 memory.max or v1 memory.limit_in_bytes,
+    as set by SLURM or a container runtime), in MB, or None if there is no limit. Inactive page cache
+    is counted as free, since the kernel reclaims it before reaching the limit."""
+    try:
+        with open('/proc/self/cgroup') as f:
+            entries = [line.rstrip('\n').split(':', 2) for line in f]
+    except OSError:
+        return None
+    candidates = []
+    for _, controllers, path in entries:
+        if controllers == '':
+            names, root = ('memory.max', 'memory.current', 'inactive_file'), '/sys/fs/cgroup'
+        elif 'memory' in controllers.split(','):
+            names, root = ('memory.limit_in_bytes', 'memory.usage_in_bytes', 'total_inactive_file'), '/sys/fs/cgroup/memory'
+        else:
+            continue
+        # Inside a container the cgroup of the process is usually mounted as the root of the hierarchy
+        candidates += [(os.path.join(root, path.lstrip('/')),) + names, (root,) + names]
+    for directory, limit_name, usage_name, inactive_name in candidates:
+        try:
+            with open(os.path.join(directory, limit_name)) as f:
+                limit = f.read().strip()
+            with open(os.path.join(directory, usage_name)) as f:
+                usage = int(f.read())
+        except (OSError, ValueError):
+            continue
+        if limit == 'max' or int(limit) >= 1 << 60:  # No limit (cgroup v2, v1)
+            return None
+        inactive = 0
+        try:
+            with open(os.path.join(directory, 'memory.stat')) as f:
+                inactive = next((int(line.split()[1]) for line in f if line.split()[0] == inactive_name), 0)
+        except (OSError, ValueError, IndexError):
+            pass
+        return max(0, int(limit) - usage + inactive) // (1024 * 1024)
+    return None
+
+def slurm_memory_mb():
+    """Memory allocated to this SLURM job step (--mem or --mem-per-cpu), in MB, or None outside SLURM."""
+    if os.environ.get('SLURM_MEM_PER_NODE'):
+        return int(os.environ['SLURM_MEM_PER_NODE'])
+    if os.environ.get('SLURM_MEM_PER_CPU'):
+        return int(os.environ['SLURM_MEM_PER_CPU']) * usable_cpus()
+    return None
+
+def available_memory_mb():
+    """Memory available for new processes, in MB: what is left under the cgroup or SLURM memory limit of
+    this job, or else the node's MemAvailable (Linux)."""
+    limits = [memory_mb for memory_mb in (cgroup_memory_mb(), slurm_memory_mb()) if memory_mb is not None]
+    if limits:
+        return min(limits)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def plan_workers(heap_mb=ALIGN_HEAP_MB, requested=ALIGN_WORKERS):
+    """Number of JVM workers that fit in the available cores and memory, unless set explicitly."""
+    if requested > 0:
+        return requested
+    workers = usable_cpus()
+    memory_mb = available_memory_mb()
+    if memory_mb is not None:
+        workers = min(workers, int(memory_mb * MEMORY_FRACTION) // (heap_mb + JVM_OVERHEAD_MB))
+    return max(1, workers)
+
+def gene_size(gene_dir):
+    """Combined size in bytes of a gene's CDS (files or packed store), used as a proxy for its alignment cost."""
+    return cds_store.gene_size(gene_dir)
+
+def longest_first(gene_dirs):
+    """Return (gene_dir, size) pairs with the largest genes first, so they do not start last and
+    leave a long tail of idle workers (longest-processing-time-first scheduling)."""
+    # Ties are broken by path so that every shard of a cluster run computes the same order.
+    return sorted(((gene_dir, gene_size(gene_dir)) for gene_dir in gene_dirs), key=lambda item: (-item[1], item[0]))
+
+def gene_timeout(size, fixed=0):
+    """Seconds allowed to align a gene of `size` bytes; a non-zero `fixed` timeout takes precedence."""
+    if fixed > 0:
+        return fixed
+    return ALIGN_TIMEOUT_BASE + ALIGN_TIMEOUT_PER_KB * size / 1024
@@ -0,0 +1,214 @@
+"""Per-gene, per-stage timing spans written as JSON lines, and a report of them.
+
+Every process appends its spans to its own file, temp/telemetry/{run}/{host}-{pid}.jsonl, so the
+worker processes of a step (and the tasks of a SLURM array) never write to the same file. All the
+scripts started by one `mastercode.py` run share the run name in TELEMETRY_RUN.
+
+    python scripts/telemetry.py                  # report of the last run
+    python scripts/telemetry.py --run 20240501-101500 --top 30
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+temp_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'temp')
+# Directory of the span files, or "off" to disable telemetry.
+TELEMETRY = os.environ.get('TELEMETRY', os.path.join(temp_directory, 'telemetry'))
+# Name of the run the spans belong to; inherited by every process started from this one.
+TELEMETRY_RUN = os.environ.setdefault('TELEMETRY_RUN', time.strftime('%Y%m%d-%H%M%S'))
+HOST = socket.gethostname()
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+class SpanWriter:
+    """Appends spans to the file of the current process, reopened after a fork."""
+
+    def __init__(self, directory=TELEMETRY, run=TELEMETRY_RUN):
+        self.enabled = bool(directory) and directory.lower() != 'off'
+        self.directory = os.path.join(directory, run) if self.enabled else None
+        self.run = run
+        self.pid = None
+        self.file = None
+        self.lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # A worker forked while another thread (e.g. the fetch thread of the streaming mode) was writing
+            # a span would otherwise inherit the lock held, and block on its first span
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if not self.enabled:
+            return
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.pid != os.getpid():
+                # First span of this process (or of a forked worker, which must not share its parent's file)
+                os.makedirs(self.directory, exist_ok=True)
+                self.pid = os.getpid()
+                self.file = open(os.path.join(self.directory, f'{HOST}-{self.pid}.jsonl'), 'a', buffering=1)
+            self.file.write(line)
+
+writer = SpanWriter()
+
+def emit(stage, gene=None, start=None, wall=0.0, **fields):
+    """Record a span measured by the caller; `start` is a time.time() timestamp (default: now - wall)."""
+    record = {'run': writer.run, 'stage': stage, 'gene': gene,
+              'start': round(start if start is not None else time.time() - wall, 6), 'wall': round(wall, 6),
+              'pid': os.getpid(), 'host': HOST}
+    record.update(fields)
+    writer.write(record)
+
+@contextmanager
+def span(stage, gene=None, **fields):
+    """Time the enclosed block (wall and CPU time of the calling thread) and record it as a span.
+
+    Yields the dict of extra fields, so the block can add measurements; a span whose block raises
+    is recorded with an "error" field.
+    """
+    start, wall_start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
+    try:
+        yield fields
+    except BaseException as e:
+        fields['error'] = type(e).__name__
+        raise
+    finally:
+        if writer.enabled:
+            emit(stage, gene, start, time.perf_counter() - wall_start,
+                 cpu=round(time.thread_time() - cpu_start, 6), **fields)
+
+def process_usage(pid):
+    """(CPU seconds, peak RSS in MB) of a running process, from /proc; None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the command name, which is in parentheses and may contain spaces
+            values = f.read().rsplit(')', 1)[1].split()
+        peak_kb = 0
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak_kb = int(line.split()[1])
+        return (int(values[11]) + int(values[12])) / CLOCK_TICKS, peak_kb / 1024
+    except (OSError, IndexError, ValueError):
+        return None
+
+def reset_peak_rss(pid):
+    """Reset the peak RSS (VmHWM) of a running process to its current RSS, so that process_usage() then
+    reports the peak since the reset; False where the kernel does not allow it (no /proc, Linux < 4.0)."""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def read_spans(directory):
+    spans = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.jsonl'):
+            with open(os.path.join(directory, name)) as f:
+                # A process killed mid-write may leave a truncated last line
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        pass
+    return spans
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def bar(value, largest, width=40):
+    return '#' * max(1 if value else 0, round(width * value / largest)) if largest else ''
+
+def report(spans, top=20, buckets=12):
+    """Print stage totals and histograms, the slowest genes, HTTP endpoints and throughput over time."""
+    by_stage = defaultdict(list)
+    for record in spans:
+        by_stage[record['stage']].append(record)
+    run_start = min(record['start'] for record in spans)
+    run_end = max(record['start'] + record['wall'] for record in spans)
+    print(f"{len(spans)} spans from {len({(r['host'], r['pid']) for r in spans})} processes, "
+          f"{run_end - run_start:.1f} s")
+
+    print("\nStages (seconds):")
+    print(f"{'stage':>8} {'spans':>7} {'total':>9} {'cpu':>9} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} errors")
+    for stage, records in by_stage.items():
+        walls = sorted(record['wall'] for record in records)
+        cpu = sum(record.get('cpu', 0) for record in records)
+        errors = sum('error' in record for record in records)
+        print(f"{stage:>8} {len(walls):>7} {sum(walls):>9.1f} {cpu:>9.1f} {percentile(walls, 0.5):>8.3f} "
+              f"{percentile(walls, 0.9):>8.3f} {percentile(walls, 0.99):>8.3f} {walls[-1]:>8.3f} {errors}")
+
+    for stage, records in by_stage.items():
+        # Power-of-two buckets from 1 ms
+        histogram = Counter(max(0, int(record['wall'] * 1000).bit_length()) for record in records)
+        largest = max(histogram.values())
+        print(f"\n{stage} duration histogram:")
+        for bucket in range(min(histogram), max(histogram) + 1):
+            upper = (1 << bucket) / 1000
+            print(f"  < {upper:>9.3f} s {histogram[bucket]:>7} {bar(histogram[bucket], largest)}")
+
+    genes = defaultdict(Counter)
+    for record in spans:
+        if record.get('gene'):
+            genes[record['gene']][record['stage']] += record['wall']
+    if genes:
+        stages = [stage for stage in by_stage if any(stage in times for times in genes.values())]
+        print("\nSlowest genes (seconds, all stages):")
+        print(f"{'gene':>20} {'total':>9} " + ' '.join(f"{stage:>8}" for stage in stages))
+        for gene, times in sorted(genes.items(), key=lambda item: -sum(item[1].values()))[:top]:
+            print(f"{gene:>20} {sum(times.values()):>9.2f} " + ' '.join(f"{times[stage]:>8.2f}" for stage in stages))
+        align = [r for r in by_stage.get('align', []) if r.get('peak_rss_mb')]
+        if align:
+            print("\nLargest MACSE memory peaks:")
+            for record in sorted(align, key=lambda r: -r['peak_rss_mb'])[:min(top, 5)]:
+                print(f"{record['gene']:>20} {record['peak_rss_mb']:>8.0f} MB, {record['wall']:.1f} s wall, "
+                      f"{record.get('macse_cpu', 0):.1f} s CPU")
+
+    http = by_stage.get('http', [])
+    if http:
+        print("\nHTTP endpoints:")
+        print(f"{'endpoint':>24} {'requests':>9} {'retries':>8} {'MB':>8} {'p50 s':>7} {'p90 s':>7} {'wait s':>8}")
+        endpoints = defaultdict(list)
+        for record in http:
+            endpoints[record.get('endpoint', '?')].append(record)
+        for endpoint, records in sorted(endpoints.items(), key=lambda item: -sum(r['wall'] for r in item[1])):
+            walls = sorted(record['wall'] for record in records)
+            print(f"{endpoint:>24} {len(records):>9} {sum(r.get('retries', 0) for r in records):>8} "
+                  f"{sum(r.get('bytes', 0) for r in records) / 1e6:>8.2f} {percentile(walls, 0.5):>7.3f} "
+                  f"{percentile(walls, 0.9):>7.3f} {sum(r.get('wait', 0) for r in records):>8.1f}")
+
+    width = max((run_end - run_start) / buckets, 1e-6)
+    print(f"\nThroughput over time (spans completed per second, {width:.1f} s buckets):")
+    print(f"{'from s':>8} " + ' '.join(f"{stage:>8}" for stage in by_stage))
+    completed = {stage: Counter(min(buckets - 1, int((r['start'] + r['wall'] - run_start) / width)) for r in records)
+                 for stage, records in by_stage.items()}
+    for bucket in range(buckets):
+        print(f"{bucket * width:>8.1f} " + ' '.join(f"{completed[stage][bucket] / width:>8.2f}" for stage in by_stage))
+
+def main():
+    parser = argparse.ArgumentParser(description="Report on the telemetry spans of a run.")
+    parser.add_argument('--run', help="Run name (a directory of temp/telemetry); default: the last run.")
+    parser.add_argument('--top', type=int, default=20, help="Number of slowest genes to list.")
+    parser.add_argument('--buckets', type=int, default=12, help="Number of time buckets for the throughput table.")
+    args = parser.parse_args()
+    if not writer.enabled or not os.path.isdir(TELEMETRY):
+        print(f"No telemetry found in {TELEMETRY}")
+        return
+    runs = [name for name in os.listdir(TELEMETRY) if os.path.isdir(os.path.join(TELEMETRY, name))]
+    run = args.run or max(runs, key=lambda name: os.path.getmtime(os.path.join(TELEMETRY, name)), default=None)
+    spans = read_spans(os.path.join(TELEMETRY, run)) if run else []
+    if not spans:
+        print(f"No spans recorded for run {run}")
+        return
+    print(f"Run {run}: ", end='')
+    report(spans, args.top, args.buckets)
+
+if __name__ == "__main__":
+    main()